@@ -0,0 +1,46 @@
+# backend/api/debug.py
+# On-demand profiling (backend/core/profiling.py). Mounted by backend/main.py
+# only when PROFILING_ENABLED is set; never expose it on a public replica.
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel
+
+from backend.core.profiling import get_request_profiler, profile_path
+
+router = APIRouter()
+
+
+class ProfileToggle(BaseModel):
+    # Profile the next N requests whose path starts with path_prefix; 0 disarms
+    requests: int = 1
+    path_prefix: str = "/api/"
+
+
+@router.get("/debug/profile")
+def profile_state():
+    """Whether profiling is armed, the last profile's summary and the profiles on disk."""
+    return get_request_profiler().state()
+
+
+@router.post("/debug/profile")
+def arm_profile(toggle: ProfileToggle):
+    """Arms request profiling without touching the client: e.g. the next /api/upload."""
+    if toggle.requests < 0:
+        raise HTTPException(status_code=400, detail="requests must be >= 0")
+    profiler = get_request_profiler()
+    profiler.arm(toggle.requests, toggle.path_prefix)
+    return profiler.state()
+
+
+@router.get("/debug/profile/{profile_id}", response_class=PlainTextResponse)
+def get_profile(profile_id: str):
+    """
+    A profile as collapsed stacks, ready for flamegraph.pl, speedscope or
+    inferno-flamegraph.
+    """
+    try:
+        path = profile_path(profile_id)
+        with open(path, encoding="utf-8") as f:
+            return f.read()
+    except (ValueError, FileNotFoundError):
+        raise HTTPException(status_code=404, detail="Profile not found")
@@ -0,0 +1,121 @@
+# backend/api/ocr_jobs.py
+# Queued ingestion: uploads are stored and handed to OCR worker processes
+# (backend/scripts/ocr_worker.py) through the ocr_jobs table. Nothing here
+# runs OCR, so this router is mounted on every replica role.
+from fastapi import APIRouter, File, UploadFile, HTTPException, Depends, Query
+from pydantic import BaseModel
+from typing import Optional, Dict, Any
+import datetime
+import logging
+
+# Local imports
+from backend.core.jobs import OCR_JOB_MAX_ATTEMPTS
+from backend.core.logs import request_id_var
+from backend.core.storage import get_storage
+from backend.core.validation import UploadRejected, validate_upload
+from backend.db.database import get_db
+from backend.db import crud
+from sqlalchemy.orm import Session
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+storage = get_storage()
+
+
+class OcrJobResponse(BaseModel):
+    id: int
+    status: str
+    filename: str
+    content_type: str
+    attempts: int
+    max_attempts: int
+    available_at: Optional[datetime.datetime] = None
+    lease_owner: Optional[str] = None
+    lease_expires_at: Optional[datetime.datetime] = None
+    last_error: Optional[str] = None
+    receipt_id: Optional[int] = None
+    created_at: Optional[datetime.datetime] = None
+    finished_at: Optional[datetime.datetime] = None
+
+    class Config:
+        from_attributes = True
+
+
+@router.post("/ocr-jobs", response_model=OcrJobResponse, status_code=202)
+def enqueue_upload(
+    file: UploadFile = File(...),
+    reuse_duplicate_ocr: bool = Query(False, description="Reuse the OCR text of a near-duplicate receipt instead of running OCR"),
+    source: Optional[str] = Query(None, description="Uploading client or account; its OCR language choice is cached"),
+    db: Session = Depends(get_db)
+):
+    """
+    Store an upload and queue it for OCR. Poll GET /ocr-jobs/{id} for the receipt id.
+    Uploads are validated (real type, pixel and page budgets) before they are queued.
+    """
+    try:
+        stream, inspection = validate_upload(file.file, file.content_type)
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.reason)
+    try:
+        blob = storage.save(stream)
+    except IOError as e:
+        raise HTTPException(status_code=500, detail=f"Could not save file: {e}")
+    try:
+        job = crud.enqueue_ocr_job(
+            db,
+            filename=file.filename,
+            content_type=inspection.content_type,
+            saved_path=blob.path,
+            content_hash=blob.digest,
+            blob_size=blob.size,
+            source=source,
+            reuse_duplicate_ocr=reuse_duplicate_ocr,
+            max_attempts=OCR_JOB_MAX_ATTEMPTS,
+            request_id=request_id_var.get()
+        )
+    except Exception as e:
+        logger.exception("Database error while queueing OCR job")
+        db.rollback()  # the failed flush / commit left the session unusable
+        if blob.created and not crud.get_blob(db, blob.digest):
+            storage.delete(blob.digest)
+        raise HTTPException(status_code=500, detail=f"Failed to queue upload: {e}")
+    if not storage.exists(blob.digest):
+        # Removed by a delete of identical content before the job's reference was committed
+        stream.seek(0)
+        storage.save(stream)
+    return job
+
+
+@router.get("/ocr-jobs/stats", response_model=Dict[str, Any])
+def get_ocr_queue_stats(db: Session = Depends(get_db)):
+    """
+    Job counts per status and the age of the oldest pending job.
+    """
+    return crud.get_ocr_queue_stats(db)
+
+
+@router.get("/ocr-jobs/{job_id}", response_model=OcrJobResponse)
+def get_ocr_job(job_id: int, db: Session = Depends(get_db)):
+    """
+    Get the state of a queued upload.
+    """
+    job = crud.get_ocr_job(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="OCR job not found")
+    return job
+
+
+@router.post("/ocr-jobs/{job_id}/retry", response_model=OcrJobResponse, status_code=202)
+def retry_dead_ocr_job(job_id: int, db: Session = Depends(get_db)):
+    """
+    Re-queue a dead-lettered job with a fresh set of attempts.
+    """
+    job = crud.get_ocr_job(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="OCR job not found")
+    if job.status != "dead":
+        raise HTTPException(status_code=409, detail=f"Only dead-lettered jobs can be retried (job is {job.status})")
+    if not storage.exists(job.content_hash):
+        raise HTTPException(status_code=410, detail="The stored upload for this job no longer exists")
+    return crud.retry_ocr_job(db, job)
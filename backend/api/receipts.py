@@ -0,0 +1,478 @@
+# backend/api/receipts.py
+# Read, correction and analytics endpoints. Nothing here imports the OCR
+# stack, so read-only replicas (APP_ROLE=api) start without it.
+from fastapi import APIRouter, HTTPException, Depends, Query, BackgroundTasks
+from pydantic import BaseModel
+from typing import Optional, Dict, List, Any
+import datetime
+import logging
+import os
+
+# Local imports
+from backend.core.categorizer import get_categorizer
+from backend.core.cleanup import remove_released_files
+from backend.core.fx import BASE_CURRENCY
+from backend.db.database import get_db
+from backend.db import crud
+from sqlalchemy.orm import Session
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+# Most receipts one bulk update or delete request may name
+BULK_MAX_RECEIPTS = int(os.getenv("BULK_MAX_RECEIPTS", "1000"))
+
+
+# Pydantic models for API request/response (keep as is)
+class ReceiptUpdate(BaseModel):
+    filename: Optional[str] = None
+    content_type: Optional[str] = None
+    saved_path: Optional[str] = None
+    vendor: Optional[str] = None
+    transaction_date: Optional[datetime.date] = None
+    amount: Optional[float] = None
+    category: Optional[str] = None
+    currency: Optional[str] = None
+
+    class Config:
+        extra = "ignore"
+        from_attributes = True
+
+
+class BulkReceiptUpdate(ReceiptUpdate):
+    id: int
+
+
+class BulkUpdateRequest(BaseModel):
+    updates: List[BulkReceiptUpdate]
+
+
+class BulkDeleteRequest(BaseModel):
+    ids: List[int]
+
+
+class BulkResult(BaseModel):
+    id: int
+    status: str  # "updated", "unchanged", "deleted" or "not_found"
+    # Deletes only: "removal_scheduled", or "kept_shared" while another receipt uses the file
+    file: Optional[str] = None
+
+
+class BulkResponse(BaseModel):
+    results: List[BulkResult]
+    counts: Dict[str, int]
+
+
+class ReceiptResponse(BaseModel):
+    id: int
+    filename: str
+    content_type: str
+    saved_path: str
+    vendor: Optional[str] = None
+    vendor_id: Optional[int] = None
+    transaction_date: Optional[datetime.date] = None
+    amount: Optional[float] = None
+    category: Optional[str] = None
+    currency: Optional[str] = None
+    currency_code: Optional[str] = None
+    base_amount: Optional[float] = None
+    language: Optional[str] = None
+    anomaly_score: Optional[float] = None
+    anomaly_detail: Optional[str] = None
+    created_at: Optional[datetime.date] = None
+
+    class Config:
+        from_attributes = True
+
+
+class ReceiptPage(BaseModel):
+    items: List[ReceiptResponse]
+    # Pass back as `cursor` for the following page; None on the last page
+    next_cursor: Optional[str] = None
+
+
+class ReceiptSummary(BaseModel):
+    count: int
+    max_id: Optional[int] = None
+    min_date: Optional[datetime.date] = None
+    max_date: Optional[datetime.date] = None
+
+
+class ReceiptItemResponse(BaseModel):
+    receipt_id: int
+    line_no: int
+    description: str
+    quantity: Optional[float] = None
+    unit_price: Optional[float] = None
+    total: Optional[float] = None
+
+    class Config:
+        from_attributes = True
+
+
+class ItemSearchResult(ReceiptItemResponse):
+    vendor: Optional[str] = None
+    transaction_date: Optional[datetime.date] = None
+    currency_code: Optional[str] = None
+
+
+# --- Algorithmic Endpoints (Order is Crucial for Path Matching) ---
+
+# 1. Most specific static path first
+@router.get("/receipts/search", response_model=List[ReceiptResponse])
+def search_receipts_api(
+    keyword: Optional[str] = Query(None, description="Keyword to search in filename, vendor, or category"),
+    min_amount: Optional[float] = Query(None, description="Minimum amount for search"),
+    max_amount: Optional[float] = Query(None, description="Maximum amount for search"),
+    start_date: Optional[datetime.date] = Query(None, description="Start date (YYYY-MM-DD) for transaction date range"),
+    end_date: Optional[datetime.date] = Query(None, description="End date (YYYY-MM-DD) for transaction date range"),
+    vendor_pattern: Optional[str] = Query(None, description="Vendor name pattern (e.g., 'Walmart%')"),
+    min_anomaly_score: Optional[float] = Query(None, ge=0, description="Only receipts whose amount scored at least this unusual"),
+    anomalous_only: bool = Query(False, description="Only receipts flagged as unusual for their vendor or category"),
+    skip: int = 0,
+    limit: int = 100,
+    db: Session = Depends(get_db)
+):
+    """
+    Search receipts based on various criteria like keyword, amount range, date range, or vendor pattern.
+    Anomaly filters return the most unusual amounts first.
+    """
+    logger.debug("Search parameters", extra={
+        "keyword": keyword, "min_amount": min_amount, "max_amount": max_amount,
+        "start_date": start_date, "end_date": end_date, "vendor_pattern": vendor_pattern,
+        "min_anomaly_score": min_anomaly_score, "anomalous_only": anomalous_only, "skip": skip, "limit": limit,
+    })
+
+    receipts = crud.search_receipts(
+        db=db,
+        keyword=keyword,
+        min_amount=min_amount,
+        max_amount=max_amount,
+        start_date=start_date,
+        end_date=end_date,
+        vendor_pattern=vendor_pattern,
+        min_anomaly_score=min_anomaly_score,
+        anomalous_only=anomalous_only,
+        skip=skip,
+        limit=limit
+    )
+    return [ReceiptResponse.model_validate(r) for r in receipts]
+
+@router.post("/receipts/recategorize", response_model=Dict[str, int])
+def recategorize_receipts_api(
+    only_uncategorized: bool = Query(False, description="Only fill in receipts that have no category yet"),
+    db: Session = Depends(get_db)
+):
+    """
+    Re-apply the current category rules to all stored receipts.
+    """
+    return crud.recategorize_receipts(db, get_categorizer(), only_uncategorized=only_uncategorized)
+
+@router.post("/receipts/backfill-base-amounts", response_model=Dict[str, int])
+def backfill_base_amounts_api(
+    only_missing: bool = Query(True, description="Only convert receipts that have no base amount yet; false recomputes all (e.g. after an FX table update)"),
+    db: Session = Depends(get_db)
+):
+    """
+    Convert stored receipt amounts to the base currency using the local FX rate table.
+    """
+    return crud.backfill_base_amounts(db, only_missing=only_missing)
+
+@router.patch("/receipts/bulk", response_model=BulkResponse)
+def bulk_update_receipts_api(request: BulkUpdateRequest, db: Session = Depends(get_db)):
+    """
+    Apply corrections to many receipts in one transaction. Each entry is an
+    id plus the fields to change, as in PUT /receipts/{id}.
+    """
+    if len(request.updates) > BULK_MAX_RECEIPTS:
+        raise HTTPException(status_code=413, detail=f"At most {BULK_MAX_RECEIPTS} receipts per request")
+    results = crud.bulk_update_receipts(db, [u.model_dump(exclude_unset=True) for u in request.updates])
+    return _bulk_response(results)
+
+@router.post("/receipts/bulk-delete", response_model=BulkResponse)
+def bulk_delete_receipts_api(request: BulkDeleteRequest, background_tasks: BackgroundTasks,
+                             db: Session = Depends(get_db)):
+    """
+    Delete many receipts in one transaction. Files no other receipt uses
+    are removed in the background after the response ("removal_scheduled").
+    """
+    if len(request.ids) > BULK_MAX_RECEIPTS:
+        raise HTTPException(status_code=413, detail=f"At most {BULK_MAX_RECEIPTS} receipts per request")
+    results, digests, legacy_paths = crud.bulk_delete_receipts(db, request.ids)
+    if digests or legacy_paths:
+        background_tasks.add_task(remove_released_files, digests, legacy_paths)
+    return _bulk_response(results)
+
+def _bulk_response(results):
+    counts = {}
+    for result in results:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+    return BulkResponse(results=results, counts=counts)
+
+# 2. Next most specific static path
+@router.get("/receipts", response_model=List[ReceiptResponse])
+def get_all_receipts(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+    """
+    Retrieve a list of all receipt records from the database.
+    This endpoint must come BEFORE /receipts/{receipt_id}.
+    """
+    receipts = crud.get_receipts(db, skip=skip, limit=limit)
+    return [ReceiptResponse.model_validate(r) for r in receipts]
+
+@router.get("/receipts/page", response_model=ReceiptPage)
+def get_receipt_page_api(
+    sort_by: str = Query("id", description="Sort column: 'id', 'date', 'amount' or 'vendor'"),
+    sort_order: str = Query("desc", description="Sort order: 'asc' or 'desc'"),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page; omit for the first page"),
+    limit: int = Query(50, ge=1, le=500),
+    db: Session = Depends(get_db)
+):
+    """
+    Page through all receipts in a stable order. Unlike skip/limit, every
+    page costs the same however deep it is; receipts without a value in the
+    sort column come last.
+    """
+    try:
+        receipts, next_cursor = crud.get_receipt_page(db, sort_by=sort_by, sort_order=sort_order,
+                                                      cursor=cursor, limit=limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return ReceiptPage(items=[ReceiptResponse.model_validate(r) for r in receipts], next_cursor=next_cursor)
+
+@router.get("/receipts/summary", response_model=ReceiptSummary)
+def get_receipt_summary_api(db: Session = Depends(get_db)):
+    """
+    Receipt count, transaction date range and highest id, without fetching receipts.
+    """
+    return crud.get_receipt_summary(db)
+
+
+# --- Line item endpoints ---
+
+@router.get("/items/search", response_model=List[ItemSearchResult])
+def search_items_api(
+    q: str = Query(..., description="Words that must all appear in the item description, e.g. 'milk'"),
+    start_date: Optional[datetime.date] = Query(None, description="Start date (YYYY-MM-DD) for transaction date range"),
+    end_date: Optional[datetime.date] = Query(None, description="End date (YYYY-MM-DD) for transaction date range"),
+    skip: int = 0,
+    limit: int = 100,
+    db: Session = Depends(get_db)
+):
+    """
+    Search purchased line items across all receipts.
+    """
+    return crud.search_items(db, q, start_date=start_date, end_date=end_date, skip=skip, limit=limit)
+
+@router.get("/items/spend", response_model=Dict[str, Any])
+def get_item_spend_api(
+    q: str = Query(..., description="Words that must all appear in the item description, e.g. 'milk'"),
+    start_date: Optional[datetime.date] = Query(None, description="Start date (YYYY-MM-DD) for transaction date range"),
+    end_date: Optional[datetime.date] = Query(None, description="End date (YYYY-MM-DD) for transaction date range"),
+    db: Session = Depends(get_db)
+):
+    """
+    Total spend, quantity and receipt count for matching line items, in the base currency.
+    """
+    spend = crud.get_item_spend(db, q, start_date=start_date, end_date=end_date)
+    spend["base_currency"] = BASE_CURRENCY
+    return spend
+
+@router.get("/receipts/{receipt_id}/items", response_model=List[ReceiptItemResponse])
+def get_receipt_items_api(receipt_id: int, db: Session = Depends(get_db)):
+    """
+    Retrieve the line items extracted from one receipt.
+    """
+    if not crud.get_receipt(db, receipt_id):
+        raise HTTPException(status_code=404, detail="Receipt not found")
+    return [ReceiptItemResponse.model_validate(i) for i in crud.get_receipt_items(db, receipt_id)]
+
+# 3. Dynamic path last (because it's more general and can capture other strings)
+@router.get("/receipts/{receipt_id}", response_model=ReceiptResponse)
+def get_single_receipt(receipt_id: int, db: Session = Depends(get_db)):
+    """
+    Retrieve a single receipt record by its ID.
+    """
+    receipt = crud.get_receipt(db, receipt_id)
+    if not receipt:
+        raise HTTPException(status_code=404, detail="Receipt not found")
+    return ReceiptResponse.model_validate(receipt)
+
+# --- Other CRUD and Algorithmic Endpoints (order less critical if they don't conflict with preceding ones) ---
+
+@router.put("/receipts/{receipt_id}", response_model=ReceiptResponse)
+def update_single_receipt(receipt_id: int, update_data: ReceiptUpdate, db: Session = Depends(get_db)):
+    update_data_dict = update_data.model_dump(exclude_unset=True)
+
+    updated_receipt = crud.update_receipt(db, receipt_id, update_data_dict)
+    if not updated_receipt:
+        raise HTTPException(status_code=404, detail="Receipt not found or no changes made")
+    return ReceiptResponse.model_validate(updated_receipt)
+
+@router.delete("/receipts/{receipt_id}", status_code=204)
+def delete_single_receipt(receipt_id: int, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+    results, digests, legacy_paths = crud.bulk_delete_receipts(db, [receipt_id])
+    if results[0]["status"] == "not_found":
+        raise HTTPException(status_code=404, detail="Receipt not found")
+    # Remove the stored file once no receipt references it any more
+    if digests or legacy_paths:
+        background_tasks.add_task(remove_released_files, digests, legacy_paths)
+    return {"message": "Receipt deleted successfully"}
+
+@router.get("/receipts/sort", response_model=List[ReceiptResponse])
+def sort_receipts_api(
+    sort_by: str = Query(..., description="Field to sort by: 'amount', 'date', or 'vendor'"),
+    sort_order: str = Query("asc", description="Sort order: 'asc' or 'desc'"),
+    skip: int = 0,
+    limit: int = 100,
+    db: Session = Depends(get_db)
+):
+    """
+    Sort receipts by a specified field (amount, date, or vendor) and order (ascending/descending).
+    """
+    if sort_by not in ["amount", "date", "vendor"]:
+        raise HTTPException(status_code=400, detail="sort_by must be 'amount', 'date', or 'vendor'")
+    if sort_order not in ["asc", "desc"]:
+        raise HTTPException(status_code=400, detail="sort_order must be 'asc' or 'desc'")
+
+    receipts = crud.sort_receipts(
+        db=db,
+        sort_by=sort_by,
+        sort_order=sort_order,
+        skip=skip,
+        limit=limit
+    )
+    return [ReceiptResponse.model_validate(r) for r in receipts]
+
+@router.get("/analytics/total-spend", response_model=Dict[str, Any])
+def get_total_spend_api(db: Session = Depends(get_db)):
+    """
+    Get the total sum of all receipt amounts, converted to the base currency.
+    """
+    total = crud.get_total_spend(db)
+    return {"total_spend": total, "base_currency": BASE_CURRENCY}
+
+@router.get("/analytics/timeseries", response_model=Dict[str, Any])
+def get_spend_timeseries_api(
+    granularity: str = Query("month", pattern="^(day|week|month|quarter|year)$", description="Bucket size"),
+    category: Optional[str] = Query(None, description="Only this category"),
+    vendor: Optional[str] = Query(None, description="Only this vendor; any spelling, matched to the canonical vendor"),
+    vendor_id: Optional[int] = Query(None, description="Only this canonical vendor id"),
+    currency: Optional[str] = Query(None, description="Only receipts in this currency (code or symbol); adds per-bucket 'amount' in it"),
+    start_date: Optional[datetime.date] = Query(None, description="First day (YYYY-MM-DD); defaults to the first matching receipt"),
+    end_date: Optional[datetime.date] = Query(None, description="Last day (YYYY-MM-DD); defaults to the last matching receipt"),
+    db: Session = Depends(get_db)
+):
+    """
+    Spend per day, week, month, quarter or year in the base currency, with
+    empty buckets filled with zeros. Served from the daily spend rollup.
+    """
+    try:
+        series = crud.get_spend_timeseries(db, granularity=granularity, category=category, vendor=vendor,
+                                           vendor_id=vendor_id, currency=currency, start_date=start_date, end_date=end_date)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    series["base_currency"] = BASE_CURRENCY
+    return series
+
+@router.post("/analytics/timeseries/rebuild", response_model=Dict[str, int])
+def rebuild_spend_rollup_api(db: Session = Depends(get_db)):
+    """
+    Recompute the daily spend rollup behind /analytics/timeseries from the receipts table.
+    """
+    return {"rows": crud.rebuild_daily_spend(db)}
+
+@router.get("/analytics/approx/percentiles", response_model=Dict[str, Any])
+def get_approx_percentiles_api(
+    q: List[float] = Query([0.5, 0.9, 0.99], description="Quantiles between 0 and 1, e.g. q=0.5&q=0.95"),
+    db: Session = Depends(get_db)
+):
+    """
+    Approximate percentiles of receipt amounts (base currency) from a t-digest, in constant time.
+    """
+    if any(not 0 <= value <= 1 for value in q):
+        raise HTTPException(status_code=400, detail="Quantiles must be between 0 and 1")
+    result = crud.get_approx_percentiles(db, q)
+    result["base_currency"] = BASE_CURRENCY
+    return result
+
+@router.get("/analytics/approx/distinct-vendors", response_model=Dict[str, Any])
+def get_approx_distinct_vendors_api(db: Session = Depends(get_db)):
+    """
+    Approximate number of distinct vendors from a HyperLogLog, in constant time.
+    """
+    return crud.get_approx_distinct_vendors(db)
+
+@router.get("/analytics/approx/top-vendors", response_model=Dict[str, Any])
+def get_approx_top_vendors_api(
+    k: int = Query(10, ge=1, le=100, description="Number of vendors"),
+    db: Session = Depends(get_db)
+):
+    """
+    Approximate most frequent vendors from a Count-Min sketch with a top-k heap, in constant time.
+    """
+    return crud.get_approx_top_vendors(db, k)
+
+@router.post("/analytics/approx/rebuild", response_model=Dict[str, int])
+def rebuild_approx_sketches_api(db: Session = Depends(get_db)):
+    """
+    Rebuild the approximate analytics sketches from the receipts table (clears accumulated deletions).
+    """
+    return crud.rebuild_sketches(db)
+
+@router.post("/analytics/anomalies/rebuild", response_model=Dict[str, int])
+def rebuild_spend_stats_api(db: Session = Depends(get_db)):
+    """
+    Recompute the vendor / category spend statistics and re-score every receipt against them.
+    """
+    return crud.rebuild_spend_stats(db)
+
+@router.get("/analytics/spend-statistics", response_model=Dict[str, Optional[float]])
+def get_spend_statistics_api(db: Session = Depends(get_db)):
+    """
+    Get mean, median, and mode of expenditure.
+    """
+    stats = crud.get_spend_statistics(db)
+    return stats
+
+@router.get("/analytics/vendor-frequency", response_model=Dict[str, int])
+def get_vendor_frequency_api(db: Session = Depends(get_db)):
+    """
+    Get the frequency distribution of vendors.
+    """
+    frequency = crud.get_vendor_frequency(db)
+    return frequency
+
+@router.get("/vendors/match", response_model=Dict[str, Any])
+def match_vendor_api(
+    name: str = Query(..., description="Vendor name as printed or OCR'd, e.g. 'WA1MART SUPERCENTER #12'"),
+    db: Session = Depends(get_db)
+):
+    """
+    The canonical vendor a name would be filed under at ingest, without recording anything.
+    """
+    vendor_id = crud.match_vendor(db, name)
+    return {"name": name, "vendor_id": vendor_id,
+            "vendor": crud.vendor_names(db, [vendor_id]).get(vendor_id) if vendor_id is not None else None}
+
+@router.get("/analytics/monthly-spend-trend", response_model=List[Dict[str, Any]])
+def get_monthly_spend_trend_api(db: Session = Depends(get_db)):
+    """
+    Get monthly spend trends.
+    """
+    trend = crud.get_monthly_spend_trend(db)
+    return trend
+
+@router.get("/analytics/yearly-spend-trend", response_model=List[Dict[str, Any]])
+def get_yearly_spend_trend_api(db: Session = Depends(get_db)):
+    """
+    Get yearly spend trends.
+    """
+    return crud.get_yearly_spend_trend(db)
+
+@router.get("/analytics/spend-by-category", response_model=List[Dict[str, Any]])
+def get_spend_by_category_api(db: Session = Depends(get_db)):
+    """
+    Get total spend broken down by category.
+    """
+    spend_by_cat = crud.get_spend_by_category(db)
+    return spend_by_cat
\ No newline at end of file
@@ -0,0 +1,56 @@
+# backend/api/reprocess.py
+# Bulk reprocessing jobs. Mounted alongside the upload router because a job
+# may re-run OCR (see backend/core/reprocess.py).
+from fastapi import APIRouter, HTTPException, Depends, Query, BackgroundTasks
+from typing import Dict, Any
+
+# Local imports
+from backend.core.reprocess import run_job
+from backend.db.database import get_db
+from backend.db import crud
+from sqlalchemy.orm import Session
+
+router = APIRouter()
+
+
+@router.post("/reprocess", response_model=Dict[str, Any], status_code=202)
+def start_reprocess_job(
+    background_tasks: BackgroundTasks,
+    rerun_ocr: bool = Query(False, description="Re-run OCR on the stored file instead of re-parsing stored OCR text"),
+    workers: int = Query(1, ge=1, le=32, description="Number of worker processes"),
+    batch_size: int = Query(500, ge=1, le=10000, description="Receipts read and written per batch"),
+    db: Session = Depends(get_db)
+):
+    """
+    Start a job that re-derives parsed fields for every stored receipt.
+    """
+    job = crud.create_reprocess_job(db, workers=workers, batch_size=batch_size, rerun_ocr=rerun_ocr)
+    background_tasks.add_task(run_job, job.id)
+    return crud.get_reprocess_progress(db, job)
+
+
+@router.get("/reprocess/{job_id}", response_model=Dict[str, Any])
+def get_reprocess_job_progress(job_id: int, db: Session = Depends(get_db)):
+    """
+    Get progress of a reprocessing job, overall and per worker shard.
+    """
+    job = crud.get_reprocess_job(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Reprocess job not found")
+    return crud.get_reprocess_progress(db, job)
+
+
+@router.post("/reprocess/{job_id}/resume", response_model=Dict[str, Any], status_code=202)
+def resume_reprocess_job(job_id: int, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+    """
+    Resume an interrupted or failed job from its last checkpoints.
+    """
+    job = crud.get_reprocess_job(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Reprocess job not found")
+    if job.status == "running":
+        raise HTTPException(status_code=409, detail="Reprocess job is already running")
+    if job.status == "completed":
+        raise HTTPException(status_code=409, detail="Reprocess job has already completed")
+    background_tasks.add_task(run_job, job.id)
+    return crud.get_reprocess_progress(db, job)
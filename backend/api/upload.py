@@ -1,21 +1,31 @@
 # backend/api/upload.py
-from fastapi import APIRouter, File, UploadFile, HTTPException, Depends, Query
+# Ingestion endpoints: everything here runs OCR, so this router is only
+# mounted on replicas whose APP_ROLE includes OCR work (see backend/main.py).
+from fastapi import APIRouter, File, UploadFile, HTTPException, Depends, Query, Request, Header
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from typing import Optional, Dict, List, Any
-import os
-import datetime
+from typing import Optional, Dict, Any, List
+import logging
 
 # Local imports
-from backend.core.ocr import ocr_image, ocr_pdf, parse_receipt_text, parse_text_file
+from backend.core.admission import AdmissionRejected, estimate_cost, get_admission_controller
+from backend.core.cleanup import remove_released_files
+from backend.core.language import OCR_LANGUAGE_PHASH_DISTANCE, remember_language, vendor_hint
+from backend.core.ocr import extract_text_with_details, parse_receipt_text
+from backend.core.phash import compute_phash, PHASH_MAX_DISTANCE
+from backend.core.resumable import UploadSession, UploadSessionError, sweep_expired_sessions
+from backend.core.storage import get_storage
+from backend.core.validation import UploadRejected, apply_downsampling, validate_upload
 from backend.db.database import get_db
 from backend.db import crud
 from sqlalchemy.orm import Session
-from backend.db.models import Receipt as DBReceipt
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
-UPLOAD_DIR = "backend/uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+# Uploads are stored content-addressed under backend/uploads/blobs (see backend/core/storage.py)
+storage = get_storage()
+admission = get_admission_controller()
 
 
 # Pydantic models for API request/response (keep as is)
@@ -26,220 +36,309 @@ class FileUploadResponse(BaseModel):
     saved_path: Optional[str] = None
     parsed_fields: Optional[Dict] = None
     db_record_id: Optional[int] = None
+    duplicate_of: Optional[int] = None
+    duplicate_distance: Optional[int] = None
+    ocr_reused: bool = False
+    # How the text was obtained; for PDFs, per page: "text_layer", "ocr" or "ocr_preprocessed".
+    # "input" describes the file as validated: sniffed type, dimensions / pages, any downsampling.
+    extraction: Optional[Dict[str, Any]] = None
+    # How unusual the amount is for its vendor / category (see backend/core/anomaly.py)
+    anomaly_score: Optional[float] = None
+    anomaly_detail: Optional[str] = None
+
+
+class UploadSessionCreate(BaseModel):
+    filename: str
+    size: int
+    content_type: Optional[str] = None  # as declared; the real type is sniffed on completion
+    chunk_size: Optional[int] = None
+    # Hex sha256 of the whole file, checked on completion if given
+    sha256: Optional[str] = None
 
 
-class ReceiptUpdate(BaseModel):
-    filename: Optional[str] = None
-    content_type: Optional[str] = None
-    saved_path: Optional[str] = None
-    vendor: Optional[str] = None
-    transaction_date: Optional[datetime.date] = None
-    amount: Optional[float] = None
-    category: Optional[str] = None
-    currency: Optional[str] = None
-
-    class Config:
-        extra = "ignore"
-        from_attributes = True
-
-
-class ReceiptResponse(BaseModel):
-    id: int
+class UploadSessionStatus(BaseModel):
+    session_id: str
     filename: str
-    content_type: str
-    saved_path: str
-    vendor: Optional[str] = None
-    transaction_date: Optional[datetime.date] = None
-    amount: Optional[float] = None
-    category: Optional[str] = None
-    currency: Optional[str] = None
-    created_at: Optional[datetime.date] = None
+    size: int
+    chunk_size: int
+    chunk_count: int
+    bytes_received: int
+    missing_chunks: List[int]
+    finalized: bool
+    expires_at: float  # unix time
 
-    class Config:
-        from_attributes = True
 
-
-# --- File Upload Endpoint ---
-@router.post("/upload", response_model=FileUploadResponse)
-async def upload_receipt(file: UploadFile = File(...), db: Session = Depends(get_db)):
-    allowed_types = ["image/jpeg", "image/png", "application/pdf", "text/plain"]
-    if file.content_type not in allowed_types:
-        raise HTTPException(status_code=400, detail=f"Unsupported file type: {file.content_type}")
-
-    file_location = os.path.join(UPLOAD_DIR, file.filename)
+def _save_referenced(stream, db: Session):
+    """
+    Stores the upload and commits a reference on its blob straight away,
+    before OCR, so deleting a receipt with identical content (or the
+    retention policy) can't remove the file while this upload is using it.
+    The reference clears a pending released / purged mark; if the file was
+    already set aside or removed, it is stored again. Release it with
+    _release_upload_blob if the upload fails.
+    """
+    blob = storage.save(stream)
+    try:
+        crud.acquire_blob(db, blob.digest, blob.path, blob.size)
+        db.commit()
+    except Exception:
+        db.rollback()
+        if blob.created and not crud.get_blob(db, blob.digest):
+            storage.delete(blob.digest)
+        raise
+    if not storage.exists(blob.digest):
+        # Removed between the save and the commit above: store it again
+        stream.seek(0)
+        storage.save(stream)
+    return blob
+
+
+def _release_upload_blob(db: Session, blob):
+    """Drops the reference of an upload that failed; removes the file if nothing else uses it."""
+    db.rollback()  # a failed flush / commit leaves the session unusable until rolled back
+    released = crud.release_blob(db, blob.digest)
+    db.commit()
+    if released:
+        remove_released_files([blob.digest])
+
+
+async def _ingest(stream, inspection, reuse_duplicate_ocr: bool, source: Optional[str], db: Session):
+    """
+    Downsamples (if validation deferred it), stores the upload and produces
+    its text. Runs under an admission slot; CPU-heavy steps go to the
+    threadpool so the event loop keeps serving.
+    """
+    content_type = inspection.content_type
+    if inspection.downsample_to:
+        try:
+            stream = await run_in_threadpool(apply_downsampling, stream, inspection)
+        except UploadRejected as e:
+            raise HTTPException(status_code=e.status_code, detail=e.reason)
+
+    # Content-addressed: identical uploads share one blob, different files never collide
     try:
-        with open(file_location, "wb") as f:
-            f.write(await file.read())
-    except IOError as e:
+        blob = await run_in_threadpool(_save_referenced, stream, db)  # hashes and writes the whole file
+    except Exception as e:
         raise HTTPException(status_code=500, detail=f"Could not save file: {e}")
+    file_location = blob.path
 
-    text = ""
-    if file.content_type in ["image/jpeg", "image/png"]:
-        text = ocr_image(file_location)
-    elif file.content_type == "application/pdf":
-        text = ocr_pdf(file_location)
-    elif file.content_type == "text/plain":
-        text = parse_text_file(file_location)
+    try:
+        # Perceptual hash catches re-photographed / re-scanned copies of the same receipt
+        phash = await run_in_threadpool(compute_phash, file_location, content_type)
+        duplicate, duplicate_distance, similar = None, None, None
+        if phash is not None:
+            # One probe finds a near-duplicate and any similar-looking receipt to take an OCR model from
+            match = crud.find_near_duplicate(db, phash, max(PHASH_MAX_DISTANCE, OCR_LANGUAGE_PHASH_DISTANCE))
+            if match:
+                similar = match[0]
+                if match[1] <= PHASH_MAX_DISTANCE:
+                    duplicate, duplicate_distance = match
+
+        text = ""
+        ocr_reused = False
+        if reuse_duplicate_ocr and duplicate is not None and duplicate.ocr_text:
+            text = duplicate.ocr_text
+            ocr_reused = True
+            extraction = {"method": "reused_duplicate", "language": duplicate.language}
+        else:
+            vendor = vendor_hint(similar.vendor, similar.language) if similar is not None else None
+            text, extraction = await run_in_threadpool(
+                extract_text_with_details, file_location, content_type, vendor=vendor, source=source
+            )
+    except BaseException:
+        _release_upload_blob(db, blob)
+        raise
+    return blob, phash, duplicate, duplicate_distance, text, ocr_reused, extraction
+
+
+async def _process_upload(stream, filename: str, declared_type: Optional[str],
+                          reuse_duplicate_ocr: bool, source: Optional[str], db: Session) -> FileUploadResponse:
+    """
+    Validation, admission, OCR, parsing and the database write for one
+    uploaded file, whether it arrived in one request or in chunks.
+    """
+    # The real type comes from the magic bytes, and the pixel / page budgets
+    # are checked from headers, before anything is decoded. Oversized
+    # images are only flagged here: downsampling decodes the whole bitmap,
+    # so it waits for admission like OCR does (see _ingest).
+    try:
+        stream, inspection = await run_in_threadpool(validate_upload, stream, declared_type, downsample=False)
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.reason)
+    content_type = inspection.content_type
+
+    # Admission control: estimate OCR cost from the same headers, then wait
+    # for capacity in a bounded priority queue or shed load with 429.
+    cost, priority = estimate_cost(inspection)
+    try:
+        async with admission.admit(cost, priority):
+            blob, phash, duplicate, duplicate_distance, text, ocr_reused, extraction = await _ingest(
+                stream, inspection, reuse_duplicate_ocr, source, db
+            )
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=429,
+            detail=f"Server busy: {e.reason}. Please retry later.",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    file_location = blob.path
+    extraction["input"] = inspection.describe()
 
-    parsed_data = parse_receipt_text(text)
+    try:
+        parsed_data = parse_receipt_text(text)
+        parsed_data["language"] = extraction.get("language")
+        # Later receipts from this vendor go straight to the same OCR model
+        remember_language(parsed_data["language"], vendor=parsed_data.get("vendor"))
+    except BaseException:
+        _release_upload_blob(db, blob)
+        raise
 
     try:
         db_receipt = crud.create_receipt(
             db=db,
-            filename=file.filename,
-            content_type=file.content_type,
+            filename=filename,
+            content_type=content_type,
             saved_path=file_location,
-            parsed_data=parsed_data
+            parsed_data=parsed_data,
+            ocr_text=text,
+            phash=phash,
+            content_hash=blob.digest,
+            blob_size=blob.size,
+            blob_acquired=True
         )
     except Exception as e:
-        print(f"Database error during receipt creation: {e}")
+        logger.exception("Database error during receipt creation")
+        _release_upload_blob(db, blob)
         raise HTTPException(status_code=500, detail=f"Failed to save receipt to database: {e}")
 
+    message = "File uploaded and parsed successfully!"
+    if duplicate is not None:
+        message = f"File uploaded and parsed. Likely duplicate of receipt {duplicate.id}."
+
     return FileUploadResponse(
-        filename=file.filename,
-        content_type=file.content_type,
-        message="File uploaded and parsed successfully!",
+        filename=filename,
+        content_type=content_type,
+        message=message,
         saved_path=file_location,
         parsed_fields=parsed_data,
-        db_record_id=db_receipt.id
+        db_record_id=db_receipt.id,
+        duplicate_of=duplicate.id if duplicate is not None else None,
+        duplicate_distance=duplicate_distance,
+        ocr_reused=ocr_reused,
+        extraction=extraction,
+        anomaly_score=db_receipt.anomaly_score,
+        anomaly_detail=db_receipt.anomaly_detail
     )
 
-# --- Algorithmic Endpoints (Order is Crucial for Path Matching) ---
-
-# 1. Most specific static path first
-@router.get("/receipts/search", response_model=List[ReceiptResponse])
-def search_receipts_api(
-    keyword: Optional[str] = Query(None, description="Keyword to search in filename, vendor, or category"),
-    min_amount: Optional[float] = Query(None, description="Minimum amount for search"),
-    max_amount: Optional[float] = Query(None, description="Maximum amount for search"),
-    start_date: Optional[datetime.date] = Query(None, description="Start date (YYYY-MM-DD) for transaction date range"),
-    end_date: Optional[datetime.date] = Query(None, description="End date (YYYY-MM-DD) for transaction date range"),
-    vendor_pattern: Optional[str] = Query(None, description="Vendor name pattern (e.g., 'Walmart%')"),
-    skip: int = 0,
-    limit: int = 100,
-    db: Session = Depends(get_db)
-):
-    """
-    Search receipts based on various criteria like keyword, amount range, date range, or vendor pattern.
-    """
-    print(f"Received search parameters: keyword={keyword}, min_amount={min_amount}, max_amount={max_amount}, "
-          f"start_date={start_date}, end_date={end_date}, vendor_pattern={vendor_pattern}, "
-          f"skip={skip}, limit={limit}")
-
-    receipts = crud.search_receipts(
-        db=db,
-        keyword=keyword,
-        min_amount=min_amount,
-        max_amount=max_amount,
-        start_date=start_date,
-        end_date=end_date,
-        vendor_pattern=vendor_pattern,
-        skip=skip,
-        limit=limit
-    )
-    return [ReceiptResponse.model_validate(r) for r in receipts]
 
-# 2. Next most specific static path
-@router.get("/receipts", response_model=List[ReceiptResponse])
-def get_all_receipts(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    """
-    Retrieve a list of all receipt records from the database.
-    This endpoint must come BEFORE /receipts/{receipt_id}.
-    """
-    receipts = crud.get_receipts(db, skip=skip, limit=limit)
-    return [ReceiptResponse.model_validate(r) for r in receipts]
-
-
-# 3. Dynamic path last (because it's more general and can capture other strings)
-@router.get("/receipts/{receipt_id}", response_model=ReceiptResponse)
-def get_single_receipt(receipt_id: int, db: Session = Depends(get_db)):
-    """
-    Retrieve a single receipt record by its ID.
-    """
-    receipt = crud.get_receipt(db, receipt_id)
-    if not receipt:
-        raise HTTPException(status_code=404, detail="Receipt not found")
-    return ReceiptResponse.model_validate(receipt)
-
-# --- Other CRUD and Algorithmic Endpoints (order less critical if they don't conflict with preceding ones) ---
-
-@router.put("/receipts/{receipt_id}", response_model=ReceiptResponse)
-def update_single_receipt(receipt_id: int, update_data: ReceiptUpdate, db: Session = Depends(get_db)):
-    update_data_dict = update_data.model_dump(exclude_unset=True)
-
-    updated_receipt = crud.update_receipt(db, receipt_id, update_data_dict)
-    if not updated_receipt:
-        raise HTTPException(status_code=404, detail="Receipt not found or no changes made")
-    return ReceiptResponse.model_validate(updated_receipt)
-
-@router.delete("/receipts/{receipt_id}", status_code=204)
-def delete_single_receipt(receipt_id: int, db: Session = Depends(get_db)):
-    success = crud.delete_receipt(db, receipt_id)
-    if not success:
-        raise HTTPException(status_code=404, detail="Receipt not found")
-    return {"message": "Receipt deleted successfully"}
-
-@router.get("/receipts/sort", response_model=List[ReceiptResponse])
-def sort_receipts_api(
-    sort_by: str = Query(..., description="Field to sort by: 'amount', 'date', or 'vendor'"),
-    sort_order: str = Query("asc", description="Sort order: 'asc' or 'desc'"),
-    skip: int = 0,
-    limit: int = 100,
+# --- File Upload Endpoint ---
+@router.post("/upload", response_model=FileUploadResponse)
+async def upload_receipt(
+    file: UploadFile = File(...),
+    reuse_duplicate_ocr: bool = Query(False, description="Reuse the OCR text of a near-duplicate receipt instead of running OCR"),
+    source: Optional[str] = Query(None, description="Uploading client or account; its OCR language choice is cached"),
     db: Session = Depends(get_db)
 ):
-    """
-    Sort receipts by a specified field (amount, date, or vendor) and order (ascending/descending).
-    """
-    if sort_by not in ["amount", "date", "vendor"]:
-        raise HTTPException(status_code=400, detail="sort_by must be 'amount', 'date', or 'vendor'")
-    if sort_order not in ["asc", "desc"]:
-        raise HTTPException(status_code=400, detail="sort_order must be 'asc' or 'desc'")
+    return await _process_upload(file.file, file.filename, file.content_type, reuse_duplicate_ocr, source, db)
 
-    receipts = crud.sort_receipts(
-        db=db,
-        sort_by=sort_by,
-        sort_order=sort_order,
-        skip=skip,
-        limit=limit
-    )
-    return [ReceiptResponse.model_validate(r) for r in receipts]
 
-@router.get("/analytics/total-spend", response_model=Dict[str, float])
-def get_total_spend_api(db: Session = Depends(get_db)):
+# --- Resumable (chunked) uploads: see backend/core/resumable.py ---
+@router.post("/uploads", response_model=UploadSessionStatus, status_code=201)
+def create_upload_session(body: UploadSessionCreate):
     """
-    Get the total sum of all receipt amounts.
+    Open a resumable upload. Send the file with PUT /uploads/{session_id}?offset=...
+    in chunks of the returned chunk_size, then POST /uploads/{session_id}/complete.
     """
-    total = crud.get_total_spend(db)
-    return {"total_spend": total}
-
-@router.get("/analytics/spend-statistics", response_model=Dict[str, Optional[float]])
-def get_spend_statistics_api(db: Session = Depends(get_db)):
+    sweep_expired_sessions()
+    try:
+        session = UploadSession.create(body.filename, body.content_type, body.size,
+                                       chunk_size=body.chunk_size, sha256=body.sha256)
+    except UploadSessionError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.reason)
+    return session.status()
+
+@router.put("/uploads/{session_id}", response_model=UploadSessionStatus)
+async def put_upload_chunk(
+    session_id: str,
+    request: Request,
+    offset: int = Query(..., description="Byte offset of the chunk; a multiple of the session's chunk_size"),
+    chunk_sha256: Optional[str] = Header(None, alias="X-Chunk-SHA256", description="Rejects the chunk if its bytes differ"),
+):
     """
-    Get mean, median, and mode of expenditure.
+    Store one chunk. Chunks may be sent in any order, concurrently, and
+    again after a failure: resending a chunk is harmless.
     """
-    stats = crud.get_spend_statistics(db)
-    return stats
+    try:
+        session = UploadSession.load(session_id)
+        index = session.chunk_index(offset)
+    except UploadSessionError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.reason)
+    expected = session.chunk_length(index)
+    data = bytearray()
+    async for piece in request.stream():
+        data += piece
+        if len(data) > expected:
+            raise HTTPException(status_code=400, detail=f"Chunk {index} must be {expected} bytes")
+    try:
+        await run_in_threadpool(session.write_chunk, index, bytes(data), chunk_sha256)
+    except UploadSessionError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.reason)
+    return session.status()
 
-@router.get("/analytics/vendor-frequency", response_model=Dict[str, int])
-def get_vendor_frequency_api(db: Session = Depends(get_db)):
+@router.get("/uploads/{session_id}", response_model=UploadSessionStatus)
+def get_upload_session(session_id: str):
     """
-    Get the frequency distribution of vendors.
+    Progress of a resumable upload; resume by sending its missing_chunks.
     """
-    frequency = crud.get_vendor_frequency(db)
-    return frequency
+    try:
+        return UploadSession.load(session_id).status()
+    except UploadSessionError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.reason)
 
-@router.get("/analytics/monthly-spend-trend", response_model=List[Dict[str, Any]])
-def get_monthly_spend_trend_api(db: Session = Depends(get_db)):
+@router.delete("/uploads/{session_id}", status_code=204)
+def abort_upload_session(session_id: str):
+    try:
+        UploadSession.load(session_id).discard()
+    except UploadSessionError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.reason)
+
+@router.post("/uploads/{session_id}/complete", response_model=FileUploadResponse)
+async def complete_upload_session(
+    session_id: str,
+    reuse_duplicate_ocr: bool = Query(False, description="Reuse the OCR text of a near-duplicate receipt instead of running OCR"),
+    source: Optional[str] = Query(None, description="Uploading client or account; its OCR language choice is cached"),
+    db: Session = Depends(get_db)
+):
     """
-    Get monthly spend trends.
+    Assemble the chunks and process the file like POST /upload. Calling it
+    again after success returns the same result without a second receipt.
     """
-    trend = crud.get_monthly_spend_trend(db)
-    return trend
-
-@router.get("/analytics/spend-by-category", response_model=List[Dict[str, Any]])
-def get_spend_by_category_api(db: Session = Depends(get_db)):
+    try:
+        session = UploadSession.load(session_id)
+        previous = session.result()
+        if previous is not None:
+            return FileUploadResponse(**previous)
+        stream = await run_in_threadpool(session.begin_finalize)
+    except UploadSessionError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.reason)
+    try:
+        response = await _process_upload(stream, session.meta["filename"], session.meta["content_type"],
+                                         reuse_duplicate_ocr, source, db)
+    except Exception as e:
+        stream.close()
+        if isinstance(e, HTTPException) and e.status_code not in (429, 500):
+            session.discard()  # the file itself was rejected
+        else:
+            session.end_finalize()  # transient: the same session can be completed later
+        raise
+    stream.close()
+    session.end_finalize(response.model_dump(mode="json"))
+    return response
+
+
+@router.get("/upload/admission", response_model=Dict[str, Any])
+def get_admission_stats():
     """
-    Get total spend broken down by category.
+    Current OCR admission state: capacity in use, queue depth and rejections.
     """
-    spend_by_cat = crud.get_spend_by_category(db)
-    return spend_by_cat
\ No newline at end of file
+    return admission.stats()
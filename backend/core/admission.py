@@ -0,0 +1,176 @@
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+
+# Cost units: 1 unit ~ OCR of a one-megapixel image. A CPU core is budgeted
+# about one phone photo (~12 MP) at a time.
+OCR_CAPACITY_UNITS = float(os.getenv("OCR_CAPACITY_UNITS", str((os.cpu_count() or 1) * 12)))
+# Uploads allowed to wait for capacity before new ones are rejected with 429.
+OCR_MAX_QUEUE = int(os.getenv("OCR_MAX_QUEUE", "32"))
+# Longest an admitted-to-queue upload waits before giving up with 429.
+OCR_MAX_WAIT_SECONDS = float(os.getenv("OCR_MAX_WAIT_SECONDS", "30"))
+
+# Lower value = served first. Plain text skips OCR entirely, so it jumps the queue.
+PRIORITY_TEXT = 0
+PRIORITY_DOCUMENT = 1
+
+TEXT_COST = 0.05
+# pdf2image renders at 200 dpi: an A4/Letter page is roughly 4 MP
+PDF_PAGE_COST = 4.0
+UNKNOWN_IMAGE_COST = 12.0
+# Decoding and resizing an oversized image before its OCR, per megapixel of the original
+DOWNSAMPLE_COST_PER_MEGAPIXEL = 0.1
+
+
+class AdmissionRejected(Exception):
+    """Raised when an upload can't be admitted; carries a Retry-After hint in seconds."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def estimate_cost(inspection):
+    """
+    (cost_units, priority) for an upload from its UploadInspection
+    (backend/core/validation.py): page count and page size, or pixel
+    dimensions. Only headers were inspected; nothing is rasterised.
+    """
+    if inspection.content_type == "text/plain":
+        return TEXT_COST, PRIORITY_TEXT
+    if inspection.content_type == "application/pdf":
+        page_cost = inspection.page_megapixels or PDF_PAGE_COST
+        return (inspection.pages or 1) * page_cost, PRIORITY_DOCUMENT
+    if inspection.megapixels is None:
+        return UNKNOWN_IMAGE_COST, PRIORITY_DOCUMENT
+    if inspection.downsample_to:
+        # OCR sees the downsampled image, but the original is decoded in full first
+        ocr_cost = min(inspection.megapixels, inspection.downsample_to)
+        return ocr_cost + inspection.megapixels * DOWNSAMPLE_COST_PER_MEGAPIXEL, PRIORITY_DOCUMENT
+    return max(inspection.megapixels, 1.0), PRIORITY_DOCUMENT
+
+
+class AdmissionController:
+    """
+    Weighted admission control for OCR work in one process.
+
+    Uploads reserve their estimated cost against a fixed capacity. When the
+    capacity is used up they wait in a bounded priority queue (priority, then
+    arrival order). A full queue or an over-long wait raises
+    AdmissionRejected with a Retry-After estimate based on recently
+    observed seconds per cost unit.
+    """
+
+    def __init__(self, capacity=OCR_CAPACITY_UNITS, max_queue=OCR_MAX_QUEUE, max_wait=OCR_MAX_WAIT_SECONDS):
+        self.capacity = capacity
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.in_use = 0.0
+        self.admitted = 0
+        self.rejected = 0
+        self._queue = []  # heap of [priority, seq, cost, future]
+        self._queued = 0
+        self._queued_cost = 0.0
+        self._seq = itertools.count()
+        self._seconds_per_unit = 1.0
+
+    def retry_after(self):
+        backlog = self.in_use + self._queued_cost
+        return max(1, math.ceil(backlog / self.capacity * self._seconds_per_unit))
+
+    def _reject(self, reason):
+        self.rejected += 1
+        raise AdmissionRejected(reason, self.retry_after())
+
+    def _dispatch(self):
+        while self._queue:
+            priority, seq, cost, future = self._queue[0]
+            if future.cancelled():
+                heapq.heappop(self._queue)
+                continue
+            if self.in_use + cost > self.capacity:
+                break  # head of line waits; keeps large documents from starving
+            heapq.heappop(self._queue)
+            self._queued -= 1
+            self._queued_cost -= cost
+            self.in_use += cost
+            future.set_result(True)
+
+    async def acquire(self, cost, priority=PRIORITY_DOCUMENT):
+        """Reserves capacity, waiting if needed. Returns the (clamped) cost reserved."""
+        # A document bigger than the whole budget runs alone rather than never
+        cost = min(max(cost, 0.01), self.capacity)
+        if self._queued == 0 and self.in_use + cost <= self.capacity:
+            self.in_use += cost
+            self.admitted += 1
+            return cost
+        if self._queued >= self.max_queue:
+            self._reject("OCR queue is full")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, [priority, next(self._seq), cost, future])
+        self._queued += 1
+        self._queued_cost += cost
+        self._dispatch()  # a cheap high-priority upload may fit right away
+        try:
+            await asyncio.wait_for(future, self.max_wait)
+        except asyncio.TimeoutError:
+            self._abandon(future, cost)
+            self._reject("Timed out waiting for OCR capacity")
+        except BaseException:
+            # e.g. the client disconnected while queued
+            self._abandon(future, cost)
+            raise
+        self.admitted += 1
+        return cost
+
+    def _abandon(self, future, cost):
+        if future.done() and not future.cancelled():
+            self.release(cost)  # granted just as the wait ended
+        else:
+            self._queued -= 1
+            self._queued_cost -= cost
+            self._dispatch()
+
+    def release(self, cost, elapsed=None):
+        self.in_use = max(0.0, self.in_use - cost)
+        if elapsed is not None and cost > 0:
+            # Exponentially weighted average of observed seconds per cost unit
+            self._seconds_per_unit = 0.8 * self._seconds_per_unit + 0.2 * (elapsed / cost)
+        self._dispatch()
+
+    @asynccontextmanager
+    async def admit(self, cost, priority=PRIORITY_DOCUMENT):
+        reserved = await self.acquire(cost, priority)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(reserved, time.monotonic() - start)
+
+    def stats(self):
+        return {
+            "capacity_units": self.capacity,
+            "in_use_units": round(self.in_use, 2),
+            "queued": self._queued,
+            "queued_units": round(self._queued_cost, 2),
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "seconds_per_unit": round(self._seconds_per_unit, 3),
+        }
+
+
+_controller = None
+
+
+def get_admission_controller():
+    global _controller
+    if _controller is None:
+        _controller = AdmissionController()
+    return _controller
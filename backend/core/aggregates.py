@@ -0,0 +1,56 @@
+"""
+Background folding of the aggregate deltas that receipt writes append
+(see crud.fold_aggregate_deltas). Sketch readers fold before reading as
+well, so this only keeps the pending backlog, and the first read after a
+busy period, small.
+"""
+import logging
+import os
+import threading
+
+from backend.db import crud
+from backend.db.database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Seconds between background folds; 0 leaves folding to the readers
+AGGREGATE_FOLD_INTERVAL = float(os.getenv("AGGREGATE_FOLD_INTERVAL", "30"))
+
+
+class _Folder(threading.Thread):
+    """Folds pending aggregate deltas every `interval` seconds until stopped."""
+
+    def __init__(self, interval):
+        super().__init__(daemon=True, name="aggregate-folder")
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            db = SessionLocal()
+            try:
+                folded = crud.fold_aggregate_deltas(db)
+                if folded:
+                    logger.debug("Folded %s aggregate deltas", folded)
+            except Exception:
+                # Deltas stay pending and are folded by the next pass or read
+                db.rollback()
+                logger.exception("Folding aggregate deltas failed")
+            finally:
+                db.close()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+_folder = None
+
+
+def start_folding(interval=AGGREGATE_FOLD_INTERVAL):
+    """Starts the process-wide background folder once; a no-op when `interval` is 0."""
+    global _folder
+    if _folder is None and interval > 0:
+        _folder = _Folder(interval)
+        _folder.start()
+    return _folder
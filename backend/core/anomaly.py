@@ -0,0 +1,60 @@
+import math
+import os
+
+# A vendor / category needs this many receipts before its amounts are judged.
+ANOMALY_MIN_SAMPLES = int(os.getenv("ANOMALY_MIN_SAMPLES", "5"))
+# Scores at or above this are reported as anomalous by /api/receipts/search.
+ANOMALY_SCORE_THRESHOLD = float(os.getenv("ANOMALY_SCORE_THRESHOLD", "3.0"))
+# Floor on the spread (in log units, ~5%) so a vendor that always charges the
+# same amount doesn't turn a one-cent difference into a huge score.
+ANOMALY_MIN_STD = float(os.getenv("ANOMALY_MIN_STD", "0.05"))
+# Per-vendor / per-category t-digest size; small, since it only backs a percentile hint.
+ANOMALY_DIGEST_COMPRESSION = 50
+
+# Statistics are kept per vendor and per category
+DIMENSIONS = ("vendor", "category")
+
+
+def transform(amount):
+    """
+    Amounts are compared on a log scale: receipt amounts are skewed, and an
+    OCR slip such as 1000 for 10.00 is a ratio, not a difference.
+    Returns None for missing or non-positive amounts, which are not scored.
+    """
+    if amount is None or amount <= 0:
+        return None
+    return math.log(amount)
+
+
+def welford_add(count, mean, m2, x):
+    """Welford's online update: (count, mean, M2) after adding x."""
+    count += 1
+    delta = x - mean
+    mean += delta / count
+    m2 += delta * (x - mean)
+    return count, mean, m2
+
+
+def welford_remove(count, mean, m2, x):
+    """Exact inverse of welford_add: (count, mean, M2) after removing x."""
+    if count <= 1:
+        return 0, 0.0, 0.0
+    new_mean = (count * mean - x) / (count - 1)
+    m2 -= (x - new_mean) * (x - mean)
+    return count - 1, new_mean, max(m2, 0.0)
+
+
+def summarize(values):
+    """(count, mean, M2) of a batch of values, to be merged into running statistics."""
+    count, mean, m2 = 0, 0.0, 0.0
+    for x in values:
+        count, mean, m2 = welford_add(count, mean, m2, x)
+    return count, mean, m2
+
+
+def z_score(x, count, mean, m2):
+    """|z| of x against the running statistics, or None with too few samples."""
+    if count < ANOMALY_MIN_SAMPLES:
+        return None
+    std = max(math.sqrt(m2 / (count - 1)), ANOMALY_MIN_STD)
+    return abs(x - mean) / std
@@ -0,0 +1,172 @@
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Rule dictionary location; override to ship a customer-specific rule set.
+CATEGORY_RULES_PATH = os.getenv(
+    "CATEGORY_RULES_PATH", os.path.join(os.path.dirname(__file__), "category_rules.json")
+)
+# How often (seconds) the rule file's mtime is checked for hot reload.
+CATEGORY_RULES_RELOAD_INTERVAL = float(os.getenv("CATEGORY_RULES_RELOAD_INTERVAL", "5"))
+
+VENDOR = "vendor"
+TEXT = "text"
+
+
+class AhoCorasick:
+    """
+    Multi-pattern substring matcher. All patterns are compiled into one
+    automaton, so a scan is linear in the text length plus the number of
+    matches, regardless of how many patterns there are.
+    """
+
+    def __init__(self):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+
+    def add(self, pattern, payload):
+        state = 0
+        for ch in pattern:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        self._out[state].append(payload)
+
+    def build(self):
+        """Computes failure links breadth-first and merges outputs along them."""
+        queue = list(self._goto[0].values())
+        head = 0
+        while head < len(queue):
+            state = queue[head]
+            head += 1
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fallback = self._fail[state]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+        return self
+
+    def iter_matches(self, text):
+        """Yields the payload of every pattern occurring in `text`."""
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                yield from out[state]
+
+
+class Categorizer:
+    """
+    Rule-based category assignment compiled from a JSON rule file:
+
+        {"rules": [{"category": "Utilities", "priority": 30,
+                    "vendor": ["electricity", "power"], "text": ["kwh"]}]}
+
+    `vendor` patterns are matched against the parsed vendor name and `text`
+    patterns against the full receipt text, both case-insensitively. A
+    vendor match always wins over text keywords (an "organic" line item
+    doesn't turn a cafe into Groceries); among matches of the same kind the
+    highest priority wins, then the longest pattern.
+    """
+
+    def __init__(self, rules):
+        vendor_matcher, text_matcher = AhoCorasick(), AhoCorasick()
+        for rule in rules:
+            category = rule["category"]
+            priority = int(rule.get("priority", 0))
+            for pattern in rule.get(VENDOR, []):
+                if pattern:
+                    vendor_matcher.add(pattern.lower(), (1, priority, len(pattern), category))
+            for pattern in rule.get(TEXT, []):
+                if pattern:
+                    text_matcher.add(pattern.lower(), (0, priority, len(pattern), category))
+        self.rule_count = len(rules)
+        self._vendor = vendor_matcher.build()
+        self._text = text_matcher.build()
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f).get("rules", []))
+
+    def categorize(self, vendor=None, text=None):
+        best = None
+        if vendor:
+            for match in self._vendor.iter_matches(vendor.lower()):
+                if best is None or match > best:
+                    best = match
+        if text:
+            for match in self._text.iter_matches(text.lower()):
+                if best is None or match > best:
+                    best = match
+        return best[3] if best else None
+
+
+class _ReloadingCategorizer:
+    """Process-wide categorizer that recompiles when the rule file changes."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._categorizer = None
+        self._mtime = None
+        self._next_check = 0.0
+
+    def get(self):
+        now = time.monotonic()
+        if self._categorizer is None or now >= self._next_check:
+            with self._lock:
+                if self._categorizer is None or now >= self._next_check:
+                    self._next_check = now + CATEGORY_RULES_RELOAD_INTERVAL
+                    self._reload_if_changed()
+        return self._categorizer
+
+    def _reload_if_changed(self):
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError as e:
+            if self._categorizer is None:
+                logger.warning("Category rules not found at %s: %s", self.path, e)
+                self._categorizer = Categorizer([])
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            # Swap in the new automaton only once it has compiled successfully
+            self._categorizer = Categorizer.from_file(self.path)
+            self._mtime = mtime
+            logger.info("Loaded %d category rules from %s", self._categorizer.rule_count, self.path)
+        except (ValueError, KeyError, TypeError) as e:
+            self._mtime = mtime  # don't re-parse (and re-log) the same broken file
+            logger.error("Invalid category rules in %s, keeping previous rules: %s", self.path, e)
+            if self._categorizer is None:
+                self._categorizer = Categorizer([])
+
+
+_default = _ReloadingCategorizer(CATEGORY_RULES_PATH)
+
+
+def get_categorizer():
+    """Returns the current compiled rule set, reloading it if the file changed."""
+    return _default.get()
+
+
+def categorize(vendor=None, text=None):
+    """Category for a receipt, or None if no rule matches."""
+    return get_categorizer().categorize(vendor, text)
@@ -0,0 +1,110 @@
+"""
+Removal of stored upload files once no receipt references them.
+
+Deleting receipts only updates the database: the transaction that drops a
+blob's last reference marks it released, and the files go afterwards, in
+the background and in batches, so a bulk delete commits (and answers)
+without waiting on thousands of unlinks.
+
+An upload of identical content can take a new reference at any moment,
+which clears the mark. So a file is first set aside (moved out of its
+path), then the mark is checked again: a blob referenced in the meantime
+gets its file put back, and an upload whose reference lands after that
+check finds the file gone and stores it again. The retention policy
+removes files the same way (see backend/core/lifecycle.py).
+"""
+import logging
+import os
+
+from backend.core.storage import STORAGE_ROOT, get_storage
+from backend.db import crud
+from backend.db.database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Files removed per batch (one blob re-check query per batch)
+FILE_REMOVAL_BATCH_SIZE = int(os.getenv("FILE_REMOVAL_BATCH_SIZE", "200"))
+
+
+def _inside_storage_root(path):
+    """saved_path is editable through the API, so never remove anything outside the upload tree."""
+    root = os.path.realpath(STORAGE_ROOT)
+    return os.path.commonpath([root, os.path.realpath(path)]) == root
+
+
+def remove_blob_files(db, digests, still_unused, counts):
+    """
+    Removes the files of the blobs in `digests` that `still_unused(db,
+    digests)` (a set of digests) confirms both before and after they are
+    set aside; the others are kept or put back. Adds to `counts` and
+    returns the digests whose files are gone.
+    """
+    storage = get_storage()
+    candidates = still_unused(db, digests)
+    db.rollback()  # end the read transaction before touching files
+    counts["kept"] += len(digests) - len(candidates)
+    aside, gone = {}, []
+    for digest in digests:
+        if digest not in candidates:
+            continue
+        try:
+            handle = storage.set_aside(digest)
+        except OSError:
+            logger.exception("Could not remove blob %s", digest)
+            counts["failed"] += 1
+            continue
+        if handle is None:
+            counts["missing"] += 1
+            gone.append(digest)
+        else:
+            aside[digest] = handle
+    confirmed = still_unused(db, list(aside))
+    db.rollback()
+    for digest, handle in aside.items():
+        try:
+            if digest in confirmed:
+                storage.discard(handle)
+                counts["removed"] += 1
+                gone.append(digest)
+            else:
+                storage.put_back(digest, handle)  # referenced again meanwhile
+                counts["kept"] += 1
+        except OSError:
+            logger.exception("Could not remove blob %s", digest)
+            counts["failed"] += 1
+    return gone
+
+
+def remove_released_files(digests, legacy_paths=(), batch_size=FILE_REMOVAL_BATCH_SIZE):
+    """
+    Removes the files (and then the rows) of the blobs in `digests` that
+    are still released, and the given pre-content-addressing upload paths.
+    Returns counts of removed, kept (referenced again), missing and failed files.
+    """
+    counts = {"removed": 0, "kept": 0, "missing": 0, "failed": 0}
+    db = SessionLocal()
+    try:
+        for start in range(0, len(digests), batch_size):
+            batch = digests[start:start + batch_size]
+            gone = remove_blob_files(db, batch, crud.released_blob_digests, counts)
+            crud.forget_released_blobs(db, gone)
+            db.commit()
+    finally:
+        db.close()
+
+    for path in legacy_paths:
+        if not _inside_storage_root(path):
+            logger.warning("Not removing %s: outside %s", path, STORAGE_ROOT)
+            counts["kept"] += 1
+            continue
+        try:
+            os.remove(path)
+            counts["removed"] += 1
+        except FileNotFoundError:
+            counts["missing"] += 1
+        except OSError:
+            logger.exception("Could not remove %s", path)
+            counts["failed"] += 1
+
+    logger.info("Removed files of deleted receipts", extra=counts)
+    return counts
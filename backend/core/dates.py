@@ -0,0 +1,162 @@
+import datetime
+import os
+import re
+import threading
+from collections import OrderedDict
+
+# Order tried first for ambiguous numeric dates such as 03/04/2024:
+# "MDY" (US) or "DMY" (most other locales). Year-first dates are never ambiguous,
+# and dotted dates (03.04.2024) are read day-first unless the vendor's order is known.
+DATE_ORDER = os.getenv("DATE_ORDER", "MDY").upper()
+# How many vendors' preferred date orders are remembered (LRU).
+DATE_FORMAT_CACHE_SIZE = int(os.getenv("DATE_FORMAT_CACHE_SIZE", "10000"))
+
+MIN_YEAR = 1970
+
+_MONTHS = {
+    "jan": 1, "january": 1, "feb": 2, "february": 2, "mar": 3, "march": 3,
+    "apr": 4, "april": 4, "may": 5, "jun": 6, "june": 6, "jul": 7, "july": 7,
+    "aug": 8, "august": 8, "sep": 9, "sept": 9, "september": 9, "oct": 10, "october": 10,
+    "nov": 11, "november": 11, "dec": 12, "december": 12,
+}
+# Only real month names and abbreviations: "Decaf", "Marlboro" or "MAYO" are not months
+_MONTH_NAME = (r"(?:jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?"
+               r"|sep(?:t(?:ember)?)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?)(?![a-z])\.?")
+# A two-digit year followed by ".<digit>" is the start of a price ("1 Decaf 12.50")
+_YEAR = r"(?:\d{4}\b|\d{2}\b(?!\.\d))"
+
+# Date-shaped substrings in OCR text, most specific shapes first
+_DATE_PATTERNS = [
+    re.compile(r"\b\d{4}[-/.]\d{1,2}[-/.]\d{1,2}\b"),
+    re.compile(r"(?<![\d/.\-])\d{1,2}[-/.]\d{1,2}[-/.]" + _YEAR),
+    re.compile(r"\b\d{1,2}(?:st|nd|rd|th)?[\s\-/.]*" + _MONTH_NAME + r"[\s\-/.,]*'?" + _YEAR, re.IGNORECASE),
+    re.compile(r"\b" + _MONTH_NAME + r"[\s\-/.]*\d{1,2}(?:st|nd|rd|th)?[\s\-/.,]*'?" + _YEAR, re.IGNORECASE),
+]
+_TOKENS = re.compile(r"[A-Za-z]+|\d+")
+_ORDINALS = {"st", "nd", "rd", "th"}
+
+
+class _FormatMemo:
+    """Thread-safe LRU of vendor -> numeric date order that last parsed for it."""
+
+    def __init__(self, size):
+        self.size = size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, vendor):
+        with self._lock:
+            order = self._data.get(vendor)
+            if order is not None:
+                self._data.move_to_end(vendor)
+            return order
+
+    def put(self, vendor, order):
+        with self._lock:
+            self._data[vendor] = order
+            self._data.move_to_end(vendor)
+            if len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+
+_memo = _FormatMemo(DATE_FORMAT_CACHE_SIZE)
+
+
+def _vendor_key(vendor):
+    return vendor.strip().lower() if vendor else None
+
+
+def _expand_year(token):
+    year = int(token)
+    if len(token) <= 2:
+        # Two-digit years: up to next year's yy is this century, the rest last century
+        pivot = (datetime.date.today().year + 1) % 100
+        year += 2000 if year <= pivot else 1900
+    return year
+
+
+def _build(year, month, day):
+    if not MIN_YEAR <= year <= datetime.date.today().year + 1:
+        return None
+    try:
+        return datetime.date(year, month, day)
+    except ValueError:
+        return None
+
+
+def _numeric_orders(vendor_key, dotted=False):
+    orders = []
+    remembered = _memo.get(vendor_key) if vendor_key else None
+    for order in (remembered, "DMY" if dotted else DATE_ORDER, "MDY", "DMY"):
+        if order and order not in orders:
+            orders.append(order)
+    return orders
+
+
+def parse_date(value, vendor=None):
+    """
+    Parses a single date string in any common receipt format: ISO and
+    year-first, DD/MM/YYYY and MM/DD/YYYY with '/', '-' or '.', two-digit
+    years, and textual months ("15 Jun 2024", "June 15, 2024", "15-Jun-24").
+    Ambiguous numeric dates use the order that last worked for `vendor`,
+    then DATE_ORDER (day-first for dotted dates). Returns a datetime.date or None.
+    """
+    if not value:
+        return None
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+
+    tokens = [t for t in _TOKENS.findall(str(value)) if t.lower() not in _ORDINALS]
+    if len(tokens) != 3:
+        return None
+
+    words = [t for t in tokens if t.isalpha()]
+    if words:
+        if len(words) != 1:
+            return None
+        month = _MONTHS.get(words[0].lower())
+        if month is None:
+            return None
+        numbers = [t for t in tokens if t.isdigit()]
+        # The year is the 4-digit number, otherwise the last one ("Jun 15 24", "15 Jun 24")
+        if len(numbers[0]) == 4:
+            year_token, day_token = numbers
+        else:
+            day_token, year_token = numbers
+        return _build(_expand_year(year_token), month, int(day_token))
+
+    if not all(t.isdigit() for t in tokens):
+        return None
+    first, second, third = tokens
+    if len(first) == 4:
+        return _build(int(first), int(second), int(third))
+
+    vendor_key = _vendor_key(vendor)
+    for order in _numeric_orders(vendor_key, dotted="." in str(value)):
+        if order == "MDY":
+            parsed = _build(_expand_year(third), int(first), int(second))
+        else:
+            parsed = _build(_expand_year(third), int(second), int(first))
+        if parsed is not None:
+            if vendor_key:
+                _memo.put(vendor_key, order)
+            return parsed
+    return None
+
+
+def find_date(text, vendor=None):
+    """
+    Finds the first parseable date in free OCR text.
+    Returns (matched_substring, datetime.date) or (None, None).
+    """
+    if not text:
+        return None, None
+    for pattern in _DATE_PATTERNS:
+        for match in pattern.finditer(text):
+            parsed = parse_date(match.group(0), vendor)
+            if parsed is not None:
+                return match.group(0), parsed
+    return None, None
+
@@ -0,0 +1,120 @@
+import bisect
+import csv
+import datetime
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Currency every aggregate is reported in. Receipts with no detected
+# currency are assumed to already be in it; a currency that isn't
+# recognised or has no rate leaves the receipt unconverted.
+BASE_CURRENCY = os.getenv("BASE_CURRENCY", "USD")
+FX_RATES_PATH = os.getenv("FX_RATES_PATH", os.path.join(os.path.dirname(__file__), "fx_rates.csv"))
+
+# Symbols and spellings seen in OCR output, mapped to ISO 4217 codes
+CURRENCY_ALIASES = {
+    "$": "USD", "us$": "USD", "usd": "USD",
+    "₹": "INR", "rs": "INR", "rs.": "INR", "inr": "INR",
+    "€": "EUR", "eur": "EUR",
+    "£": "GBP", "gbp": "GBP",
+}
+
+
+def normalize_currency(value):
+    """ISO code for a currency symbol or code, or None if it isn't recognised."""
+    if not value:
+        return None
+    value = value.strip()
+    code = CURRENCY_ALIASES.get(value.lower())
+    if code:
+        return code
+    if len(value) == 3 and value.isalpha():
+        return value.upper()
+    return None
+
+
+class FxRateTable:
+    """
+    Date-effective rates held in memory: per currency, a sorted list of
+    effective dates and the USD value of one unit from that date on.
+    Lookups are a binary search.
+    """
+
+    def __init__(self, rows):
+        by_currency = {}
+        for effective_date, currency, usd_per_unit in rows:
+            by_currency.setdefault(currency, []).append((effective_date, usd_per_unit))
+        self._dates = {}
+        self._rates = {}
+        for currency, entries in by_currency.items():
+            entries.sort()
+            self._dates[currency] = [d for d, _ in entries]
+            self._rates[currency] = [r for _, r in entries]
+
+    @classmethod
+    def from_csv(cls, path):
+        rows = []
+        with open(path, newline="", encoding="utf-8") as f:
+            lines = (line for line in f if line.strip() and not line.startswith("#"))
+            for row in csv.DictReader(lines):
+                rows.append((
+                    datetime.date.fromisoformat(row["effective_date"]),
+                    row["currency"].strip().upper(),
+                    float(row["usd_per_unit"]),
+                ))
+        return cls(rows)
+
+    def usd_per_unit(self, currency, on_date):
+        """USD value of one unit on `on_date`; dates before the table use its first rate."""
+        dates = self._dates.get(currency)
+        if not dates:
+            return None
+        idx = bisect.bisect_right(dates, on_date) - 1
+        return self._rates[currency][max(idx, 0)]
+
+    def rate(self, currency, base, on_date):
+        """Multiplier converting `currency` to `base` on `on_date`, or None if unknown."""
+        if currency == base:
+            return 1.0
+        source = self.usd_per_unit(currency, on_date)
+        target = self.usd_per_unit(base, on_date)
+        if source is None or not target:
+            return None
+        return source / target
+
+
+_table = None
+
+
+def get_rate_table():
+    global _table
+    if _table is None:
+        try:
+            _table = FxRateTable.from_csv(FX_RATES_PATH)
+        except (OSError, ValueError, KeyError) as e:
+            logger.error("Could not load FX rates from %s: %s", FX_RATES_PATH, e)
+            _table = FxRateTable([])
+    return _table
+
+
+def to_base_currency(amount, currency, on_date=None):
+    """
+    Converts an amount to BASE_CURRENCY at the rate effective on `on_date`.
+    Returns (currency_code, fx_rate, base_amount); fx_rate and base_amount
+    are None when the currency has no rate in the table, and all three when
+    the currency isn't recognised. Both cases are logged.
+    """
+    if not currency or not currency.strip():
+        code = BASE_CURRENCY
+    else:
+        code = normalize_currency(currency)
+        if code is None:
+            logger.warning("Unrecognised currency %r; amount not converted to %s", currency, BASE_CURRENCY)
+            return None, None, None
+    rate = get_rate_table().rate(code, BASE_CURRENCY, on_date or datetime.date.today())
+    if rate is None:
+        logger.warning("No %s/%s rate; amount not converted", code, BASE_CURRENCY)
+    if amount is None or rate is None:
+        return code, rate, None
+    return code, rate, round(amount * rate, 4)
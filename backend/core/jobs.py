@@ -0,0 +1,217 @@
+"""
+Durable OCR job queue.
+
+Uploads queued through /api/ocr-jobs are stored as blobs and recorded in
+the ocr_jobs table; OCR worker processes (backend/scripts/ocr_worker.py),
+on this machine or others sharing the database and upload volume, claim
+jobs with a lease, keep it alive with heartbeats while OCR runs, and
+write the receipt and the job's completion in one transaction. A worker
+that crashes simply stops renewing its lease and the job is picked up
+again; failed attempts are retried with exponential backoff and
+dead-lettered after max_attempts.
+"""
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+
+from backend.core.cleanup import remove_released_files
+from backend.core.language import OCR_LANGUAGE_PHASH_DISTANCE, remember_language, vendor_hint
+from backend.core.logs import request_id_var
+from backend.core.ocr import extract_text_with_details, parse_receipt_text
+from backend.core.phash import compute_phash, PHASH_MAX_DISTANCE
+from backend.db import crud
+from backend.db.database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# A job whose worker hasn't renewed its lease for this long is reclaimed.
+OCR_JOB_LEASE_SECONDS = float(os.getenv("OCR_JOB_LEASE_SECONDS", "120"))
+OCR_JOB_HEARTBEAT_SECONDS = float(os.getenv("OCR_JOB_HEARTBEAT_SECONDS", str(OCR_JOB_LEASE_SECONDS / 4)))
+OCR_JOB_MAX_ATTEMPTS = int(os.getenv("OCR_JOB_MAX_ATTEMPTS", "5"))
+# Retry n waits about base * 2^(n-1) seconds (with jitter), capped.
+OCR_JOB_RETRY_BASE_SECONDS = float(os.getenv("OCR_JOB_RETRY_BASE_SECONDS", "10"))
+OCR_JOB_RETRY_MAX_SECONDS = float(os.getenv("OCR_JOB_RETRY_MAX_SECONDS", "900"))
+# How long an idle worker sleeps before polling the queue again.
+OCR_JOB_POLL_SECONDS = float(os.getenv("OCR_JOB_POLL_SECONDS", "2"))
+
+
+def new_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def retry_delay(attempts):
+    """Exponential backoff with jitter, so failing jobs don't retry in lockstep."""
+    delay = min(OCR_JOB_RETRY_MAX_SECONDS, OCR_JOB_RETRY_BASE_SECONDS * 2 ** max(0, attempts - 1))
+    return random.uniform(delay / 2, delay)
+
+
+class _Heartbeat(threading.Thread):
+    """Renews a job's lease in the background while OCR runs; notes if it was lost."""
+
+    def __init__(self, job_id, worker_id):
+        super().__init__(daemon=True)
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.lost = False
+        self._stop_event = threading.Event()
+
+    def run(self):
+        db = SessionLocal()
+        try:
+            while not self._stop_event.wait(OCR_JOB_HEARTBEAT_SECONDS):
+                try:
+                    if not crud.heartbeat_ocr_job(db, self.job_id, self.worker_id, OCR_JOB_LEASE_SECONDS):
+                        self.lost = True
+                        return
+                except Exception as e:
+                    # A missed beat is fine; the lease outlives several of them
+                    db.rollback()
+                    logger.warning("OCR job %s: heartbeat failed: %s", self.job_id, e)
+        finally:
+            db.close()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def process_job(db, job):
+    """
+    The OCR part of ingestion for one job, mirroring /api/upload:
+    perceptual hash, optional reuse of a near-duplicate's text, OCR, parse.
+    Returns (parsed_data, text, phash). Raises if the stored file is missing.
+    """
+    if not os.path.exists(job.saved_path):
+        raise FileNotFoundError(f"Stored upload not found: {job.saved_path}")
+
+    phash = compute_phash(job.saved_path, job.content_type)
+    duplicate, similar = None, None
+    if phash is not None:
+        # One probe finds a near-duplicate and any similar-looking receipt to take an OCR model from
+        match = crud.find_near_duplicate(db, phash, max(PHASH_MAX_DISTANCE, OCR_LANGUAGE_PHASH_DISTANCE))
+        if match:
+            similar = match[0]
+            if job.reuse_duplicate_ocr and match[1] <= PHASH_MAX_DISTANCE and match[0].ocr_text:
+                duplicate = match[0]
+
+    if duplicate is not None:
+        text, language = duplicate.ocr_text, duplicate.language
+    else:
+        vendor = vendor_hint(similar.vendor, similar.language) if similar is not None else None
+        text, extraction = extract_text_with_details(job.saved_path, job.content_type,
+                                                     vendor=vendor, source=job.source)
+        language = extraction.get("language")
+
+    parsed_data = parse_receipt_text(text)
+    parsed_data["language"] = language
+    remember_language(language, vendor=parsed_data.get("vendor"))
+    return parsed_data, text, phash
+
+
+def run_one(worker_id, db=None):
+    """
+    Claims and runs a single job. Returns the job id, or None if the queue
+    had nothing runnable.
+    """
+    own_session = db is None
+    db = db or SessionLocal()
+    try:
+        job = crud.claim_ocr_job(db, worker_id, OCR_JOB_LEASE_SECONDS)
+        if job is None:
+            return None
+        # Logs of this job carry the id of the request that queued it
+        token = request_id_var.set(job.request_id or f"ocr-job-{job.id}")
+        try:
+            return _run_claimed(db, job, worker_id)
+        finally:
+            request_id_var.reset(token)
+    finally:
+        if own_session:
+            db.close()
+
+
+def _delete_unreferenced_blob(db, digest):
+    # Ends whatever transaction is open first: after a failed flush the
+    # session refuses every query until it is rolled back
+    db.rollback()
+    remove_released_files([digest])
+
+
+def _fail_attempt(db, job, worker_id, error):
+    db.rollback()
+    status = crud.fail_ocr_job(db, job, worker_id, f"{type(error).__name__}: {error}", retry_delay(job.attempts))
+    logger.warning("OCR job %s attempt %s/%s failed (%s): %s", job.id, job.attempts, job.max_attempts, status, error)
+    if status == "dead":
+        _delete_unreferenced_blob(db, job.content_hash)
+
+
+def _run_claimed(db, job, worker_id):
+    heartbeat = _Heartbeat(job.id, worker_id)
+    heartbeat.start()
+    try:
+        parsed_data, text, phash = process_job(db, job)
+    except Exception as e:
+        heartbeat.stop()
+        _fail_attempt(db, job, worker_id, e)
+        return job.id
+    heartbeat.stop()
+
+    try:
+        receipt = None if heartbeat.lost else crud.complete_ocr_job(db, job, worker_id, parsed_data,
+                                                                   ocr_text=text, phash=phash)
+    except Exception as e:
+        # Writing the receipt failed (e.g. a constraint or a lost connection): counts as a failed attempt
+        db.rollback()
+        logger.exception("OCR job %s: could not store the receipt", job.id)
+        _fail_attempt(db, job, worker_id, e)
+        return job.id
+    if receipt is None:
+        logger.warning("OCR job %s: lease lost to another worker, result discarded", job.id)
+    else:
+        logger.info("OCR job %s completed", job.id, extra={"receipt_id": job.receipt_id, "attempt": job.attempts})
+    return job.id
+
+
+def reap_dead_jobs(db):
+    """Dead-letters jobs that crashed their worker on every attempt and frees their blobs."""
+    for job in crud.dead_letter_exhausted_jobs(db):
+        logger.error("OCR job %s dead-lettered after %s attempts", job.id, job.attempts)
+        _delete_unreferenced_blob(db, job.content_hash)
+
+
+def run_worker(worker_id=None, stop_event=None, burst=False):
+    """
+    Worker loop: claims and runs jobs until `stop_event` is set (finishing
+    the current job first). With `burst`, returns once the queue is empty.
+    Returns the number of jobs processed.
+    """
+    worker_id = worker_id or new_worker_id()
+    stop_event = stop_event or threading.Event()
+    processed = 0
+    db = SessionLocal()
+    try:
+        logger.info("OCR worker %s started", worker_id)
+        while not stop_event.is_set():
+            try:
+                job_id = run_one(worker_id, db)
+            except Exception as e:
+                # Database briefly unavailable or locked: back off, keep the worker alive
+                db.rollback()
+                logger.warning("OCR worker %s: %s", worker_id, e)
+                stop_event.wait(OCR_JOB_POLL_SECONDS)
+                continue
+            if job_id is not None:
+                processed += 1
+                continue
+            reap_dead_jobs(db)
+            if burst:
+                break
+            stop_event.wait(OCR_JOB_POLL_SECONDS)
+    finally:
+        db.close()
+    logger.info("OCR worker %s stopped after %d jobs", worker_id, processed)
+    return processed
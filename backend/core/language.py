@@ -0,0 +1,199 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+# Tesseract model used when detection is unavailable or inconclusive.
+OCR_DEFAULT_LANG = os.getenv("OCR_DEFAULT_LANG", "eng")
+# OSD only identifies the script; Latin-script receipts are read with this model.
+OCR_LATIN_LANG = os.getenv("OCR_LATIN_LANG", OCR_DEFAULT_LANG)
+# Extra or overriding script -> model pairs, e.g. "Cyrillic=ukr,Han=chi_tra".
+OCR_SCRIPT_LANGS = os.getenv("OCR_SCRIPT_LANGS", "")
+# Below this OSD script confidence the default model is used.
+OCR_OSD_MIN_CONFIDENCE = float(os.getenv("OCR_OSD_MIN_CONFIDENCE", "1.5"))
+# How many vendors' / sources' model choices are remembered (LRU).
+OCR_LANGUAGE_CACHE_SIZE = int(os.getenv("OCR_LANGUAGE_CACHE_SIZE", "10000"))
+# A stored receipt whose perceptual hash is this close is taken to come from
+# the same vendor, so an upload borrows its OCR model before it is read.
+OCR_LANGUAGE_PHASH_DISTANCE = int(os.getenv("OCR_LANGUAGE_PHASH_DISTANCE", "11"))
+
+# Tesseract OSD script names -> single traineddata model
+SCRIPT_LANGS = {
+    "Latin": OCR_LATIN_LANG,
+    "Cyrillic": "rus",
+    "Greek": "ell",
+    "Arabic": "ara",
+    "Hebrew": "heb",
+    "Devanagari": "hin",
+    "Bengali": "ben",
+    "Tamil": "tam",
+    "Telugu": "tel",
+    "Kannada": "kan",
+    "Malayalam": "mal",
+    "Gujarati": "guj",
+    "Gurmukhi": "pan",
+    "Thai": "tha",
+    "Han": "chi_sim",
+    "Japanese": "jpn",
+    "Katakana": "jpn",
+    "Hiragana": "jpn",
+    "Hangul": "kor",
+}
+for _pair in filter(None, (p.strip() for p in OCR_SCRIPT_LANGS.split(","))):
+    _script, _, _lang = _pair.partition("=")
+    SCRIPT_LANGS[_script.strip()] = _lang.strip()
+
+# Unicode blocks used to tell the script of already-extracted text (PDF text
+# layers, .txt uploads) without running OSD. Checked in order.
+_SCRIPT_RANGES = (
+    ("Cyrillic", 0x0400, 0x052F),
+    ("Greek", 0x0370, 0x03FF),
+    ("Hebrew", 0x0590, 0x05FF),
+    ("Arabic", 0x0600, 0x06FF),
+    ("Devanagari", 0x0900, 0x097F),
+    ("Bengali", 0x0980, 0x09FF),
+    ("Gurmukhi", 0x0A00, 0x0A7F),
+    ("Gujarati", 0x0A80, 0x0AFF),
+    ("Tamil", 0x0B80, 0x0BFF),
+    ("Telugu", 0x0C00, 0x0C7F),
+    ("Kannada", 0x0C80, 0x0CFF),
+    ("Malayalam", 0x0D00, 0x0D7F),
+    ("Thai", 0x0E00, 0x0E7F),
+    ("Japanese", 0x3040, 0x30FF),
+    ("Han", 0x4E00, 0x9FFF),
+    ("Hangul", 0xAC00, 0xD7AF),
+)
+
+
+@lru_cache(maxsize=1)
+def installed_languages():
+    """Traineddata models tesseract can load, or None if that can't be determined."""
+    try:
+        import pytesseract
+        return frozenset(pytesseract.get_languages(config=""))
+    except Exception:
+        return None
+
+
+def language_for_script(script):
+    """The single tesseract model for a script name, falling back to OCR_DEFAULT_LANG."""
+    lang = SCRIPT_LANGS.get(script)
+    installed = installed_languages()
+    if not lang or (installed is not None and lang not in installed):
+        return OCR_DEFAULT_LANG
+    return lang
+
+
+def detect_script(image):
+    """
+    Tesseract orientation and script detection on a PIL image. Returns
+    {"script", "script_conf", "rotate", "orientation_conf"} or None when OSD
+    isn't available (no osd.traineddata) or finds too little text.
+    """
+    import pytesseract
+
+    try:
+        osd = pytesseract.image_to_osd(image, output_type=pytesseract.Output.DICT)
+    except Exception as e:
+        logger.info("Script detection failed: %s", e)
+        return None
+    return {
+        "script": osd.get("script"),
+        "script_conf": float(osd.get("script_conf") or 0),
+        "rotate": int(osd.get("rotate") or 0),
+        "orientation_conf": float(osd.get("orientation_conf") or 0),
+    }
+
+
+def script_of_text(text):
+    """Dominant non-Latin script of extracted text by Unicode block, else "Latin"."""
+    counts = {}
+    latin = 0
+    for ch in text or "":
+        code = ord(ch)
+        if code < 0x0250:
+            latin += ch.isalpha()
+            continue
+        for script, low, high in _SCRIPT_RANGES:
+            if low <= code <= high:
+                counts[script] = counts.get(script, 0) + 1
+                break
+    if counts:
+        script, count = max(counts.items(), key=lambda kv: kv[1])
+        # Mostly-Latin text with a stray symbol keeps the Latin model
+        if count >= latin / 4:
+            return script
+    return "Latin"
+
+
+def language_for_text(text):
+    return language_for_script(script_of_text(text))
+
+
+class _LanguageMemo:
+    """Thread-safe LRU of vendor / source -> tesseract model that last read it well."""
+
+    def __init__(self, size):
+        self.size = size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            lang = self._data.get(key)
+            if lang is not None:
+                self._data.move_to_end(key)
+            return lang
+
+    def put(self, key, lang):
+        with self._lock:
+            self._data[key] = lang
+            self._data.move_to_end(key)
+            if len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+
+_memo = _LanguageMemo(OCR_LANGUAGE_CACHE_SIZE)
+
+
+def _keys(vendor=None, source=None):
+    keys = []
+    if vendor and vendor.strip():
+        keys.append("vendor:" + vendor.strip().lower())
+    if source and source.strip():
+        keys.append("source:" + source.strip().lower())
+    return keys
+
+
+def cached_language(vendor=None, source=None):
+    """Model remembered for the vendor (preferred) or source, or None."""
+    for key in _keys(vendor, source):
+        lang = _memo.get(key)
+        if lang:
+            return lang
+    return None
+
+
+def vendor_hint(vendor, lang):
+    """
+    The vendor to look an upload's model up by, from a similar-looking
+    stored receipt (its vendor and the model that read it): an upload's own
+    vendor is only known after OCR. The stored model is remembered for the
+    vendor unless one already is. Returns the vendor or None.
+    """
+    if not vendor or not vendor.strip():
+        return None
+    if lang and cached_language(vendor) is None:
+        remember_language(lang, vendor=vendor)
+    return vendor
+
+
+def remember_language(lang, vendor=None, source=None):
+    """Records the model that produced good text for this vendor and/or source."""
+    if not lang:
+        return
+    for key in _keys(vendor, source):
+        _memo.put(key, lang)
@@ -0,0 +1,369 @@
+"""
+Storage lifecycle for uploaded originals.
+
+Three passes, run by backend/scripts/storage_lifecycle.py (once, or every
+--interval seconds as a background manager), after sweeping up released
+blobs whose background removal never ran:
+
+- Recompression: once a blob's OCR has run, its file is re-encoded in
+  place if that saves enough space. PNGs are re-encoded losslessly; JPEGs
+  are optimized losslessly with jpegtran, or re-encoded at
+  LIFECYCLE_JPEG_QUALITY if that is set. The blob keeps its digest (the
+  sha256 of the upload), so an identical upload still finds it.
+- Retention: with RETENTION_ORIGINALS_DAYS set, the files of blobs whose
+  receipts are all older than that are removed. The receipts keep their
+  OCR text and fields; uploading the same file again restores the blob.
+- Orphan collection: the files on disk are reconciled with the database
+  in both directions. Files no blob or receipt points at are reported (and
+  removed with delete_orphans); receipts whose file is gone are reported.
+
+Every pass streams: blobs and receipts are read in keyset batches, and
+the file walk holds one directory listing at a time. Recompression and
+retention record their progress on the blob rows; the orphan collection
+checkpoints a StorageGcRun after every batch, so an interrupted run
+resumes where it stopped.
+
+Receipts stored before content addressing (files directly under the
+upload root) have no blob row; they are left as they are by the first
+two passes and only take part in orphan collection.
+"""
+import datetime
+import json
+import logging
+import os
+import shutil
+import subprocess
+import time
+import uuid
+
+from backend.core.cleanup import remove_blob_files, remove_released_files
+from backend.core.resumable import UPLOAD_SESSION_DIR, sweep_expired_sessions
+from backend.core.storage import STORAGE_ROOT, get_storage
+from backend.db import crud
+from backend.db.database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# JPEG quality for lossy re-encoding; 0 keeps JPEGs lossless (jpegtran only)
+LIFECYCLE_JPEG_QUALITY = int(os.getenv("LIFECYCLE_JPEG_QUALITY", "0"))
+# A re-encoded file replaces the original only if it is at least this much smaller
+LIFECYCLE_MIN_SAVING = float(os.getenv("LIFECYCLE_MIN_SAVING", "0.05"))
+# Rows read per query and per checkpoint
+LIFECYCLE_BATCH_SIZE = int(os.getenv("LIFECYCLE_BATCH_SIZE", "500"))
+# Originals whose receipts are all older than this many days are removed; 0 keeps them forever
+RETENTION_ORIGINALS_DAYS = int(os.getenv("RETENTION_ORIGINALS_DAYS", "0"))
+# Unreferenced files younger than this may belong to an upload still being committed
+ORPHAN_GRACE_SECONDS = float(os.getenv("ORPHAN_GRACE_SECONDS", "3600"))
+
+# Receipt ids of missing files kept on a StorageGcRun for inspection
+_MISSING_SAMPLE_SIZE = 100
+
+
+def _recompressed_image(path, content_type, out_path, jpeg_quality):
+    """Writes a re-encoded copy of the image at `path` to `out_path`. Returns False if there is nothing to try."""
+    if content_type == "image/jpeg" and not jpeg_quality:
+        jpegtran = shutil.which("jpegtran")
+        if not jpegtran:
+            return False
+        # Rearranges the Huffman coding only; the decoded pixels are identical
+        subprocess.run([jpegtran, "-copy", "all", "-optimize", "-progressive", "-outfile", out_path, path],
+                       check=True, capture_output=True, timeout=120)
+        return True
+
+    from PIL import Image
+
+    with Image.open(path) as image:
+        if content_type == "image/jpeg":
+            options = {key: image.info[key] for key in ("exif", "icc_profile", "dpi") if image.info.get(key)}
+            image.save(out_path, "JPEG", quality=jpeg_quality, optimize=True, progressive=True, **options)
+        elif content_type == "image/png":
+            options = {key: image.info[key] for key in ("icc_profile", "dpi", "transparency") if key in image.info}
+            image.save(out_path, "PNG", optimize=True, **options)
+        else:
+            return False
+    return True
+
+
+def recompress_file(path, content_type, jpeg_quality=LIFECYCLE_JPEG_QUALITY, min_saving=LIFECYCLE_MIN_SAVING):
+    """
+    Re-encodes the file at `path` in place when that makes it at least
+    `min_saving` smaller. Returns the new size, or None if the file was
+    kept (PDFs and text files always are).
+    """
+    if content_type not in ("image/jpeg", "image/png"):
+        return None
+    size = os.path.getsize(path)
+    # Next to the original, so the swap is an atomic rename on the same filesystem
+    tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        if not _recompressed_image(path, content_type, tmp_path, jpeg_quality):
+            return None
+        new_size = os.path.getsize(tmp_path)
+        if new_size > size * (1 - min_saving):
+            return None
+        os.replace(tmp_path, path)
+        return new_size
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def recompress_blobs(batch_size=LIFECYCLE_BATCH_SIZE, jpeg_quality=LIFECYCLE_JPEG_QUALITY):
+    """
+    Recompresses every blob not handled yet. Each blob is marked once
+    looked at, whether or not it was re-encoded, so later runs skip it.
+    Returns counts.
+    """
+    counts = {"examined": 0, "recompressed": 0, "bytes_saved": 0, "failed": 0}
+    db = SessionLocal()
+    try:
+        after = ""
+        while True:
+            batch = crud.get_blobs_to_recompress(db, after=after, limit=batch_size)
+            if not batch:
+                break
+            for digest, path, content_type in batch:
+                counts["examined"] += 1
+                try:
+                    size = os.path.getsize(path)
+                    new_size = recompress_file(path, content_type, jpeg_quality=jpeg_quality)
+                except Exception as e:
+                    # Left unmarked, so the next run tries again
+                    logger.warning("Could not recompress blob %s: %s", digest, e)
+                    counts["failed"] += 1
+                    continue
+                if new_size is not None:
+                    counts["recompressed"] += 1
+                    counts["bytes_saved"] += size - new_size
+                crud.record_recompressed(db, digest, new_size)
+            after = batch[-1][0]
+            db.commit()
+    finally:
+        db.close()
+    logger.info("Recompressed stored uploads", extra=counts)
+    return counts
+
+
+def sweep_released_blobs(grace_seconds=ORPHAN_GRACE_SECONDS, batch_size=LIFECYCLE_BATCH_SIZE):
+    """
+    Removes the files of blobs released more than `grace_seconds` ago whose
+    background removal never ran (e.g. the process stopped first). Returns counts.
+    """
+    before = datetime.datetime.utcnow() - datetime.timedelta(seconds=grace_seconds)
+    counts = {"removed": 0, "kept": 0, "missing": 0, "failed": 0}
+    db = SessionLocal()
+    try:
+        after = ""
+        while True:
+            digests = crud.get_released_blobs(db, before, after=after, limit=batch_size)
+            db.rollback()
+            if not digests:
+                break
+            for name, value in remove_released_files(digests, batch_size=batch_size).items():
+                counts[name] += value
+            after = digests[-1]
+    finally:
+        db.close()
+    return counts
+
+
+def apply_retention(days=RETENTION_ORIGINALS_DAYS, batch_size=LIFECYCLE_BATCH_SIZE):
+    """
+    Removes the files of blobs whose receipts were all uploaded more than
+    `days` days ago, skipping blobs an upload in progress holds. A blob is
+    marked purged (and committed) before its file goes, and the file is
+    removed like a released one (see backend/core/cleanup.py): an
+    identical upload's reference clears the mark and keeps the file, or
+    stores it again if it was already gone. Returns counts.
+    """
+    counts = {"removed": 0, "kept": 0, "missing": 0, "failed": 0}
+    if days <= 0:
+        return counts
+    cutoff = datetime.date.today() - datetime.timedelta(days=days)
+    db = SessionLocal()
+    try:
+        after = ""
+        while True:
+            digests = crud.get_blobs_past_retention(db, cutoff, after=after, limit=batch_size)
+            if not digests:
+                break
+            crud.mark_blobs_purged(db, digests)
+            db.commit()
+            remove_blob_files(db, digests, crud.purged_blob_digests, counts)
+            after = digests[-1]
+    finally:
+        db.close()
+    logger.info("Applied the retention policy to stored uploads", extra=counts)
+    return counts
+
+
+def iter_files(root, after=None, skip=()):
+    """
+    Yields (relative path, DirEntry) for every file under `root`, depth
+    first in sorted order, skipping top-level entries named in `skip`.
+    Only one directory's names are listed at a time. With `after` (a path
+    yielded earlier), the walk resumes right after it: directories that
+    sort entirely before it are not even opened.
+    """
+    after_parts = tuple(after.split("/")) if after else None
+
+    def walk(directory, parts):
+        try:
+            entries = sorted(os.scandir(directory), key=lambda entry: entry.name)
+        except FileNotFoundError:
+            return  # removed while we were walking
+        for entry in entries:
+            entry_parts = parts + (entry.name,)
+            if not parts and entry.name in skip:
+                continue
+            if after_parts and entry_parts <= after_parts and after_parts[:len(entry_parts)] != entry_parts:
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                yield from walk(entry.path, entry_parts)
+            elif entry.is_file(follow_symlinks=False):
+                if after_parts and entry_parts <= after_parts:
+                    continue
+                yield "/".join(entry_parts), entry
+
+    yield from walk(root, ())
+
+
+def _saved_path_candidates(rel_path):
+    """Spellings of saved_path that point at `rel_path` under the storage root."""
+    # Rows uploaded on Windows join the root with a backslash (backend/uploads\\1.jpg)
+    backslashed = rel_path.replace("/", "\\")
+    return {f"{STORAGE_ROOT}/{rel_path}", f"{STORAGE_ROOT}\\{backslashed}",
+            f"{STORAGE_ROOT}\\{backslashed}".replace("/", "\\")}
+
+
+def _is_orphan(kind, rel_path, live_digests, used_paths):
+    if kind == "blobs":
+        digest = rel_path.rsplit("/", 1)[-1]
+        return not (digest in live_digests and get_storage().path_for(digest) == os.path.join(STORAGE_ROOT, rel_path))
+    if kind == "tmp":
+        return True  # left behind by an interrupted save
+    return not (_saved_path_candidates(rel_path) & used_paths)
+
+
+def _collect_file_batch(db, run, batch):
+    """Classifies one batch of walked files, removing orphans if the run says so, and checkpoints the run."""
+    blob_names = [rel_path.rsplit("/", 1)[-1] for rel_path, _ in batch if rel_path.startswith("blobs/")]
+    other_paths = set()
+    for rel_path, _ in batch:
+        if not rel_path.startswith(("blobs/", "tmp/")):
+            other_paths |= _saved_path_candidates(rel_path)
+    live_digests = crud.live_blob_digests(db, blob_names)
+    used_paths = crud.referenced_paths(db, other_paths)
+
+    young_after = time.time() - ORPHAN_GRACE_SECONDS
+    for rel_path, entry in batch:
+        kind = rel_path.split("/", 1)[0] if "/" in rel_path else ""
+        if not _is_orphan(kind, rel_path, live_digests, used_paths):
+            continue
+        try:
+            stat = entry.stat(follow_symlinks=False)
+        except FileNotFoundError:
+            continue
+        if stat.st_mtime > young_after:
+            continue
+        run.orphan_files += 1
+        run.orphan_bytes += stat.st_size
+        if not run.delete_orphans:
+            logger.info("Orphaned upload file %s (%d bytes)", rel_path, stat.st_size)
+            continue
+        try:
+            os.remove(entry.path)
+            run.removed_files += 1
+        except FileNotFoundError:
+            pass
+        except OSError:
+            logger.exception("Could not remove orphaned file %s", rel_path)
+
+    run.files_scanned += len(batch)
+    run.file_cursor = batch[-1][0]
+    run.updated_at = datetime.datetime.utcnow()
+    db.commit()
+
+
+def _collect_receipt_batch(db, run, rows):
+    """Counts receipts in `rows` whose file is gone (and not removed on purpose) and checkpoints the run."""
+    missing = json.loads(run.missing_receipt_ids or "[]")
+    for row in rows:
+        path = row.saved_path or ""
+        if row.purged or os.path.exists(path) or os.path.exists(path.replace("\\", "/")):
+            continue
+        run.missing_files += 1
+        if len(missing) < _MISSING_SAMPLE_SIZE:
+            missing.append(row.id)
+    run.missing_receipt_ids = json.dumps(missing)
+    run.receipts_scanned += len(rows)
+    run.receipt_cursor = rows[-1].id
+    run.updated_at = datetime.datetime.utcnow()
+    db.commit()
+
+
+def collect_orphans(delete_orphans=False, batch_size=LIFECYCLE_BATCH_SIZE):
+    """
+    Runs (or resumes) an orphan collection: first the files on disk
+    against the blob and receipt rows, then the receipt rows against the
+    files on disk. Upload sessions are left to sweep_expired_sessions.
+    Returns the id of the StorageGcRun.
+    """
+    skip = set()
+    sessions = os.path.relpath(UPLOAD_SESSION_DIR, STORAGE_ROOT)
+    if not sessions.startswith(".."):
+        skip.add(sessions.split(os.sep, 1)[0])
+
+    db = SessionLocal()
+    try:
+        run = crud.start_storage_gc_run(db, delete_orphans=delete_orphans)
+        run_id = run.id
+        try:
+            if run.phase == "files":
+                batch = []
+                for item in iter_files(STORAGE_ROOT, after=run.file_cursor, skip=skip):
+                    batch.append(item)
+                    if len(batch) >= batch_size:
+                        _collect_file_batch(db, run, batch)
+                        batch = []
+                if batch:
+                    _collect_file_batch(db, run, batch)
+                run.phase = "receipts"
+                db.commit()
+
+            while True:
+                rows = crud.get_receipt_files(db, after_id=run.receipt_cursor, limit=batch_size)
+                if not rows:
+                    break
+                _collect_receipt_batch(db, run, rows)
+
+            run.status = "completed"
+            run.finished_at = datetime.datetime.utcnow()
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            run = crud.get_storage_gc_run(db, run_id)
+            run.status = "failed"
+            run.error = str(e)
+            db.commit()
+            raise
+        logger.info("Collected orphaned upload files", extra={
+            "run_id": run_id, "files_scanned": run.files_scanned, "orphan_files": run.orphan_files,
+            "removed_files": run.removed_files, "missing_files": run.missing_files,
+        })
+        return run_id
+    finally:
+        db.close()
+
+
+def run_lifecycle(recompress=True, retention=True, gc=True, delete_orphans=False):
+    """One pass of every enabled step, in order. Returns each step's result."""
+    results = {"expired_sessions": sweep_expired_sessions(),
+               "released_blobs": sweep_released_blobs()}
+    if recompress:
+        results["recompression"] = recompress_blobs()
+    if retention:
+        results["retention"] = apply_retention()
+    if gc:
+        results["gc_run_id"] = collect_orphans(delete_orphans=delete_orphans)
+    return results
@@ -0,0 +1,184 @@
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import uuid
+import zlib
+
+# Level for the service's own loggers (backend.*): DEBUG, INFO, WARNING, ...
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "json" (one object per line, for log shippers) or "text" (for a terminal)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+# Records buffered for the writer thread; when full, new records are dropped
+# (and counted) rather than blocking the request that logged them.
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Share of requests whose large payloads (OCR text, file contents) are logged;
+# the others log only the payload's size. Decided once per correlation id.
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "0.05"))
+# Longest payload excerpt written; the rest is replaced by a length marker.
+LOG_PAYLOAD_MAX_CHARS = int(os.getenv("LOG_PAYLOAD_MAX_CHARS", "500"))
+
+# Correlation id of the request / job being handled, added to every record
+request_id_var = contextvars.ContextVar("request_id", default=None)
+
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id"}
+
+
+class _ContextFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if record.request_id:
+            entry["request_id"] = record.request_id
+        # Anything passed through extra={...} becomes a field
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class _TextFormatter(logging.Formatter):
+    def format(self, record):
+        fields = " ".join(f"{key}={value!r}" for key, value in record.__dict__.items()
+                          if key not in _STANDARD_ATTRS and not key.startswith("_"))
+        line = f"{self.formatTime(record, '%H:%M:%S')} {record.levelname:<7} {record.name}"
+        if record.request_id:
+            line += f" [{record.request_id}]"
+        line += f" {record.getMessage()}" + (f" {fields}" if fields else "")
+        if record.exc_text:
+            line += "\n" + record.exc_text
+        return line
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that never blocks: records that don't fit are counted and
+    dropped. The first record that fits again is followed by a warning
+    with the number lost since the last one.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self.reported = 0  # drops already announced in the log
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return
+        if self.dropped > self.reported:
+            try:
+                self.queue.put_nowait(self.dropped_notice())
+                self.reported = self.dropped
+            except queue.Full:
+                pass  # announced with the next record that fits
+
+    def dropped_notice(self):
+        notice = logging.LogRecord(__name__, logging.WARNING, __file__, 0,
+                                   "%d log records dropped: the log queue was full", (self.dropped - self.reported,), None)
+        notice.request_id = None
+        notice.dropped_total = self.dropped
+        return self.prepare(notice)
+
+    def prepare(self, record):
+        # Render args and traceback now (they may not survive the trip to the
+        # writer thread), keeping the message and the traceback apart.
+        record = copy.copy(record)
+        record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+_listener = None
+_handler = None  # its .dropped counts records lost to a full queue
+_configured_pid = None
+
+
+def configure_logging():
+    """
+    Routes the backend.* loggers through a bounded in-memory queue to a
+    writer thread, so logging never waits on stdout. Safe to call more
+    than once; call again in a forked child (the writer thread doesn't
+    survive a fork).
+    """
+    global _listener, _handler, _configured_pid
+    if _configured_pid == os.getpid():
+        return
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(_JsonFormatter() if LOG_FORMAT == "json" else _TextFormatter())
+
+    _handler = _DroppingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    _handler.addFilter(_ContextFilter())
+    _listener = logging.handlers.QueueListener(_handler.queue, stream_handler, respect_handler_level=False)
+    _listener.start()
+    # atexit runs these last-registered first: flush the queue, then report drops nobody heard about
+    atexit.register(_report_dropped_at_exit, _handler, stream_handler)
+    atexit.register(_listener.stop)
+
+    root = logging.getLogger("backend")
+    for old in list(root.handlers):
+        root.removeHandler(old)
+    root.addHandler(_handler)
+    root.setLevel(LOG_LEVEL)
+    root.propagate = False
+    _configured_pid = os.getpid()
+
+
+def _report_dropped_at_exit(handler, stream_handler):
+    if handler.dropped > handler.reported:
+        stream_handler.handle(handler.dropped_notice())
+        handler.reported = handler.dropped
+
+
+def new_request_id():
+    return uuid.uuid4().hex[:16]
+
+
+def payload_sampled():
+    """Whether this request / job logs full payloads; the same answer for all its records."""
+    request_id = request_id_var.get()
+    if request_id is None:
+        return random.random() < LOG_PAYLOAD_SAMPLE_RATE
+    return zlib.crc32(request_id.encode("utf-8")) % 10_000 < LOG_PAYLOAD_SAMPLE_RATE * 10_000
+
+
+def truncate(text, limit=LOG_PAYLOAD_MAX_CHARS):
+    if text is None or len(text) <= limit:
+        return text
+    return f"{text[:limit]}...(+{len(text) - limit} chars)"
+
+
+def log_payload(logger, message, payload, level=logging.DEBUG, **fields):
+    """
+    Logs a large payload (such as OCR text): its size always, the text itself
+    only for sampled requests and truncated to LOG_PAYLOAD_MAX_CHARS. Costs
+    nothing when `level` is disabled.
+    """
+    if not logger.isEnabledFor(level):
+        return
+    fields["payload_chars"] = len(payload) if payload is not None else 0
+    if payload and payload_sampled():
+        fields["payload"] = truncate(payload)
+    logger.log(level, message, extra=fields)
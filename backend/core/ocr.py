@@ -1,16 +1,54 @@
-import pytesseract
-from PIL import Image
-from pdf2image import convert_from_path
-import cv2
-import numpy as np
+import logging
 import re
 import os
+import subprocess
+
+from backend.core.categorizer import categorize
+from backend.core.dates import find_date
+from backend.core.language import (
+    OCR_DEFAULT_LANG, OCR_OSD_MIN_CONFIDENCE, cached_language, detect_script,
+    language_for_script, language_for_text, remember_language
+)
+from backend.core.logs import log_payload
+
+logger = logging.getLogger(__name__)
+
+# pytesseract, PIL, pdf2image, cv2 and numpy are imported inside the functions
+# that use them, so processes that never run OCR (read-only API replicas)
+# don't pay their import time and memory. Python caches the modules after
+# the first call, so later calls only cost a dict lookup.
+
+# Directory holding poppler's binaries (pdftotext, pdftoppm, pdfinfo); None = on PATH.
+POPPLER_PATH = os.getenv("POPPLER_PATH") or None
+# A PDF page needs at least this many letters/digits in its text layer to skip OCR.
+PDF_MIN_TEXT_CHARS = int(os.getenv("PDF_MIN_TEXT_CHARS", "20"))
+PDF_TEXT_TIMEOUT = 60
+
+# Receipt detection / crop / deskew / downscale before OCR (see prepare_receipt_image)
+OCR_RECEIPT_CROP = os.getenv("OCR_RECEIPT_CROP", "1") not in ("0", "false", "False")
+# Tesseract reads best when capital letters are roughly this many pixels tall
+OCR_TARGET_TEXT_HEIGHT = int(os.getenv("OCR_TARGET_TEXT_HEIGHT", "32"))
+_DETECT_MAX_SIDE = 1000
+
+def _poppler_tool(name):
+    return os.path.join(POPPLER_PATH, name) if POPPLER_PATH else name
+
+def load_ocr_dependencies():
+    """Eagerly import the OCR stack, e.g. at OCR-worker startup."""
+    import pytesseract  # noqa: F401
+    import cv2  # noqa: F401
+    import numpy  # noqa: F401
+    from PIL import Image  # noqa: F401
+    from pdf2image import convert_from_path  # noqa: F401
 
 def preprocess_image_opencv(file_path):
     """
     Advanced preprocessing using OpenCV to enhance image quality for OCR.
     Steps: grayscale, adaptive threshold, denoising, sharpening.
     """
+    import cv2
+    import numpy as np
+
     img = cv2.imread(file_path)
     if img is None:
         return None
@@ -31,70 +69,399 @@ def preprocess_image_opencv(file_path):
     cv2.imwrite(temp_path, sharpened)
     return temp_path
 
-def ocr_image(file_path, lang="eng"):
+def _order_corners(points):
+    """Orders 4 points as top-left, top-right, bottom-right, bottom-left."""
+    import numpy as np
+
+    points = points.reshape(4, 2).astype(np.float32)
+    sums = points.sum(axis=1)
+    diffs = np.diff(points, axis=1).ravel()
+    return np.array([
+        points[np.argmin(sums)], points[np.argmin(diffs)],
+        points[np.argmax(sums)], points[np.argmax(diffs)]
+    ], dtype=np.float32)
+
+def find_receipt_quad(img):
+    """
+    Locates the paper receipt in a photo: the largest bright region on a
+    darker background, found on a downscaled copy. Returns its 4 corners in
+    full-resolution coordinates, or None if no convincing receipt was found.
+    """
+    import cv2
+    import numpy as np
+
+    height, width = img.shape[:2]
+    scale = min(1.0, _DETECT_MAX_SIDE / max(height, width))
+    small = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else img
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+    blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+    _, mask = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    # Close the gaps printed text leaves in the paper mask
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (15, 15))
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None
+    contour = max(contours, key=cv2.contourArea)
+    area = cv2.contourArea(contour)
+    frame_area = small.shape[0] * small.shape[1]
+    # Too small: not a receipt. Nearly the whole frame: already cropped, nothing to gain.
+    if area < 0.05 * frame_area or area > 0.9 * frame_area:
+        return None
+
+    approx = cv2.approxPolyDP(contour, 0.02 * cv2.arcLength(contour, True), True)
+    if len(approx) == 4 and cv2.isContourConvex(approx):
+        quad = approx.reshape(4, 2)
+    else:
+        quad = cv2.boxPoints(cv2.minAreaRect(contour))
+    quad = _order_corners(quad / scale)
+    # Pad outward a little: Otsu tends to shave off dim paper edges and the glyphs on them
+    centre = quad.mean(axis=0)
+    quad = centre + (quad - centre) * 1.04
+    quad[:, 0] = np.clip(quad[:, 0], 0, width - 1)
+    quad[:, 1] = np.clip(quad[:, 1], 0, height - 1)
+    return quad
+
+def crop_to_quad(img, quad):
+    """Perspective-warps the quad to an upright rectangle: crop and deskew in one pass."""
+    import cv2
+    import numpy as np
+
+    tl, tr, br, bl = quad
+    width = int(max(np.linalg.norm(br - bl), np.linalg.norm(tr - tl)))
+    height = int(max(np.linalg.norm(tr - br), np.linalg.norm(tl - bl)))
+    target = np.array([[0, 0], [width - 1, 0], [width - 1, height - 1], [0, height - 1]], dtype=np.float32)
+    matrix = cv2.getPerspectiveTransform(quad, target)
+    return cv2.warpPerspective(img, matrix, (width, height), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
+def estimate_text_height(gray):
+    """
+    Median height of character-sized connected components (in pixels),
+    computed in one vectorised pass over the component stats. None if unknown.
+    """
+    import cv2
+    import numpy as np
+
+    binary = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, 31, 15)
+    count, _, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+    if count <= 1:
+        return None
+    widths = stats[1:, cv2.CC_STAT_WIDTH]
+    heights = stats[1:, cv2.CC_STAT_HEIGHT]
+    # Character-like blobs: not specks, not lines or borders, roughly glyph-shaped
+    glyphs = (heights >= 6) & (heights <= gray.shape[0] // 8) & (widths <= heights * 3) & (widths >= 2)
+    if np.count_nonzero(glyphs) < 20:
+        return None
+    return float(np.median(heights[glyphs]))
+
+def prepare_receipt_image(file_path, target_text_height=OCR_TARGET_TEXT_HEIGHT):
+    """
+    Finds the receipt in a photo, crops and deskews it, converts to grayscale
+    and downscales so text is about `target_text_height` pixels tall, so
+    tesseract spends its time on text rather than table or background
+    pixels. Never upscales. Returns a grayscale NumPy array, or None if the
+    file can't be read.
+    """
+    import cv2
+
+    img = cv2.imread(file_path)
+    if img is None:
+        return None
+    quad = find_receipt_quad(img)
+    if quad is not None:
+        img = crop_to_quad(img, quad)
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+    text_height = estimate_text_height(gray)
+    if text_height and text_height > target_text_height:
+        scale = target_text_height / text_height
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return gray
+
+def select_language(image, vendor=None, source=None):
+    """
+    Picks one tesseract model for a document: the one remembered for its
+    vendor or source, otherwise from an orientation and script detection
+    pass. Returns (lang, image, how); the image comes back upright when OSD
+    found it rotated.
+    """
+    lang = cached_language(vendor, source)
+    if lang:
+        return lang, image, "cached"
+    osd = detect_script(image)
+    if osd is None or osd["script_conf"] < OCR_OSD_MIN_CONFIDENCE:
+        return OCR_DEFAULT_LANG, image, "default"
+    if osd["rotate"] and osd["orientation_conf"] >= OCR_OSD_MIN_CONFIDENCE:
+        # OSD reports the clockwise rotation that makes the page upright
+        image = image.rotate(-osd["rotate"], expand=True)
+    return language_for_script(osd["script"]), image, "osd"
+
+def _ocr_with_language(image, lang, vendor, source):
+    """
+    OCR of a PIL image with one model. A cached model that reads poorly
+    (e.g. the vendor changed language) is re-checked with OSD once.
+    Returns (text, lang, how).
+    """
+    import pytesseract
+
+    how = "given"
+    if lang is None:
+        lang, image, how = select_language(image, vendor, source)
+    text = pytesseract.image_to_string(image, lang=lang)
+    if how == "cached" and not _has_usable_text(text):
+        detected, upright, _ = select_language(image)
+        if detected != lang:
+            text, lang, how = pytesseract.image_to_string(upright, lang=detected), detected, "osd"
+    if how != "given" and _has_usable_text(text):
+        remember_language(lang, source=source)
+    return text, lang, how
+
+def ocr_image(file_path, lang=None, prepare=OCR_RECEIPT_CROP, vendor=None, source=None):
     """
     OCR for image files with OpenCV preprocessing fallback.
+    With `prepare`, the receipt is first cropped, deskewed and downscaled.
+    With no `lang`, the model is chosen per document (see select_language).
     """
+    return ocr_image_with_details(file_path, lang, prepare, vendor, source)[0]
+
+def ocr_image_with_details(file_path, lang=None, prepare=OCR_RECEIPT_CROP, vendor=None, source=None):
+    """Like ocr_image, but also returns the model used and how it was chosen."""
+    from PIL import Image
+
+    details = {"method": "ocr", "language": lang, "language_source": "given" if lang else None}
     try:
-        # Try direct OCR first
-        image = Image.open(file_path)
-        text = pytesseract.image_to_string(image, lang=lang)
+        # Try direct OCR first (on the cropped receipt when available)
+        prepared = prepare_receipt_image(file_path) if prepare else None
+        image = Image.fromarray(prepared) if prepared is not None else Image.open(file_path)
+        text, lang, how = _ocr_with_language(image, lang, vendor, source)
+        details.update(language=lang, language_source=how)
         if not text.strip():
             # Try advanced OpenCV preprocessing if OCR result is empty
             preprocessed_path = preprocess_image_opencv(file_path)
             if preprocessed_path:
+                import pytesseract
                 image = Image.open(preprocessed_path)
                 text = pytesseract.image_to_string(image, lang=lang)
+                details["method"] = "ocr_preprocessed"
                 try:
                     os.remove(preprocessed_path)
                 except Exception:
                     pass
-        print("OCR Output:", text)  # Debug: print OCR result
-        return text
-    except Exception as e:
-        print(f"OCR failed for image: {e}")
-        return ""
+        log_payload(logger, "OCR output", text, method=details.get("method"), language=details.get("language"))
+        return text, details
+    except Exception:
+        logger.exception("OCR failed for image", extra={"file": file_path})
+        return "", details
 
-def ocr_pdf(file_path, lang="eng"):
+def extract_pdf_text_layer(file_path):
     """
-    OCR for PDFs; convert each page to image and apply OCR + preprocessing.
+    Embedded (digital) text of each PDF page via poppler's pdftotext, which is
+    installed alongside the pdftoppm that pdf2image uses. Returns one string
+    per page, or [] if pdftotext is unavailable or fails.
     """
-    text = ""
     try:
-        images = convert_from_path(file_path)
-        for idx, img in enumerate(images):
-            page_text = pytesseract.image_to_string(img, lang=lang)
-            if not page_text.strip():
-                # Save PIL Image to OpenCV format for preprocessing
-                temp_img_path = f"{file_path}_page{idx}.png"
-                img.save(temp_img_path)
-                preprocessed_path = preprocess_image_opencv(temp_img_path)
-                if preprocessed_path:
-                    image = Image.open(preprocessed_path)
-                    page_text = pytesseract.image_to_string(image, lang=lang)
-                    try:
-                        os.remove(preprocessed_path)
-                        os.remove(temp_img_path)
-                    except Exception:
-                        pass
-            text += page_text + "\n"
-        print("OCR Output:", text)  # Debug: print OCR result
-        return text
+        result = subprocess.run(
+            [_poppler_tool("pdftotext"), "-layout", "-enc", "UTF-8", file_path, "-"],
+            capture_output=True, check=True, timeout=PDF_TEXT_TIMEOUT
+        )
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.warning("PDF text layer extraction failed: %s", e, extra={"file": file_path})
+        return []
+    # Pages are separated by form feeds, and the last page is terminated by one too
+    pages = result.stdout.decode("utf-8", errors="replace").split("\f")
+    if pages and pages[-1] == "":
+        pages.pop()
+    return pages
+
+def _has_usable_text(page_text):
+    return sum(ch.isalnum() for ch in page_text) >= PDF_MIN_TEXT_CHARS
+
+def _ocr_pdf_page_image(img, file_path, idx, lang):
+    """
+    OCR one rasterised PDF page, retrying with OpenCV preprocessing if empty.
+    `lang` is a model, or a (vendor, source) pair to choose one from this page.
+    Returns (text, method, lang, how).
+    """
+    import pytesseract
+    from PIL import Image
+
+    if isinstance(lang, tuple):
+        page_text, lang, how = _ocr_with_language(img, None, *lang)
+    else:
+        page_text, how = pytesseract.image_to_string(img, lang=lang), "given"
+    method = "ocr"
+    if not page_text.strip():
+        # Save PIL Image to OpenCV format for preprocessing
+        temp_img_path = f"{file_path}_page{idx}.png"
+        img.save(temp_img_path)
+        preprocessed_path = preprocess_image_opencv(temp_img_path)
+        if preprocessed_path:
+            image = Image.open(preprocessed_path)
+            page_text = pytesseract.image_to_string(image, lang=lang)
+            method = "ocr_preprocessed"
+            try:
+                os.remove(preprocessed_path)
+                os.remove(temp_img_path)
+            except Exception:
+                pass
+    return page_text, method, lang, how
+
+def ocr_pdf_pages(file_path, lang=None, use_text_layer=True, vendor=None, source=None):
+    """
+    Text of each PDF page as a list of {"page", "method", "text", "language"} dicts.
+    Pages with a usable embedded text layer are read directly ("text_layer");
+    only the remaining pages are rasterised and OCR'd ("ocr" / "ocr_preprocessed").
+    With no `lang`, one model is chosen on the first OCR'd page and reused
+    for the rest of the document.
+    """
+    from pdf2image import convert_from_path, pdfinfo_from_path
+
+    chooser = (vendor, source)
+    layer = extract_pdf_text_layer(file_path) if use_text_layer else []
+    try:
+        page_count = int(pdfinfo_from_path(file_path, poppler_path=POPPLER_PATH)["Pages"])
+    except Exception:
+        page_count = len(layer)
+
+    def ocr_page(img, idx):
+        nonlocal lang
+        page_text, method, used, how = _ocr_pdf_page_image(img, file_path, idx, lang or chooser)
+        lang = used
+        return {"page": idx + 1, "method": method, "text": page_text, "language": used, "language_source": how}
+
+    if not page_count:
+        # Page count unknown: rasterise the whole document as before
+        return [ocr_page(img, idx) for idx, img in enumerate(convert_from_path(file_path, poppler_path=POPPLER_PATH))]
+
+    pages = []
+    for page_no in range(1, page_count + 1):
+        page_text = layer[page_no - 1] if page_no <= len(layer) else ""
+        if use_text_layer and _has_usable_text(page_text):
+            pages.append({"page": page_no, "method": "text_layer", "text": page_text,
+                          "language": language_for_text(page_text), "language_source": "text"})
+            continue
+        images = convert_from_path(file_path, first_page=page_no, last_page=page_no, poppler_path=POPPLER_PATH)
+        if images:
+            pages.append(ocr_page(images[0], page_no - 1))
+        else:
+            pages.append({"page": page_no, "method": "ocr", "text": "", "language": None, "language_source": None})
+    return pages
+
+def ocr_pdf(file_path, lang=None, use_text_layer=True):
+    """
+    Text of a PDF: embedded text where present, OCR + preprocessing for scanned pages.
+    """
+    return extract_pdf_with_details(file_path, lang, use_text_layer)[0]
+
+def extract_pdf_with_details(file_path, lang=None, use_text_layer=True, vendor=None, source=None):
+    """Like ocr_pdf, but also returns which path each page took and the document language."""
+    try:
+        pages = ocr_pdf_pages(file_path, lang=lang, use_text_layer=use_text_layer, vendor=vendor, source=source)
+        text = "".join(page["text"] + "\n" for page in pages)
+        details = {
+            "pages": [
+                {"page": page["page"], "method": page["method"], "chars": len(page["text"].strip()),
+                 "language": page["language"]}
+                for page in pages
+            ],
+            "language": next((page["language"] for page in pages if page["language"]), None),
+            "language_source": next((page["language_source"] for page in pages if page["language"]), None),
+        }
+        log_payload(logger, "PDF text", text, pages=len(pages), language=details["language"])
+        return text, details
     except Exception as e:
-        print(f"OCR failed for PDF: {e}")
-        return ""
+        logger.exception("OCR failed for PDF", extra={"file": file_path})
+        return "", {"pages": [], "error": str(e), "language": None}
 
 def parse_text_file(file_path):
     """Parse text from .txt files directly."""
     try:
         with open(file_path, "r", encoding="utf-8") as f:
             text = f.read()
-            print("Text file content:", text)  # Debug
+            log_payload(logger, "Text file content", text)
             return text
     except Exception as e:
-        print(f"Text file parsing failed: {e}")
+        logger.warning("Text file parsing failed: %s", e, extra={"file": file_path})
         return ""
 
+def extract_text(file_path, content_type):
+    """Runs the OCR / text extraction path matching the upload's content type."""
+    return extract_text_with_details(file_path, content_type)[0]
+
+def extract_text_with_details(file_path, content_type, vendor=None, source=None):
+    """
+    Like extract_text, but also returns a dict describing how the text was
+    obtained (for PDFs: the path each page took) and its "language" (the
+    tesseract model used, or the one matching a text file's script).
+    `vendor` / `source` select a cached OCR model and skip script detection.
+    """
+    if content_type in ["image/jpeg", "image/png"]:
+        return ocr_image_with_details(file_path, vendor=vendor, source=source)
+    elif content_type == "application/pdf":
+        return extract_pdf_with_details(file_path, vendor=vendor, source=source)
+    elif content_type == "text/plain":
+        text = parse_text_file(file_path)
+        return text, {"method": "text_file", "language": language_for_text(text) if text.strip() else None}
+    return "", {"method": None, "language": None}
+
+# Lines that carry a price but are not purchased items
+_NON_ITEM_LINE = re.compile(
+    r'\b(sub\s*-?\s*total|total|tax|vat|gst|cgst|sgst|change|cash|card|visa|mastercard|amex|'
+    r'balance|amount\s+due|tender|discount|savings|you\s+saved|payment|debit|credit|rounding)\b',
+    re.IGNORECASE
+)
+_MONEY = r'-?[₹$€£]?\s?(?:\d{1,3}(?:,\d{3})+|\d+)[.,]\d{2}'
+# "MILK 2% GAL   2 x 3.49   6.98 F" - quantity/unit price optional, trailing tax flag ignored
+_ITEM_LINE = re.compile(
+    r'^(?P<description>.*?[A-Za-z].*?)\s+'
+    r'(?:(?P<quantity>\d+(?:\.\d+)?)\s*(?:[xX@*]|pcs?|ea)\s*(?P<unit_price>' + _MONEY + r')\s+)?'
+    r'(?P<total>' + _MONEY + r')\s*[A-Z]{0,2}$'
+)
+# "2 x MILK 6.98"
+_QTY_FIRST_ITEM_LINE = re.compile(
+    r'^(?P<quantity>\d+(?:\.\d+)?)\s*[xX@*]\s+(?P<description>.*?[A-Za-z].*?)\s+(?P<total>' + _MONEY + r')\s*[A-Z]{0,2}$'
+)
+
+def _parse_money(value):
+    value = re.sub(r'[₹$€£\s]', '', value)
+    if ',' in value and '.' in value:
+        value = value.replace(',', '')
+    else:
+        value = value.replace(',', '.')
+    return float(value)
+
+def parse_line_items(lines):
+    """
+    Extracts purchased line items (description, quantity, unit price, total)
+    from receipt lines. Totals, taxes and tender lines are skipped.
+    """
+    items = []
+    for line in lines:
+        line = line.strip()
+        if not line or _NON_ITEM_LINE.search(line):
+            continue
+        match = _QTY_FIRST_ITEM_LINE.match(line) or _ITEM_LINE.match(line)
+        if not match:
+            continue
+        groups = match.groupdict()
+        try:
+            total = _parse_money(groups["total"])
+            quantity = float(groups["quantity"]) if groups.get("quantity") else 1.0
+            if groups.get("unit_price"):
+                unit_price = _parse_money(groups["unit_price"])
+            else:
+                unit_price = round(total / quantity, 4) if quantity else total
+        except (ValueError, ZeroDivisionError):
+            continue
+        items.append({
+            "description": groups["description"].strip(" .:-"),
+            "quantity": quantity,
+            "unit_price": unit_price,
+            "total": total
+        })
+    return items
+
 def parse_receipt_text(text):
     """
     Rule-based extraction logic for receipts/bills (regex).
@@ -105,12 +472,13 @@ def parse_receipt_text(text):
     category = None
     currency = None
 
+    lines = text.splitlines()
+
     vendor_match = re.search(r'(?:Vendor|Biller|Store|Payee)\s*[:\-]\s*(.+)', text, re.IGNORECASE)
     if vendor_match:
         vendor = vendor_match.group(1).strip()
     else:
         # Fallback: first line as vendor if it's not empty
-        lines = text.splitlines()
         for line in lines:
             candidate = line.strip()
             # Look for lines that are likely vendor names (not empty and not numeric)
@@ -118,9 +486,10 @@ def parse_receipt_text(text):
                 vendor = candidate
                 break
 
-    date_match = re.search(r'(\d{4}[/-]\d{2}[/-]\d{2}|\d{2}[/-]\d{2}[/-]\d{4})', text)
-    if date_match:
-        date = date_match.group(1)
+    # Any common receipt date shape; normalised to ISO so storage doesn't re-guess the order
+    _, parsed_date = find_date(text, vendor)
+    if parsed_date:
+        date = parsed_date.isoformat()
 
     amount_match = re.search(r'([₹$€£]\s?\d+[.,]?\d*)', text)
     if amount_match:
@@ -144,16 +513,14 @@ def parse_receipt_text(text):
                     currency = currency.group(0)
                 break
 
-    if vendor:
-        if any(word in vendor.lower() for word in ["electricity", "power", "energy"]):
-            category = "Utilities"
-        elif any(word in vendor.lower() for word in ["grocery", "mart", "food", "whole foods", "walmart"]):
-            category = "Groceries"
+    # Vendor and keyword rules from category_rules.json, matched in one pass each
+    category = categorize(vendor, text)
 
     return {
         "vendor": vendor,
         "date": date,
         "amount": amount,
         "category": category,
-        "currency": currency
+        "currency": currency,
+        "items": parse_line_items(lines)
     }
\ No newline at end of file
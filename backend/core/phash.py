@@ -0,0 +1,96 @@
+from itertools import combinations
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Hashes within this many differing bits are treated as the same paper receipt.
+PHASH_MAX_DISTANCE = int(os.getenv("PHASH_MAX_DISTANCE", "6"))
+
+# The 64-bit hash is split into PHASH_BANDS bands of PHASH_BAND_BITS bits, each
+# stored in its own indexed column (multi-index hashing). If two hashes differ
+# in at most d bits, at least one band differs in at most d // PHASH_BANDS bits,
+# so probing every band with that small radius finds all matches exactly.
+PHASH_BANDS = 4
+PHASH_BAND_BITS = 16
+_BAND_MASK = (1 << PHASH_BAND_BITS) - 1
+
+
+def dhash_image(image, hash_size=8):
+    """
+    Difference hash of a PIL image: shrink to (hash_size + 1) x hash_size
+    grayscale and record whether each pixel is brighter than its right neighbour.
+    Robust to rescaling, recompression and small lighting changes.
+    """
+    from PIL import Image
+
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def compute_phash(file_path, content_type):
+    """
+    Perceptual hash for an uploaded image or the first page of a PDF.
+    Returns None for text files or when the file cannot be decoded.
+    """
+    try:
+        # Imported lazily so crud (which only needs the band helpers) stays
+        # light, and inside the try so a host without pdf2image skips the hash
+        if content_type in ["image/jpeg", "image/png"]:
+            from PIL import Image
+
+            with Image.open(file_path) as image:
+                return dhash_image(image)
+        if content_type == "application/pdf":
+            from pdf2image import convert_from_path
+            from backend.core.ocr import POPPLER_PATH
+
+            pages = convert_from_path(
+                file_path, dpi=72, first_page=1, last_page=1, poppler_path=POPPLER_PATH
+            )
+            if pages:
+                return dhash_image(pages[0])
+    except Exception as e:
+        logger.warning("Perceptual hash failed: %s", e, extra={"file": file_path})
+    return None
+
+
+def hamming_distance(a, b):
+    """Number of differing bits between two 64-bit hashes."""
+    return bin((a ^ b) & 0xFFFFFFFFFFFFFFFF).count("1")
+
+
+def to_signed64(value):
+    """SQLite INTEGER is signed 64-bit; store the unsigned hash in that range."""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def from_signed64(value):
+    return value & 0xFFFFFFFFFFFFFFFF
+
+
+def split_bands(value):
+    """Split a 64-bit hash into PHASH_BANDS integers, most significant first."""
+    value = from_signed64(value)
+    return [
+        (value >> (PHASH_BAND_BITS * (PHASH_BANDS - 1 - i))) & _BAND_MASK
+        for i in range(PHASH_BANDS)
+    ]
+
+
+def band_neighbours(band, radius):
+    """All band values within `radius` bit flips of `band` (including itself)."""
+    values = [band]
+    for r in range(1, radius + 1):
+        for bits in combinations(range(PHASH_BAND_BITS), r):
+            flipped = band
+            for bit in bits:
+                flipped ^= 1 << bit
+            values.append(flipped)
+    return values
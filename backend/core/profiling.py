@@ -0,0 +1,233 @@
+"""
+Opt-in profiling: a sampling stack profiler that writes collapsed
+("folded") stacks, the input format of flamegraph.pl, speedscope and
+inferno. Nothing here runs unless PROFILING_ENABLED is set; backend/main.py
+only installs the middleware and the /debug/profile routes in that case.
+
+A sampler thread reads every other thread's current stack with
+sys._current_frames() at a fixed interval, so the profiled code runs
+unmodified (no tracing hooks) and the overhead is proportional to the
+sampling rate, not to how many calls the code makes. Work handed to the
+threadpool (OCR, PDF rendering) is captured too, which a cProfile of the
+event loop thread would miss. Request profiles sample the whole process:
+on a busy replica, concurrent requests show up in them as well.
+"""
+import os
+import re
+import socket
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+# Master switch for request profiling (header / toggle) and the /debug routes.
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") in ("1", "true", "True")
+# Where profiles are written, one .folded file each.
+PROFILE_DIR = os.getenv("PROFILE_DIR", "backend/profiles")
+# Seconds between stack samples of a profiled request / of an OCR worker.
+PROFILE_REQUEST_INTERVAL = float(os.getenv("PROFILE_REQUEST_INTERVAL", "0.005"))
+PROFILE_WORKER_INTERVAL = float(os.getenv("PROFILE_WORKER_INTERVAL", "0.02"))
+# How often (seconds) a long-running worker profile is rewritten to disk.
+PROFILE_WORKER_FLUSH_SECONDS = float(os.getenv("PROFILE_WORKER_FLUSH_SECONDS", "60"))
+# Request header that asks for a profile of that one request.
+PROFILE_HEADER = "X-Profile"
+
+_PROFILE_ID = re.compile(r"^[A-Za-z0-9_.-]+$")
+# Leaf frames of threads that are parked, not working (thread pools, log writer)
+_IDLE_FILES = ("threading.py", "queue.py")
+
+
+def _frame_label(code):
+    path = code.co_filename
+    if path.startswith("<"):
+        return f"{path.strip('<>').replace('frozen ', '')}.{code.co_name}"  # "<frozen importlib._bootstrap>"
+    module = os.path.splitext(os.path.basename(path))[0]
+    # Show package-relative names for our own code, bare module names elsewhere
+    marker = path.rfind("backend" + os.sep)
+    if marker >= 0:
+        module = os.path.splitext(path[marker:])[0].replace(os.sep, ".")
+    return f"{module}.{code.co_name}"
+
+
+class StackSampler:
+    """
+    Samples the stacks of all other threads every `interval` seconds on a
+    daemon thread and counts identical stacks. Threads sitting idle in
+    threading / queue waits, and an idle asyncio loop, are not counted.
+    """
+
+    def __init__(self, interval=PROFILE_REQUEST_INTERVAL):
+        self.interval = interval
+        self.counts = Counter()
+        self.samples = 0
+        self.started_at = None
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.started_at = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.elapsed = time.monotonic() - self.started_at
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        own = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        stacks = []
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            leaf = frame.f_code
+            if os.path.basename(leaf.co_filename) in _IDLE_FILES:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            if leaf.co_name == "select" and any(label.endswith("._run_once") for label in labels[:3]):
+                continue  # event loop waiting for I/O
+            labels.append(names.get(ident, f"thread-{ident}"))
+            stacks.append(";".join(reversed(labels)))
+        with self._lock:
+            self.samples += 1
+            self.counts.update(stacks)
+
+    def folded(self):
+        """Collapsed stacks, "thread;outer;...;inner count" per line."""
+        with self._lock:
+            return "".join(f"{stack} {count}\n" for stack, count in self.counts.most_common())
+
+    def top_functions(self, limit=15):
+        """[(function, share of samples)] by time spent in the function itself."""
+        with self._lock:
+            own = Counter()
+            for stack, count in self.counts.items():
+                own[stack.rsplit(";", 1)[-1]] += count
+            total = sum(own.values()) or 1
+            return [(name, round(count / total, 3)) for name, count in own.most_common(limit)]
+
+    def write(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.folded())
+        os.replace(tmp_path, path)  # readers never see a half-written profile
+        return path
+
+
+def profile_path(profile_id):
+    if not _PROFILE_ID.match(profile_id):
+        raise ValueError(f"Invalid profile id '{profile_id}'")
+    return os.path.join(PROFILE_DIR, f"{profile_id}.folded")
+
+
+def list_profiles(limit=50):
+    """Most recent profiles first: [{"id", "bytes", "modified"}]."""
+    try:
+        entries = [entry for entry in os.scandir(PROFILE_DIR) if entry.name.endswith(".folded")]
+    except FileNotFoundError:
+        return []
+    entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    return [{"id": entry.name[:-len(".folded")], "bytes": entry.stat().st_size,
+             "modified": entry.stat().st_mtime} for entry in entries[:limit]]
+
+
+class RequestProfiler:
+    """
+    Decides which requests are profiled and runs one profile at a time
+    (overlapping samplers would each see the other's request anyway).
+    A request is profiled when it sends the X-Profile header, or while the
+    /debug/profile toggle has requests left for a matching path.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._busy = False
+        self.armed = 0
+        self.path_prefix = "/api/"
+        self.last = None  # summary of the most recent profile
+
+    def arm(self, requests, path_prefix="/api/"):
+        with self._lock:
+            self.armed = max(0, requests)
+            self.path_prefix = path_prefix
+
+    def try_begin(self, path, header_value):
+        """True if this request should be profiled and the sampler was free (then call end())."""
+        wanted = header_value is not None and header_value.lower() not in ("0", "false", "")
+        with self._lock:
+            if not wanted and not (self.armed and path.startswith(self.path_prefix)):
+                return False
+            if self._busy:
+                return False
+            if not wanted:
+                self.armed -= 1
+            self._busy = True
+            return True
+
+    def end(self):
+        with self._lock:
+            self._busy = False
+
+    def state(self):
+        return {"enabled": PROFILING_ENABLED, "armed_requests": self.armed, "path_prefix": self.path_prefix,
+                "busy": self._busy, "last": self.last, "profiles": list_profiles()}
+
+
+def new_profile_id(prefix="req"):
+    return f"{prefix}-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+
+
+class WorkerProfiler:
+    """
+    Continuous low-rate sampling of an OCR worker process. The cumulative
+    profile is rewritten every PROFILE_WORKER_FLUSH_SECONDS and on stop, to
+    PROFILE_DIR/ocr-worker-<host>-<pid>.folded.
+    """
+
+    def __init__(self, interval=PROFILE_WORKER_INTERVAL, flush_seconds=PROFILE_WORKER_FLUSH_SECONDS):
+        self.sampler = StackSampler(interval)
+        self.flush_seconds = flush_seconds
+        self.path = profile_path(f"ocr-worker-{socket.gethostname()}-{os.getpid()}")
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name="profile-flusher", daemon=True)
+
+    def start(self):
+        self.sampler.start()
+        self._flusher.start()
+        return self
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_seconds):
+            self.sampler.write(self.path)
+
+    def stop(self):
+        self._stop.set()
+        self._flusher.join()
+        self.sampler.stop()
+        self.sampler.write(self.path)
+        return self.path
+
+
+_request_profiler = None
+
+
+def get_request_profiler():
+    global _request_profiler
+    if _request_profiler is None:
+        _request_profiler = RequestProfiler()
+    return _request_profiler
@@ -0,0 +1,166 @@
+"""
+Bulk reprocessing of stored receipts.
+
+Re-derives parsed fields from each receipt's stored OCR text (or re-runs
+OCR on the stored file when asked) so improvements to parse_receipt_text
+and the category rules reach existing rows. A job is split into id-range
+shards; each shard is processed by its own worker process, streaming
+batches from the database and checkpointing after every batch, so an
+interrupted job resumes where it stopped.
+"""
+import datetime
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from backend.core.language import remember_language
+from backend.core.logs import configure_logging
+from backend.core.ocr import extract_text_with_details, parse_receipt_text
+from backend.db import crud
+from backend.db.database import SessionLocal, engine
+
+logger = logging.getLogger(__name__)
+
+# Columns a reprocess may rewrite. Identity, storage and hash columns are never touched.
+REPROCESSED_FIELDS = ("vendor", "transaction_date", "amount", "category", "currency",
+                      "currency_code", "fx_rate", "base_amount", "language", "year_month")
+
+
+def _resolve_path(saved_path):
+    # Rows uploaded on Windows store backslash-separated paths
+    if saved_path and not os.path.exists(saved_path):
+        return saved_path.replace("\\", "/")
+    return saved_path
+
+
+def reprocess_receipt(receipt, rerun_ocr=False):
+    """
+    Re-parses a single receipt. Returns (changes, items): the dict of changed
+    columns (including 'id', empty if nothing changed) and the re-extracted
+    line items. Returns None if there is no text to parse (no stored OCR
+    text and OCR not requested).
+    """
+    text, language = receipt.ocr_text, receipt.language
+    changes = {}
+    if rerun_ocr:
+        # The vendor's remembered OCR model skips script detection
+        text, details = extract_text_with_details(
+            _resolve_path(receipt.saved_path), receipt.content_type, vendor=receipt.vendor
+        )
+        language = details.get("language")
+        if text != receipt.ocr_text:
+            changes["ocr_text"] = text
+    if not text:
+        return None
+
+    parsed = parse_receipt_text(text)
+    parsed["language"] = language
+    if rerun_ocr:
+        remember_language(language, vendor=parsed["vendor"])
+    fields = crud.parsed_fields_to_columns(parsed)
+    for name in REPROCESSED_FIELDS:
+        if fields[name] != getattr(receipt, name):
+            changes[name] = fields[name]
+    if changes:
+        changes["id"] = receipt.id
+    return changes, parsed["items"]
+
+
+def run_shard(job_id, shard_no):
+    """
+    Processes one shard from its checkpoint to the end of its id range.
+    Safe to call again after a crash: work resumes after the last committed batch.
+    """
+    db = SessionLocal()
+    try:
+        job = crud.get_reprocess_job(db, job_id)
+        batch_size, rerun_ocr = job.batch_size, job.rerun_ocr
+        shard = crud.get_reprocess_shard(db, job_id, shard_no)
+        if shard.status == "completed":
+            return
+        shard.status = "running"
+        db.commit()
+
+        while True:
+            batch = crud.get_reprocess_batch(db, shard, batch_size)
+            if not batch:
+                break
+            changes, items_by_receipt, skipped, failed = [], {}, 0, 0
+            for receipt in batch:
+                try:
+                    result = reprocess_receipt(receipt, rerun_ocr=rerun_ocr)
+                except Exception as e:
+                    logger.warning("Reprocess job %s: receipt %s failed: %s", job_id, receipt.id, e)
+                    failed += 1
+                    continue
+                if result is None:
+                    skipped += 1
+                    continue
+                change, items = result
+                if change:
+                    changes.append(change)
+                items_by_receipt[receipt.id] = items
+            # Rows are plain snapshots from here on; drop them before the bulk UPDATE
+            last_id = batch[-1].id
+            db.expunge_all()
+            shard = crud.get_reprocess_shard(db, job_id, shard_no)
+            crud.commit_reprocess_batch(db, shard, changes, last_id, len(batch), skipped, failed,
+                                        items_by_receipt=items_by_receipt)
+
+        shard.status = "completed"
+        db.commit()
+    except Exception:
+        db.rollback()
+        shard = crud.get_reprocess_shard(db, job_id, shard_no)
+        if shard:
+            shard.status = "failed"
+            db.commit()
+        raise
+    finally:
+        db.close()
+
+
+def _run_shard_in_subprocess(job_id, shard_no):
+    # Connections inherited from the parent process must not be reused after fork
+    engine.dispose(close=False)
+    configure_logging()
+    run_shard(job_id, shard_no)
+
+
+def run_job(job_id):
+    """
+    Runs (or resumes) every unfinished shard of a job, one worker process per
+    shard, and records the final job status.
+    """
+    db = SessionLocal()
+    try:
+        job = crud.get_reprocess_job(db, job_id)
+        job.status = "running"
+        job.error = None
+        job.finished_at = None
+        db.commit()
+        workers = job.workers
+
+        errors = []
+        if workers == 1:
+            try:
+                run_shard(job_id, 0)
+            except Exception as e:
+                errors.append(str(e))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(_run_shard_in_subprocess, job_id, n) for n in range(workers)]
+                for future in futures:
+                    try:
+                        future.result()
+                    except Exception as e:
+                        errors.append(str(e))
+
+        db.expire_all()
+        job = crud.get_reprocess_job(db, job_id)
+        job.status = "failed" if errors else "completed"
+        job.error = "; ".join(errors) or None
+        job.finished_at = datetime.datetime.utcnow()
+        db.commit()
+    finally:
+        db.close()
@@ -0,0 +1,295 @@
+"""
+Resumable uploads: a client opens an upload session, sends the file as
+fixed-size chunks in any order (and any number of times), then finalizes.
+All state lives on disk under UPLOAD_SESSION_DIR, so a session survives
+dropped connections, client restarts and server restarts, and any replica
+sharing the directory can take the next chunk.
+
+    <session_id>/meta.json      filename, type, size, chunk size (written once)
+    <session_id>/data           the file, each chunk written at its offset
+    <session_id>/received/<n>   marker per stored chunk, holding its sha256
+    <session_id>/finalizing     exclusive lock while the file is processed
+    <session_id>/result.json    response of a successful finalize
+
+Markers are only created after their chunk's bytes are on disk, so a
+crash mid-write leaves the chunk missing rather than corrupt. After a
+successful finalize the file and markers are dropped but result.json is
+kept until the session expires, so a finalize retried after a lost
+response gets the same answer instead of creating a second receipt.
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+
+from backend.core.storage import STORAGE_ROOT
+
+UPLOAD_SESSION_DIR = os.getenv("UPLOAD_SESSION_DIR", os.path.join(STORAGE_ROOT, "sessions"))
+# Chunk size offered to clients that don't ask for one, and the allowed range
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(4 * 1024 * 1024)))
+UPLOAD_MIN_CHUNK_SIZE = 256 * 1024
+UPLOAD_MAX_CHUNK_SIZE = int(os.getenv("UPLOAD_MAX_CHUNK_SIZE", str(16 * 1024 * 1024)))
+# Largest file accepted through an upload session
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(200 * 1024 * 1024)))
+# Sessions untouched for this long are removed, finished or not
+UPLOAD_SESSION_TTL_SECONDS = float(os.getenv("UPLOAD_SESSION_TTL_SECONDS", str(24 * 3600)))
+
+# A finalize lock older than this was left by a crashed process and is taken over
+_FINALIZE_LOCK_STALE_SECONDS = 600
+
+_SESSION_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+class UploadSessionError(Exception):
+    """Raised for a bad session request; carries the HTTP status to answer with."""
+
+    def __init__(self, reason, status_code=400):
+        super().__init__(reason)
+        self.reason = reason
+        self.status_code = status_code
+
+
+def _write_file_atomic(path, data):
+    tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"  # concurrent writers of one file don't share a temp file
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class UploadSession:
+    def __init__(self, session_id, path, meta):
+        self.session_id = session_id
+        self.path = path
+        self.meta = meta
+
+    @property
+    def data_path(self):
+        return os.path.join(self.path, "data")
+
+    @property
+    def received_dir(self):
+        return os.path.join(self.path, "received")
+
+    @property
+    def result_path(self):
+        return os.path.join(self.path, "result.json")
+
+    @property
+    def lock_path(self):
+        return os.path.join(self.path, "finalizing")
+
+    @property
+    def size(self):
+        return self.meta["size"]
+
+    @property
+    def chunk_size(self):
+        return self.meta["chunk_size"]
+
+    @property
+    def chunk_count(self):
+        return max(1, -(-self.size // self.chunk_size))
+
+    @classmethod
+    def create(cls, filename, content_type, size, chunk_size=None, sha256=None, root=UPLOAD_SESSION_DIR):
+        if size <= 0:
+            raise UploadSessionError("size must be positive")
+        if size > UPLOAD_MAX_BYTES:
+            raise UploadSessionError(f"File is {size} bytes; the limit is {UPLOAD_MAX_BYTES}", status_code=413)
+        chunk_size = chunk_size or UPLOAD_CHUNK_SIZE
+        if not UPLOAD_MIN_CHUNK_SIZE <= chunk_size <= UPLOAD_MAX_CHUNK_SIZE:
+            raise UploadSessionError(f"chunk_size must be between {UPLOAD_MIN_CHUNK_SIZE} and {UPLOAD_MAX_CHUNK_SIZE}")
+        if sha256 is not None and not re.match(r"^[0-9a-f]{64}$", sha256):
+            raise UploadSessionError("sha256 must be 64 lowercase hex digits")
+
+        session_id = uuid.uuid4().hex
+        path = os.path.join(root, session_id)
+        os.makedirs(os.path.join(path, "received"))
+        meta = {"filename": filename, "content_type": content_type, "size": size,
+                "chunk_size": chunk_size, "sha256": sha256, "created_at": time.time()}
+        with open(os.path.join(path, "data"), "wb") as f:
+            f.truncate(size)  # sparse; chunks fill it in at their offsets
+        _write_file_atomic(os.path.join(path, "meta.json"), json.dumps(meta).encode("utf-8"))
+        return cls(session_id, path, meta)
+
+    @classmethod
+    def load(cls, session_id, root=UPLOAD_SESSION_DIR):
+        if not _SESSION_ID.match(session_id):
+            raise UploadSessionError("Upload session not found", status_code=404)
+        path = os.path.join(root, session_id)
+        try:
+            with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+                return cls(session_id, path, json.load(f))
+        except FileNotFoundError:
+            raise UploadSessionError("Upload session not found", status_code=404)
+
+    def chunk_length(self, index):
+        return min(self.chunk_size, self.size - index * self.chunk_size)
+
+    def chunk_index(self, offset):
+        """Index of the chunk starting at `offset`; offsets must fall on chunk boundaries."""
+        if offset < 0 or offset >= self.size or offset % self.chunk_size:
+            raise UploadSessionError(f"offset must be a multiple of {self.chunk_size} below {self.size}")
+        return offset // self.chunk_size
+
+    def write_chunk(self, index, data, sha256=None):
+        """
+        Stores one chunk at its offset. Idempotent: sending a chunk again
+        just rewrites the same bytes. Returns True if the chunk was new.
+        """
+        if self.finished():
+            raise UploadSessionError("Upload session is already finalized", status_code=409)
+        if len(data) != self.chunk_length(index):
+            raise UploadSessionError(f"Chunk {index} must be {self.chunk_length(index)} bytes, got {len(data)}")
+        digest = hashlib.sha256(data).hexdigest()
+        if sha256 is not None and sha256.lower() != digest:
+            raise UploadSessionError(f"Chunk {index} does not match its sha256; resend it", status_code=422)
+        marker = os.path.join(self.received_dir, str(index))
+        is_new = not os.path.exists(marker)
+        fd = os.open(self.data_path, os.O_WRONLY)
+        try:
+            os.pwrite(fd, data, index * self.chunk_size)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        _write_file_atomic(marker, digest.encode("ascii"))
+        os.utime(self.path)  # keeps an active session from expiring
+        return is_new
+
+    def received(self):
+        try:
+            return sorted(int(name) for name in os.listdir(self.received_dir) if name.isdigit())
+        except FileNotFoundError:
+            return []
+
+    def missing(self):
+        received = set(self.received())
+        return [index for index in range(self.chunk_count) if index not in received]
+
+    def finished(self):
+        return os.path.exists(self.result_path)
+
+    def status(self):
+        received = self.received()
+        bytes_received = sum(self.chunk_length(index) for index in received)
+        return {
+            "session_id": self.session_id,
+            "filename": self.meta["filename"],
+            "size": self.size,
+            "chunk_size": self.chunk_size,
+            "chunk_count": self.chunk_count,
+            "bytes_received": bytes_received,
+            "missing_chunks": self.missing(),
+            "finalized": self.finished(),
+            "expires_at": os.path.getmtime(self.path) + UPLOAD_SESSION_TTL_SECONDS,
+        }
+
+    def begin_finalize(self):
+        """
+        Takes the finalize lock and returns the assembled file opened for
+        reading, after checking every chunk arrived and, if the client gave
+        one, the whole-file sha256. Call end_finalize() afterwards.
+        """
+        if not self._create_lock() and not (self._take_over_stale_lock() and self._create_lock()):
+            raise UploadSessionError("Upload session is already being finalized", status_code=409)
+        try:
+            missing = self.missing()
+            if missing:
+                raise UploadSessionError(f"{len(missing)} chunk(s) missing, first {missing[:10]}", status_code=409)
+            stream = open(self.data_path, "rb")
+            if self.meta.get("sha256"):
+                hasher = hashlib.sha256()
+                for block in iter(lambda: stream.read(1024 * 1024), b""):
+                    hasher.update(block)
+                stream.seek(0)
+                if hasher.hexdigest() != self.meta["sha256"]:
+                    stream.close()
+                    raise UploadSessionError("Assembled file does not match its sha256", status_code=422)
+            return stream
+        except Exception:
+            os.remove(self.lock_path)
+            raise
+
+    def _create_lock(self):
+        """Creates the finalize lock; False if it already exists."""
+        try:
+            os.close(os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            return False
+
+    def _take_over_stale_lock(self):
+        """
+        Removes a finalize lock left by a crashed finalize. The lock is renamed
+        to a unique name first: of several processes finding it stale, only
+        one rename succeeds. If the file moved turns out to be a fresh lock
+        (another process took over just before), it is put back. Returns True
+        if the lock is gone and may be created again.
+        """
+        try:
+            if time.time() - os.path.getmtime(self.lock_path) <= _FINALIZE_LOCK_STALE_SECONDS:
+                return False
+        except FileNotFoundError:
+            return True  # released meanwhile
+        aside = f"{self.lock_path}.{uuid.uuid4().hex}"
+        try:
+            os.rename(self.lock_path, aside)
+        except FileNotFoundError:
+            return False  # another process took it over first
+        if time.time() - os.path.getmtime(aside) <= _FINALIZE_LOCK_STALE_SECONDS:
+            try:
+                os.link(aside, self.lock_path)
+            except FileExistsError:
+                pass
+            os.remove(aside)
+            return False
+        os.remove(aside)
+        return True
+
+    def end_finalize(self, result=None):
+        """
+        Releases the finalize lock. With a result, the session is done: its
+        file is dropped and the result kept for retried finalize calls.
+        """
+        if result is not None:
+            _write_file_atomic(self.result_path, json.dumps(result, default=str).encode("utf-8"))
+            shutil.rmtree(self.received_dir, ignore_errors=True)
+            try:
+                os.remove(self.data_path)
+            except FileNotFoundError:
+                pass
+        try:
+            os.remove(self.lock_path)
+        except FileNotFoundError:
+            pass
+
+    def result(self):
+        try:
+            with open(self.result_path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def discard(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def sweep_expired_sessions(root=UPLOAD_SESSION_DIR, ttl=UPLOAD_SESSION_TTL_SECONDS):
+    """Removes sessions untouched for `ttl` seconds. Returns how many were removed."""
+    cutoff = time.time() - ttl
+    removed = 0
+    try:
+        entries = list(os.scandir(root))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.is_dir() and _SESSION_ID.match(entry.name) and entry.stat().st_mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                removed += 1
+        except FileNotFoundError:
+            continue  # removed concurrently
+    return removed
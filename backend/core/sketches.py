@@ -0,0 +1,321 @@
+"""
+Mergeable streaming sketches for approximate analytics over large tables.
+
+- TDigest: quantiles of a numeric stream (amount percentiles)
+- HyperLogLog: number of distinct items (distinct vendors)
+- CountMinTopK: approximate per-item counts plus a bounded candidate set
+  for the top-k items (most frequent vendors)
+
+Each sketch has a fixed size regardless of how many receipts it has seen,
+serialises to bytes for storage in the database, and merges with another
+sketch of the same shape. Deletions are supported exactly by Count-Min
+(counters are decremented), approximately by TDigest (a second digest of
+removed values is subtracted from the CDF), and not at all by
+HyperLogLog; see the error notes on each class.
+"""
+import hashlib
+import heapq
+import json
+import math
+import struct
+from array import array
+from bisect import bisect_left
+
+_MASK64 = (1 << 64) - 1
+
+
+def hash64(value):
+    """Stable 64-bit hash of a string (same value in every process and release)."""
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class TDigest:
+    """
+    Merging t-digest (Dunning) with the k1 scale function. Centroids near
+    the tails are kept small, so extreme percentiles are more precise than
+    the median. With compression 200 the quantile rank error is typically
+    well under 0.5% (far less at p1 / p99), using at most ~200 centroids.
+    """
+
+    ERROR_NOTE = "Rank error typically < 0.5% near the median and much smaller toward p1/p99."
+
+    def __init__(self, compression=200):
+        self.compression = compression
+        self.means = []
+        self.weights = []
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self._buffer = []
+
+    def add(self, value, weight=1.0):
+        self._buffer.append((value, weight))
+        self.total += weight
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if len(self._buffer) >= self.compression * 5:
+            self._compress()
+
+    def merge(self, other):
+        other._compress()
+        self._buffer.extend(zip(other.means, other.weights))
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+        return self
+
+    def _k_limit(self, q):
+        # Next quantile boundary one unit of k1(q) = delta/(2 pi) * asin(2q - 1) further on
+        k = self.compression / (2 * math.pi) * math.asin(2 * q - 1) + 1
+        if k >= self.compression / 4:
+            return 1.0
+        return (math.sin(2 * math.pi * k / self.compression) + 1) / 2
+
+    def _compress(self):
+        if not self._buffer:
+            return
+        items = sorted(list(zip(self.means, self.weights)) + self._buffer)
+        self._buffer = []
+        total = sum(w for _, w in items)
+        means, weights = [], []
+        cur_mean, cur_weight = items[0]
+        done = 0.0
+        limit = self._k_limit(0.0)
+        for mean, weight in items[1:]:
+            if (done + cur_weight + weight) / total <= limit:
+                cur_weight += weight
+                cur_mean += (mean - cur_mean) * weight / cur_weight
+            else:
+                means.append(cur_mean)
+                weights.append(cur_weight)
+                done += cur_weight
+                limit = self._k_limit(done / total)
+                cur_mean, cur_weight = mean, weight
+        means.append(cur_mean)
+        weights.append(cur_weight)
+        self.means, self.weights = means, weights
+
+    def _points(self):
+        """(cumulative weight at centroid centre, mean) knots, anchored at min and max."""
+        self._compress()
+        positions, values = [0.0], [self.min]
+        done = 0.0
+        for mean, weight in zip(self.means, self.weights):
+            positions.append(done + weight / 2)
+            values.append(mean)
+            done += weight
+        positions.append(done)
+        values.append(self.max)
+        return positions, values
+
+    def quantile(self, q):
+        if self.total <= 0:
+            return None
+        positions, values = self._points()
+        target = min(max(q, 0.0), 1.0) * positions[-1]
+        i = bisect_left(positions, target)
+        if i <= 0:
+            return values[0]
+        if i >= len(positions):
+            return values[-1]
+        span = positions[i] - positions[i - 1]
+        frac = (target - positions[i - 1]) / span if span > 0 else 0.0
+        return values[i - 1] + frac * (values[i] - values[i - 1])
+
+    def cdf(self, x):
+        if self.total <= 0:
+            return 0.0
+        if x <= self.min:
+            return 0.0
+        if x >= self.max:
+            return 1.0
+        positions, values = self._points()
+        i = bisect_left(values, x)
+        span = values[i] - values[i - 1]
+        frac = (x - values[i - 1]) / span if span > 0 else 1.0
+        return (positions[i - 1] + frac * (positions[i] - positions[i - 1])) / positions[-1]
+
+    def to_bytes(self):
+        self._compress()
+        header = struct.pack("<dIddd", self.compression, len(self.means), self.total,
+                             self.min if self.total else 0.0, self.max if self.total else 0.0)
+        return header + array("d", self.means).tobytes() + array("d", self.weights).tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        compression, n, total, low, high = struct.unpack_from("<dIddd", data)
+        digest = cls(compression)
+        offset = struct.calcsize("<dIddd")
+        means, weights = array("d"), array("d")
+        means.frombytes(data[offset:offset + 8 * n])
+        weights.frombytes(data[offset + 8 * n:offset + 16 * n])
+        digest.means, digest.weights = list(means), list(weights)
+        digest.total = total
+        if total:
+            digest.min, digest.max = low, high
+        return digest
+
+
+def quantile_with_removals(added, removed, q, iterations=60):
+    """
+    Quantile of `added` minus `removed` values: the CDF of the remaining
+    values is (Na * Fa(x) - Nr * Fr(x)) / (Na - Nr), inverted by bisection.
+    Exact when nothing was removed; degrades gracefully as the removed share
+    grows (rebuild the sketch once it is large).
+    """
+    remaining = added.total - removed.total
+    if remaining <= 0:
+        return None
+    if removed.total <= 0:
+        return added.quantile(q)
+    low, high = added.min, added.max
+    for _ in range(iterations):
+        mid = (low + high) / 2
+        cdf = (added.total * added.cdf(mid) - removed.total * removed.cdf(mid)) / remaining
+        if cdf < q:
+            low = mid
+        else:
+            high = mid
+    return (low + high) / 2
+
+
+def cdf_with_removals(added, removed, x):
+    """Fraction of the remaining values (added minus removed) that are <= x."""
+    remaining = added.total - (removed.total if removed else 0)
+    if remaining <= 0:
+        return None
+    if not removed or removed.total <= 0:
+        return added.cdf(x)
+    cdf = (added.total * added.cdf(x) - removed.total * removed.cdf(x)) / remaining
+    return min(max(cdf, 0.0), 1.0)
+
+
+class HyperLogLog:
+    """
+    HyperLogLog distinct counter with 2^p one-byte registers. Standard
+    error is 1.04 / sqrt(2^p): 1.6% at the default p=12 (4 KB). Insert-only:
+    removing an item is not possible, so after deletions the estimate can
+    only be corrected by rebuilding.
+    """
+
+    def __init__(self, p=12, registers=None):
+        self.p = p
+        self.m = 1 << p
+        self.registers = registers if registers is not None else bytearray(self.m)
+
+    @property
+    def standard_error(self):
+        return 1.04 / math.sqrt(self.m)
+
+    def add_hash(self, h):
+        index = h >> (64 - self.p)
+        rest = (h << self.p) & _MASK64
+        rank = min(64 - rest.bit_length() + 1, 64 - self.p + 1)
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def add(self, value):
+        self.add_hash(hash64(value))
+
+    def merge(self, other):
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+        return self
+
+    def count(self):
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)  # linear counting for small cardinalities
+        return int(round(estimate))
+
+    def to_bytes(self):
+        return bytes([self.p]) + bytes(self.registers)
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls(data[0], bytearray(data[1:]))
+
+
+class CountMinTopK:
+    """
+    Count-Min sketch (depth x width counters) with a bounded candidate set
+    for top-k queries. Estimates never undercount; with total count N they
+    overcount by at most e / width * N with probability 1 - e^-depth
+    (width 2048, depth 5: 0.13% of N, 99.3% of the time). Counters are
+    decremented on delete, so counts stay correct under deletions.
+    """
+
+    def __init__(self, width=2048, depth=5, capacity=200):
+        self.width = width
+        self.depth = depth
+        self.capacity = capacity
+        self.counters = array("i", bytes(4 * width * depth))
+        self.total = 0
+        self.candidates = {}  # key -> display name
+
+    @property
+    def epsilon(self):
+        return math.e / self.width
+
+    @property
+    def delta(self):
+        return math.exp(-self.depth)
+
+    def _cells(self, key):
+        h = hash64(key)
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        return [row * self.width + (h1 + row * h2) % self.width for row in range(self.depth)]
+
+    def estimate(self, key):
+        return min(self.counters[cell] for cell in self._cells(key))
+
+    def add(self, key, name=None, count=1):
+        for cell in self._cells(key):
+            self.counters[cell] += count
+        self.total += count
+        if count > 0:
+            self._offer(key, name or key)
+        elif key in self.candidates and self.estimate(key) <= 0:
+            del self.candidates[key]
+
+    def _offer(self, key, name):
+        if key in self.candidates or len(self.candidates) < self.capacity:
+            self.candidates.setdefault(key, name)
+            return
+        # Full: replace the weakest candidate if this key now outranks it
+        weakest = min(self.candidates, key=self.estimate)
+        if self.estimate(key) > self.estimate(weakest):
+            del self.candidates[weakest]
+            self.candidates[key] = name
+
+    def merge(self, other):
+        for i, value in enumerate(other.counters):
+            self.counters[i] += value
+        self.total += other.total
+        for key, name in other.candidates.items():
+            self._offer(key, name)
+        return self
+
+    def top(self, k):
+        """[(name, estimated_count)] for the k most frequent candidates."""
+        ranked = heapq.nlargest(k, ((self.estimate(key), key) for key in self.candidates))
+        return [(self.candidates[key], count) for count, key in ranked if count > 0]
+
+    def to_bytes(self):
+        header = struct.pack("<IIIq", self.width, self.depth, self.capacity, self.total)
+        return header + self.counters.tobytes() + json.dumps(self.candidates).encode("utf-8")
+
+    @classmethod
+    def from_bytes(cls, data):
+        width, depth, capacity, total = struct.unpack_from("<IIIq", data)
+        sketch = cls(width, depth, capacity)
+        offset = struct.calcsize("<IIIq")
+        end = offset + 4 * width * depth
+        sketch.counters = array("i")
+        sketch.counters.frombytes(data[offset:end])
+        sketch.total = total
+        sketch.candidates = json.loads(data[end:].decode("utf-8")) if len(data) > end else {}
+        return sketch
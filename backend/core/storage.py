@@ -0,0 +1,148 @@
+import hashlib
+import os
+import tempfile
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Optional
+
+# Root directory for the local-disk backend. Blobs live under
+# <root>/blobs/<aa>/<bb>/<sha256>, so no directory ever holds more than a
+# few hundred entries even with millions of uploads.
+STORAGE_ROOT = os.getenv("UPLOAD_STORAGE_DIR", "backend/uploads")
+STORAGE_BACKEND = os.getenv("UPLOAD_STORAGE_BACKEND", "local")
+
+CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass
+class StoredBlob:
+    digest: str   # hex sha256 of the content, the blob's identity
+    path: str     # location passed to OCR and stored as Receipt.saved_path
+    size: int
+    created: bool  # False if identical content was already stored
+
+
+class StorageBackend(ABC):
+    """
+    Interface for content-addressed blob stores. Reference counting lives in
+    the database (see crud), so backends only need to store, locate and
+    remove immutable blobs keyed by their sha256 digest.
+    """
+
+    @abstractmethod
+    def save(self, stream) -> StoredBlob:
+        ...
+
+    @abstractmethod
+    def path_for(self, digest: str) -> str:
+        ...
+
+    @abstractmethod
+    def exists(self, digest: str) -> bool:
+        ...
+
+    @abstractmethod
+    def delete(self, digest: str) -> bool:
+        ...
+
+    @abstractmethod
+    def set_aside(self, digest: str) -> Optional[str]:
+        """Moves a blob out of reach of readers and savers; returns a handle, or None if it is missing."""
+
+    @abstractmethod
+    def put_back(self, digest: str, handle: str) -> None:
+        """Returns a blob set aside to its place (a save of the same content may have restored it already)."""
+
+    @abstractmethod
+    def discard(self, handle: str) -> None:
+        """Removes a blob set aside for good."""
+
+
+class LocalDiskStorage(StorageBackend):
+    """Stores blobs on the local filesystem in a two-level sharded tree."""
+
+    def __init__(self, root=STORAGE_ROOT):
+        self.root = root
+        self.blob_dir = os.path.join(root, "blobs")
+        self.tmp_dir = os.path.join(root, "tmp")
+        os.makedirs(self.blob_dir, exist_ok=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def path_for(self, digest):
+        return os.path.join(self.blob_dir, digest[:2], digest[2:4], digest)
+
+    def exists(self, digest):
+        return os.path.exists(self.path_for(digest))
+
+    def save(self, stream):
+        """
+        Streams `stream` to a temp file while hashing it, then atomically
+        renames it into place. Identical content is kept only once.
+        """
+        hasher = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    hasher.update(chunk)
+                    tmp.write(chunk)
+                    size += len(chunk)
+            digest = hasher.hexdigest()
+            final_path = self.path_for(digest)
+            if os.path.exists(final_path):
+                os.remove(tmp_path)
+                return StoredBlob(digest, final_path, size, created=False)
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            os.replace(tmp_path, final_path)
+            return StoredBlob(digest, final_path, size, created=True)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def delete(self, digest):
+        try:
+            os.remove(self.path_for(digest))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def set_aside(self, digest):
+        handle = os.path.join(self.tmp_dir, f"{digest}.{uuid.uuid4().hex}.removing")
+        try:
+            os.replace(self.path_for(digest), handle)
+        except FileNotFoundError:
+            return None
+        return handle
+
+    def put_back(self, digest, handle):
+        os.replace(handle, self.path_for(digest))
+
+    def discard(self, handle):
+        os.remove(handle)
+
+
+_BACKENDS = {
+    "local": LocalDiskStorage,
+}
+_storage = None
+
+
+def register_backend(name, factory):
+    """Register another StorageBackend implementation (e.g. an object store)."""
+    _BACKENDS[name] = factory
+
+
+def get_storage() -> StorageBackend:
+    """Returns the process-wide storage backend selected by UPLOAD_STORAGE_BACKEND."""
+    global _storage
+    if _storage is None:
+        if STORAGE_BACKEND not in _BACKENDS:
+            raise ValueError(f"Unknown storage backend: {STORAGE_BACKEND}")
+        _storage = _BACKENDS[STORAGE_BACKEND]()
+    return _storage
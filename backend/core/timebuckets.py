@@ -0,0 +1,72 @@
+import datetime
+
+# Calendar buckets used by the spend rollup. Each is an integer key that
+# sorts chronologically and is stored on the rollup row, so grouping by any
+# granularity is a plain GROUP BY on one column on every database.
+GRANULARITIES = ("day", "week", "month", "quarter", "year")
+
+
+def bucket_keys(day):
+    """All coarser bucket keys of a date (day itself is keyed by the date)."""
+    iso_year, iso_week, _ = day.isocalendar()
+    return {
+        "week_key": iso_year * 100 + iso_week,               # 202405: ISO week 5 of 2024
+        "year_month": day.year * 100 + day.month,            # 202406
+        "quarter_key": day.year * 10 + (day.month - 1) // 3 + 1,  # 20242
+        "year": day.year,
+    }
+
+
+def bucket_start(granularity, day):
+    """First date of the bucket containing `day`."""
+    if granularity == "day":
+        return day
+    if granularity == "week":
+        return day - datetime.timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    if granularity == "quarter":
+        return datetime.date(day.year, 3 * ((day.month - 1) // 3) + 1, 1)
+    if granularity == "year":
+        return datetime.date(day.year, 1, 1)
+    raise ValueError(f"Unknown granularity '{granularity}'")
+
+
+def bucket_key(granularity, day):
+    """The key a rollup row for `day` is grouped under at `granularity`."""
+    if granularity == "day":
+        return day
+    return bucket_keys(day)[{"week": "week_key", "month": "year_month",
+                             "quarter": "quarter_key", "year": "year"}[granularity]]
+
+
+def _next_start(granularity, start):
+    if granularity == "day":
+        return start + datetime.timedelta(days=1)
+    if granularity == "week":
+        return start + datetime.timedelta(days=7)
+    months = {"month": 1, "quarter": 3, "year": 12}[granularity]
+    month_index = start.year * 12 + start.month - 1 + months
+    return datetime.date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def iter_buckets(granularity, start_day, end_day):
+    """Yields (key, bucket_start_date) for every bucket from start_day to end_day inclusive."""
+    start = bucket_start(granularity, start_day)
+    while start <= end_day:
+        yield bucket_key(granularity, start), start
+        start = _next_start(granularity, start)
+
+
+def bucket_label(granularity, start):
+    """Display label of the bucket beginning on `start`: 2024-06-15, 2024-W24, 2024-06, 2024-Q2, 2024."""
+    if granularity == "day":
+        return start.isoformat()
+    if granularity == "week":
+        iso_year, iso_week, _ = start.isocalendar()
+        return f"{iso_year}-W{iso_week:02d}"
+    if granularity == "month":
+        return f"{start.year:04d}-{start.month:02d}"
+    if granularity == "quarter":
+        return f"{start.year}-Q{(start.month - 1) // 3 + 1}"
+    return str(start.year)
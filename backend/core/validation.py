@@ -0,0 +1,273 @@
+import io
+import os
+import re
+import struct
+from dataclasses import dataclass
+from typing import Optional
+
+# Images above this many megapixels are downsampled to it before OCR;
+# more pixels than a 24 MP photo only slow tesseract down.
+UPLOAD_MAX_MEGAPIXELS = float(os.getenv("UPLOAD_MAX_MEGAPIXELS", "24"))
+# Images above this are rejected outright: decoding them at all is the risk.
+UPLOAD_REJECT_MEGAPIXELS = float(os.getenv("UPLOAD_REJECT_MEGAPIXELS", "100"))
+# PDFs with more pages than this are rejected (receipts are a page or two).
+UPLOAD_MAX_PDF_PAGES = int(os.getenv("UPLOAD_MAX_PDF_PAGES", "20"))
+
+ALLOWED_TYPES = ("image/jpeg", "image/png", "application/pdf", "text/plain")
+
+# pdf2image's default rasterisation resolution, which OCR uses
+PDF_RENDER_DPI = 200
+
+_SNIFF_BYTES = 8192
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# JPEG start-of-frame markers carrying the dimensions (C4 / C8 / CC are not frames)
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+_PDF_PAGE = re.compile(rb"/Type\s*/Page(?![a-zA-Z])")
+_PDF_COUNT = re.compile(rb"/Count\s+(\d+)")
+_PDF_MEDIABOX = re.compile(rb"/MediaBox\s*\[\s*(-?[\d.]+)\s+(-?[\d.]+)\s+(-?[\d.]+)\s+(-?[\d.]+)\s*\]")
+_CHUNK = 1024 * 1024
+_OVERLAP = 128
+
+
+class UploadRejected(Exception):
+    """Raised when an upload fails validation; carries the HTTP status to answer with."""
+
+    def __init__(self, reason, status_code=413):
+        super().__init__(reason)
+        self.reason = reason
+        self.status_code = status_code
+
+
+@dataclass
+class UploadInspection:
+    content_type: Optional[str]    # from the magic bytes; None if unrecognised
+    declared_type: Optional[str]   # what the client sent
+    width: Optional[int] = None
+    height: Optional[int] = None
+    pages: Optional[int] = None
+    # Largest page as rasterised for OCR, from its /MediaBox (None if not found)
+    page_megapixels: Optional[float] = None
+    downsampled_from: Optional[str] = None  # "WxH" of the original when the image was shrunk
+    downsample_to: Optional[float] = None   # megapixels to shrink to; set while the downsampling is still pending
+
+    @property
+    def megapixels(self):
+        if self.width is None or self.height is None:
+            return None
+        return self.width * self.height / 1_000_000
+
+    def describe(self):
+        info = {"content_type": self.content_type}
+        if self.declared_type != self.content_type:
+            info["declared_type"] = self.declared_type
+        if self.width is not None:
+            info["dimensions"] = f"{self.width}x{self.height}"
+        if self.pages is not None:
+            info["pages"] = self.pages
+        if self.downsampled_from:
+            info["downsampled_from"] = self.downsampled_from
+        return info
+
+
+def sniff_content_type(head):
+    """Real type of a file from its first bytes, or None if it is none of ALLOWED_TYPES."""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(_PNG_SIGNATURE):
+        return "image/png"
+    # Readers accept the %PDF header anywhere in the first kilobyte
+    if b"%PDF-" in head[:1024]:
+        return "application/pdf"
+    if head and b"\x00" not in head:
+        try:
+            head.decode("utf-8")
+            return "text/plain"
+        except UnicodeDecodeError as e:
+            if e.start >= len(head) - 3:
+                return "text/plain"  # a multi-byte character cut off by the sniff window
+    return None
+
+
+def image_dimensions(stream, content_type):
+    """(width, height) from a PNG IHDR or JPEG frame header, without decoding pixels. Rewinds the stream."""
+    stream.seek(0)
+    try:
+        if content_type == "image/png":
+            header = stream.read(24)
+            if len(header) < 24 or header[12:16] != b"IHDR":
+                return None
+            return struct.unpack(">II", header[16:24])
+        if content_type == "image/jpeg":
+            return _jpeg_dimensions(stream)
+        return None
+    finally:
+        stream.seek(0)
+
+
+def _jpeg_dimensions(stream):
+    stream.read(2)  # SOI
+    while True:
+        byte = stream.read(1)
+        while byte and byte != b"\xff":
+            byte = stream.read(1)  # skip to the next marker
+        while byte == b"\xff":
+            byte = stream.read(1)  # fill bytes
+        if not byte:
+            return None
+        marker = byte[0]
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            continue  # markers without a length
+        length_bytes = stream.read(2)
+        if len(length_bytes) < 2:
+            return None
+        length = struct.unpack(">H", length_bytes)[0]
+        if marker in _JPEG_SOF:
+            frame = stream.read(5)
+            if len(frame) < 5:
+                return None
+            height, width = struct.unpack(">HH", frame[1:5])
+            return width, height
+        if marker == 0xDA:
+            return None  # start of scan before any frame header
+        stream.seek(length - 2, io.SEEK_CUR)
+
+
+def scan_pdf(stream):
+    """
+    (page_count, largest page in megapixels at PDF_RENDER_DPI) from the raw
+    bytes, read in chunks without decoding any page. The page count falls
+    back to the largest /Count in the page tree when page objects sit in
+    compressed object streams; the page size is None if no /MediaBox is
+    visible. Rewinds the stream.
+    """
+    pages, max_count, max_points = 0, 0, 0.0
+    tail = b""
+    stream.seek(0)
+    while True:
+        chunk = stream.read(_CHUNK)
+        if not chunk:
+            break
+        buf = tail + chunk
+        # Only count matches ending in the new chunk; the rest were counted last time
+        pages += sum(1 for m in _PDF_PAGE.finditer(buf) if m.end() > len(tail))
+        for m in _PDF_COUNT.finditer(buf):
+            if m.end() > len(tail):
+                max_count = max(max_count, int(m.group(1)))
+        for m in _PDF_MEDIABOX.finditer(buf):
+            if m.end() > len(tail):
+                try:
+                    x0, y0, x1, y1 = (float(v) for v in m.groups())
+                except ValueError:
+                    continue
+                max_points = max(max_points, abs(x1 - x0) * abs(y1 - y0))
+        tail = buf[-_OVERLAP:]
+    stream.seek(0)
+    page_megapixels = max_points * (PDF_RENDER_DPI / 72) ** 2 / 1_000_000 if max_points else None
+    return max(pages, max_count, 1), page_megapixels
+
+
+def inspect_upload(stream, declared_type=None):
+    """Type, dimensions and page count of an upload from headers only. Rewinds the stream."""
+    stream.seek(0)
+    head = stream.read(_SNIFF_BYTES)
+    stream.seek(0)
+    inspection = UploadInspection(content_type=sniff_content_type(head), declared_type=declared_type)
+    if inspection.content_type in ("image/jpeg", "image/png"):
+        size = image_dimensions(stream, inspection.content_type)
+        if size:
+            inspection.width, inspection.height = size
+    elif inspection.content_type == "application/pdf":
+        inspection.pages, inspection.page_megapixels = scan_pdf(stream)
+    return inspection
+
+
+def downsample_image(stream, content_type, max_megapixels):
+    """
+    Re-encodes an image at no more than `max_megapixels`, keeping its aspect
+    ratio. JPEGs are scaled by the decoder (draft mode), so the full-size
+    bitmap is never built. Returns (BytesIO, (width, height)); raises
+    UploadRejected if the image can't be decoded.
+    """
+    from PIL import Image, UnidentifiedImageError
+
+    stream.seek(0)
+    try:
+        with Image.open(stream) as image:
+            scale = (max_megapixels * 1_000_000 / (image.width * image.height)) ** 0.5
+            target = (max(1, int(image.width * scale)), max(1, int(image.height * scale)))
+            if content_type == "image/jpeg":
+                image.draft("RGB", target)
+            exif = image.info.get("exif")
+            resized = image.convert("RGB" if content_type == "image/jpeg" else image.mode)
+            resized.thumbnail(target, Image.LANCZOS)
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+        # Headers that promise a large image over truncated or garbage data
+        stream.seek(0)
+        raise UploadRejected("Could not decode the image; the file looks corrupt", status_code=400) from e
+    out = io.BytesIO()
+    if content_type == "image/jpeg":
+        resized.save(out, "JPEG", quality=92, **({"exif": exif} if exif else {}))
+    else:
+        resized.save(out, "PNG")
+    out.seek(0)
+    stream.seek(0)
+    return out, resized.size
+
+
+def apply_downsampling(stream, inspection):
+    """
+    Shrinks the image if validate_upload left its downsampling pending,
+    updating the inspection. Returns the stream to store and OCR.
+    """
+    if not inspection.downsample_to:
+        return stream
+    original = f"{inspection.width}x{inspection.height}"
+    stream, (inspection.width, inspection.height) = downsample_image(
+        stream, inspection.content_type, inspection.downsample_to
+    )
+    inspection.downsampled_from = original
+    inspection.downsample_to = None
+    return stream
+
+
+def validate_upload(stream, declared_type=None,
+                    max_megapixels=UPLOAD_MAX_MEGAPIXELS,
+                    reject_megapixels=UPLOAD_REJECT_MEGAPIXELS,
+                    max_pages=UPLOAD_MAX_PDF_PAGES,
+                    downsample=True):
+    """
+    Checks an upload before any decoding or OCR: the real type must be one
+    of ALLOWED_TYPES (whatever the client claimed), images must stay under
+    the pixel budget (downsampled between the two limits, rejected above)
+    and PDFs under the page budget with no page that would rasterise past
+    the pixel limit. Returns (stream to store and OCR, UploadInspection);
+    raises UploadRejected.
+
+    Downsampling decodes the whole image, so with downsample=False it is
+    only recorded (inspection.downsample_to) for the caller to run later
+    with apply_downsampling, e.g. once admission control lets it.
+    """
+    inspection = inspect_upload(stream, declared_type)
+    if inspection.content_type not in ALLOWED_TYPES:
+        raise UploadRejected(f"Unrecognised file content (declared as {declared_type})", status_code=415)
+
+    if inspection.content_type in ("image/jpeg", "image/png"):
+        megapixels = inspection.megapixels
+        if megapixels is None:
+            raise UploadRejected("Could not read the image dimensions; the file looks corrupt", status_code=400)
+        if megapixels > reject_megapixels:
+            raise UploadRejected(f"Image is {inspection.width}x{inspection.height} ({megapixels:.0f} MP); "
+                                 f"the limit is {reject_megapixels:g} MP")
+        if megapixels > max_megapixels:
+            inspection.downsample_to = max_megapixels
+            if downsample:
+                stream = apply_downsampling(stream, inspection)
+
+    elif inspection.content_type == "application/pdf":
+        if inspection.pages > max_pages:
+            raise UploadRejected(f"PDF has {inspection.pages} pages; the limit is {max_pages}")
+        if inspection.page_megapixels is not None and inspection.page_megapixels > reject_megapixels:
+            raise UploadRejected(f"A PDF page would rasterise to {inspection.page_megapixels:.0f} MP; "
+                                 f"the limit is {reject_megapixels:g} MP")
+    return stream, inspection
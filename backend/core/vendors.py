@@ -0,0 +1,138 @@
+import os
+import re
+
+# Trigram (Dice) similarity a parsed vendor needs to join an existing vendor.
+VENDOR_MATCH_THRESHOLD = float(os.getenv("VENDOR_MATCH_THRESHOLD", "0.7"))
+
+# Words that don't tell two vendors apart ("Walmart Supercenter" is Walmart)
+_GENERIC_WORDS = {
+    "the", "inc", "llc", "ltd", "co", "corp", "company", "store", "stores", "shop",
+    "supercenter", "superstore", "supermarket", "market", "pvt", "plc", "gmbh",
+}
+# Characters OCR confuses with letters; only replaced inside words that also contain letters
+_OCR_DIGITS = str.maketrans({"0": "o", "1": "l", "5": "s", "8": "b", "|": "l", "$": "s"})
+_WORD = re.compile(r"[a-z0-9|$]+")
+_APOSTROPHES = re.compile(r"['\u2019`]")
+
+
+def normalize_vendor(name):
+    """
+    Match key of a vendor name: lowercase, OCR digit slips in words fixed
+    ("Wa1mart" -> "walmart"), punctuation, store numbers and generic words
+    dropped. Returns "" when nothing distinctive is left.
+    """
+    if not name:
+        return ""
+    name = _APOSTROPHES.sub("", name.lower())  # "McDonald's" -> "mcdonalds"
+    words = []
+    for word in _WORD.findall(name):
+        if any(c.isalpha() for c in word):
+            word = word.translate(_OCR_DIGITS)
+        elif word.isdigit():
+            continue  # store / branch numbers: "Walmart #1234"
+        if word not in _GENERIC_WORDS:
+            words.append(word)
+    key = " ".join(words)
+    # A name made only of generic words is still a name
+    return key or " ".join(_WORD.findall(name))
+
+
+def trigrams(key):
+    # Spaces are dropped: OCR splits and joins words freely ("Wal Mart", "BestBuy")
+    padded = f"  {key.replace(' ', '')} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a, b, limit):
+    """Levenshtein distance of a and b, or limit + 1 once it is known to exceed limit."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def _typo_allowance(key):
+    # Trigram overlap is harsh on short names, so single typos there are caught by edit distance
+    length = len(key.replace(" ", ""))
+    return 2 if length >= 10 else 1 if length >= 5 else 0
+
+
+def similarity(a, b):
+    """Dice coefficient of the two keys' trigram sets, 0..1."""
+    ta, tb = trigrams(a), trigrams(b)
+    return 2 * len(ta & tb) / (len(ta) + len(tb)) if ta and tb else 0.0
+
+
+class VendorIndex:
+    """
+    In-memory alias key -> vendor id map with a trigram inverted index for
+    fuzzy lookups. A lookup only scores aliases sharing at least one
+    trigram with the query, and skips those whose size alone rules out
+    reaching the threshold, so its cost tracks the number of similar
+    names rather than the number of vendors.
+    """
+
+    def __init__(self, threshold=VENDOR_MATCH_THRESHOLD):
+        self.threshold = threshold
+        self.aliases = {}    # alias key -> vendor id
+        self.postings = {}   # trigram -> set of alias keys
+        self.last_alias_id = 0
+
+    def __len__(self):
+        return len(self.aliases)
+
+    def add(self, key, vendor_id):
+        if key not in self.aliases:
+            for gram in trigrams(key):
+                self.postings.setdefault(gram, set()).add(key)
+        self.aliases[key] = vendor_id
+
+    def match(self, key):
+        """(vendor_id, similarity) of the closest alias at or above the threshold, else (None, 0.0)."""
+        if not key:
+            return None, 0.0
+        if key in self.aliases:
+            return self.aliases[key], 1.0
+        grams = trigrams(key)
+        shared = {}
+        for gram in grams:
+            for alias in self.postings.get(gram, ()):
+                shared[alias] = shared.get(alias, 0) + 1
+        best, best_score = None, 0.0
+        for alias, common in shared.items():
+            # Dice <= 2 * min / (a + b): skip sizes that can't reach the threshold
+            size = len(trigrams(alias))
+            if 2 * min(size, len(grams)) / (size + len(grams)) < self.threshold:
+                continue
+            score = 2 * common / (size + len(grams))
+            if score > best_score:
+                best, best_score = alias, score
+        if best is not None and best_score >= self.threshold:
+            return self.aliases[best], best_score
+
+        # "Starbucks" vs "Starbucks Coffee": one name is the leading words of the other
+        words = key.split()
+        for alias in sorted(shared, key=lambda alias: -shared[alias]):
+            alias_words = alias.split()
+            shorter = min(words, alias_words, key=len)
+            if len("".join(shorter)) >= 5 and words[:len(shorter)] == alias_words[:len(shorter)]:
+                return self.aliases[alias], similarity(key, alias)
+
+        limit = _typo_allowance(key)
+        if limit:
+            compact = key.replace(" ", "")
+            best_distance = limit + 1
+            for alias in sorted(shared, key=lambda alias: -shared[alias])[:50]:
+                distance = edit_distance(compact, alias.replace(" ", ""), limit)
+                if distance < best_distance:
+                    best, best_distance = alias, distance
+            if best_distance <= limit:
+                return self.aliases[best], 1 - best_distance / max(len(compact), 1)
+        return None, 0.0
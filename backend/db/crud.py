@@ -1,55 +1,1112 @@
 # backend/db/crud.py
 from sqlalchemy.orm import Session
-from sqlalchemy import func, cast, Date, asc, desc
-from backend.db.models import Receipt
-from datetime import date as DateType, datetime
+from sqlalchemy import func, cast, Date, asc, desc, or_, insert, event, update, bindparam, case
+from backend.db.models import (
+    Receipt, ReceiptItem, ReceiptItemTerm, Blob, DailySpend, AnalyticsSketch, AggregateDelta, SpendStats,
+    Vendor, VendorAlias, ReprocessJob, ReprocessShard, OcrJob, StorageGcRun
+)
+from backend.core.anomaly import (
+    ANOMALY_DIGEST_COMPRESSION, ANOMALY_SCORE_THRESHOLD, summarize, transform, welford_remove, z_score
+)
+from backend.core.categorizer import Categorizer
+from backend.core.dates import parse_date
+from backend.core.fx import to_base_currency, normalize_currency
+from backend.core.phash import (
+    PHASH_BANDS, hamming_distance, to_signed64, from_signed64, split_bands, band_neighbours
+)
+from backend.core.sketches import CountMinTopK, HyperLogLog, TDigest, cdf_with_removals, quantile_with_removals
+from backend.core.timebuckets import bucket_keys, bucket_label, iter_buckets
+from backend.core.vendors import VendorIndex, normalize_vendor
+from datetime import date as DateType, datetime, timedelta
 from typing import Dict, Any, List, Optional, Tuple
+import base64
+import json
+import logging
+import math
 import re # Import regex module
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+def parsed_fields_to_columns(parsed_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Maps the dict returned by parse_receipt_text onto Receipt column values.
+    """
+    # parse_receipt_text already returns ISO dates; other shapes (manual input) go through the same parser
+    transaction_date = parse_date(parsed_data.get("date"), parsed_data.get("vendor"))
+
+    fields = {
+        "vendor": parsed_data.get("vendor"),
+        "transaction_date": transaction_date,
+        "amount": parsed_data.get("amount"),
+        "category": parsed_data.get("category"),
+        "currency": parsed_data.get("currency"),
+        "language": parsed_data.get("language"),
+    }
+    fields.update(base_currency_columns(fields["amount"], fields["currency"], transaction_date))
+    fields["year_month"] = year_month_of(transaction_date)
+    return fields
+
+def year_month_of(value: Optional[DateType]) -> Optional[int]:
+    """Integer month bucket of a date: 2024-06-15 -> 202406."""
+    return value.year * 100 + value.month if value else None
+
+def format_year_month(year_month: int) -> str:
+    return f"{year_month // 100:04d}-{year_month % 100:02d}"
+
+def base_currency_columns(amount: Optional[float],
+                          currency: Optional[str],
+                          on_date: Optional[DateType]) -> Dict[str, Any]:
+    """
+    Column values for the normalised currency, the FX rate in effect on the
+    transaction date and the amount in the base currency.
+    """
+    currency_code, fx_rate, base_amount = to_base_currency(amount, currency, on_date)
+    return {"currency_code": currency_code, "fx_rate": fx_rate, "base_amount": base_amount}
 
 def create_receipt(db: Session,
                    filename: str,
                    content_type: str,
                    saved_path: str,
-                   parsed_data: Dict[str, Any]) -> Receipt:
+                   parsed_data: Dict[str, Any],
+                   ocr_text: Optional[str] = None,
+                   phash: Optional[int] = None,
+                   content_hash: Optional[str] = None,
+                   blob_size: Optional[int] = None,
+                   blob_acquired: bool = False) -> Receipt:
     """
     Creates a new receipt record in the database.
+    If `content_hash` is given, the blob's refcount is taken in the same
+    transaction, unless the caller already holds it for the receipt (blob_acquired).
     """
-    vendor = parsed_data.get("vendor")
-    amount = parsed_data.get("amount")
-    category = parsed_data.get("category")
-    currency = parsed_data.get("currency")
-
-    transaction_date_str = parsed_data.get("date") # Assuming 'date' is the key from parse_receipt_text
-    transaction_date: Optional[DateType] = None
-    if transaction_date_str:
-        # Attempt to parse common date formats for storage as DateType
-        # This is a basic example; more robust parsing would go here.
-        try:
-            # Example: Try YYYY-MM-DD or MM/DD/YYYY
-            if '-' in transaction_date_str:
-                transaction_date = datetime.strptime(transaction_date_str, '%Y-%m-%d').date()
-            elif '/' in transaction_date_str:
-                transaction_date = datetime.strptime(transaction_date_str, '%m/%d/%Y').date()
-            # Add more formats as needed based on OCR output patterns
-        except ValueError:
-            print(f"Warning: Could not parse date '{transaction_date_str}'. Storing as None.")
-            transaction_date = None
+    fields = parsed_fields_to_columns(parsed_data)
 
     db_receipt = Receipt(
         filename=filename,
         content_type=content_type,
         saved_path=saved_path,
-        vendor=vendor,
-        transaction_date=transaction_date,
-        amount=amount,
-        category=category,
-        currency=currency
+        ocr_text=ocr_text,
+        content_hash=content_hash,
+        **fields
     )
+    if phash is not None:
+        db_receipt.phash = to_signed64(phash)
+        db_receipt.phash_b0, db_receipt.phash_b1, db_receipt.phash_b2, db_receipt.phash_b3 = split_bands(phash)
+    if content_hash and not blob_acquired:
+        acquire_blob(db, content_hash, saved_path, blob_size or 0)
+    db_receipt.vendor_id = resolve_vendor(db, db_receipt.vendor)
     db.add(db_receipt)
+    snapshot = receipt_snapshot(db_receipt)
+    # Scored against history before this receipt joins it
+    db_receipt.anomaly_score, db_receipt.anomaly_detail = score_receipt(db, snapshot)
+    maintain_aggregates(db, [(None, snapshot)])
+    items = parsed_data.get("items") or []
+    if items:
+        db.flush() # assigns db_receipt.id for the item rows
+        insert_receipt_items(db, {db_receipt.id: items})
     db.commit()
     db.refresh(db_receipt)
     return db_receipt
 
+# --- Canonical vendors ---
+
+# Seconds between checks for aliases written by other processes; a name
+# that matches nothing always triggers a check before a vendor is created.
+VENDOR_INDEX_REFRESH_SECONDS = 5.0
+
+# Process-wide alias index (backend/core/vendors.py), topped up from vendor_aliases
+_vendor_index = VendorIndex()
+_vendor_index_lock = threading.Lock()
+_vendor_index_checked = 0.0
+
+def _refresh_vendor_index(db: Session, force: bool = False) -> VendorIndex:
+    """
+    Loads aliases committed since the last refresh, by any process. Reads
+    through its own session so rows of an uncommitted (and possibly
+    rolled back) transaction never reach the shared index.
+    """
+    global _vendor_index_checked
+    if not force and time.monotonic() - _vendor_index_checked < VENDOR_INDEX_REFRESH_SECONDS:
+        return _vendor_index
+    with _vendor_index_lock, Session(bind=db.get_bind()) as reader:
+        rows = reader.query(VendorAlias.id, VendorAlias.alias, VendorAlias.vendor_id)\
+                     .filter(VendorAlias.id > _vendor_index.last_alias_id)\
+                     .order_by(VendorAlias.id).all()
+        for row in rows:
+            _vendor_index.add(row.alias, row.vendor_id)
+            _vendor_index.last_alias_id = row.id
+        _vendor_index_checked = time.monotonic()
+    return _vendor_index
+
+def _pending_vendor_index(db: Session) -> VendorIndex:
+    """Aliases written in this session's transaction, not yet in the shared index."""
+    return db.info.setdefault("pending_vendor_aliases", VendorIndex())
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_pending_vendor_aliases(session, *args):
+    # Committed aliases reach the shared index on its next refresh; rolled back ones must not be used
+    session.info.pop("pending_vendor_aliases", None)
+
+def _add_vendor_alias(db: Session, key: str, vendor_id: int, source: str) -> None:
+    db.add(VendorAlias(alias=key, vendor_id=vendor_id, source=source))
+    _pending_vendor_index(db).add(key, vendor_id)
+
+def match_vendor(db: Session, name: Optional[str]) -> Optional[int]:
+    """The id of the canonical vendor `name` refers to, or None. Never writes."""
+    key = normalize_vendor(name)
+    if not key:
+        return None
+    pending_id, pending_score = _pending_vendor_index(db).match(key)
+    vendor_id, score = _refresh_vendor_index(db).match(key)
+    if vendor_id is None and pending_id is None:
+        vendor_id, score = _refresh_vendor_index(db, force=True).match(key)
+    return pending_id if pending_score > score else vendor_id
+
+def resolve_vendor(db: Session, name: Optional[str]) -> Optional[int]:
+    """
+    Maps an OCR'd vendor name to a canonical vendor id: an exact alias, else
+    the closest fuzzy match, else a new vendor named after this spelling.
+    New spellings are recorded as aliases so the next lookup is exact.
+    Does not commit. Returns None for an empty name.
+    """
+    key = normalize_vendor(name)
+    if not key:
+        return None
+    vendor_id = match_vendor(db, name)
+    if vendor_id is None:
+        vendor = Vendor(name=name.strip())
+        db.add(vendor)
+        db.flush() # assigns vendor.id
+        _add_vendor_alias(db, key, vendor.id, "parsed")
+        return vendor.id
+    if key not in _vendor_index.aliases and key not in _pending_vendor_index(db).aliases:
+        _add_vendor_alias(db, key, vendor_id, "matched")
+    return vendor_id
+
+def learn_vendor_correction(db: Session, receipt: Receipt, old_name: Optional[str], old_vendor_id: Optional[int]) -> None:
+    """
+    Alias-learning hook for a user's vendor correction on `receipt`, which
+    has already moved to its new vendor; no other receipt is touched.
+    A correction that only re-spells the vendor ("Costko" -> "Costco", still
+    the same vendor or the same match key) becomes its display name. The old spelling is pinned to the
+    new vendor as a "user" alias only if it was this receipt's own OCR
+    misread: a spelling other receipts carry, or one a user already
+    pinned, names an established vendor and keeps pointing at it.
+    Does not commit.
+    """
+    global _vendor_index_checked
+    new_id = receipt.vendor_id
+    old_key, new_key = normalize_vendor(old_name), normalize_vendor(receipt.vendor)
+    if new_id is None:
+        return
+    vendor = db.get(Vendor, new_id)
+    if vendor is not None and receipt.vendor.strip() and \
+            (new_id == old_vendor_id or normalize_vendor(vendor.name) == new_key):
+        vendor.name = receipt.vendor.strip()
+    if not old_key or old_key == new_key or old_vendor_id is None or old_vendor_id == new_id:
+        return
+    pinned = db.query(VendorAlias.id).filter(VendorAlias.alias == old_key, VendorAlias.source == "user").first()
+    if pinned:
+        return
+    others = db.query(Receipt.vendor)\
+               .filter(Receipt.vendor_id == old_vendor_id, Receipt.id != receipt.id, Receipt.vendor.isnot(None))
+    if any(normalize_vendor(name) == old_key for (name,) in others.yield_per(1000)):
+        return
+    _add_vendor_alias(db, old_key, new_id, "user")
+    _vendor_index_checked = 0.0  # re-pointed alias: refresh on the next lookup in this process
+
+def _resolve_vendor_changes(db: Session, changes: List[Dict[str, Any]]) -> None:
+    """Adds vendor_id to bulk_update_mappings dicts that change the vendor name."""
+    for change in changes:
+        if "vendor" in change:
+            change["vendor_id"] = resolve_vendor(db, change["vendor"])
+
+def vendor_names(db: Session, vendor_ids) -> Dict[int, str]:
+    ids = {int(vendor_id) for vendor_id in vendor_ids if vendor_id is not None}
+    if not ids:
+        return {}
+    return dict(db.query(Vendor.id, Vendor.name).filter(Vendor.id.in_(ids)).all())
+
+def backfill_vendor_ids(db: Session, batch_size: int = 1000) -> int:
+    """
+    Links receipts stored before the vendors table existed (or with a
+    vendor set outside the ORM) to canonical vendors. The aggregates keyed
+    on vendor must be rebuilt afterwards; init_db does that.
+    """
+    filled, last_id = 0, 0
+    while True:
+        rows = db.query(Receipt.id, Receipt.vendor)\
+                 .filter(Receipt.id > last_id, Receipt.vendor_id.is_(None), Receipt.vendor.isnot(None))\
+                 .order_by(Receipt.id).limit(batch_size).all()
+        if not rows:
+            break
+        changes = [{"id": row.id, "vendor_id": resolve_vendor(db, row.vendor)} for row in rows]
+        changes = [c for c in changes if c["vendor_id"] is not None]
+        db.bulk_update_mappings(Receipt, changes)
+        db.commit()
+        filled += len(changes)
+        last_id = rows[-1].id
+    return filled
+
+# --- Aggregates maintained on write ---
+
+# Receipt columns the write-time aggregates are derived from
+AGGREGATE_COLUMNS = ("transaction_date", "category", "vendor_id", "currency_code", "amount", "base_amount")
+
+def receipt_snapshot(receipt) -> Dict[str, Any]:
+    """The aggregate-relevant column values of a receipt (ORM object or row)."""
+    return {name: getattr(receipt, name) for name in AGGREGATE_COLUMNS}
+
+def maintain_aggregates(db: Session, pairs: List[Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]]) -> None:
+    """
+    Applies receipt writes to the aggregates kept alongside the table.
+    Each pair is a (before, after) snapshot: (None, new) for an insert,
+    (old, None) for a delete. Does not commit; call it in the same
+    transaction as the write so the two never drift apart.
+    """
+    _adjust_daily_spend(db, pairs)
+    _adjust_sketches(db, pairs)
+    _adjust_spend_stats(db, pairs)
+
+def maintain_aggregates_for_changes(db: Session, changes: List[Dict[str, Any]]) -> None:
+    """
+    maintain_aggregates for a bulk UPDATE given as bulk_update_mappings
+    dicts. Must run before the UPDATE, while the old values can still be read.
+    """
+    changes = [c for c in changes if not c.keys().isdisjoint(AGGREGATE_COLUMNS)]
+    if not changes:
+        return
+    rows = db.query(Receipt.id, *[getattr(Receipt, name) for name in AGGREGATE_COLUMNS])\
+             .filter(Receipt.id.in_([c["id"] for c in changes])).all()
+    before = {row.id: receipt_snapshot(row) for row in rows}
+    pairs = []
+    for change in changes:
+        old = before.get(change["id"])
+        if old is not None:
+            pairs.append((old, {name: change.get(name, old[name]) for name in AGGREGATE_COLUMNS}))
+    maintain_aggregates(db, pairs)
+
+def _daily_spend_key(snapshot: Optional[Dict[str, Any]]):
+    if snapshot is None or snapshot["transaction_date"] is None:
+        return None
+    return (snapshot["transaction_date"], snapshot["category"] or "",
+            snapshot["vendor_id"] or 0, snapshot["currency_code"] or "")
+
+def _adjust_daily_spend(db: Session, pairs) -> None:
+    deltas: Dict[Tuple, List] = {}
+    for before, after in pairs:
+        for snapshot, sign in ((before, -1), (after, 1)):
+            key = _daily_spend_key(snapshot)
+            if key is None:
+                continue
+            delta = deltas.setdefault(key, [0, 0.0, 0.0])
+            delta[0] += sign
+            delta[1] += sign * (snapshot["base_amount"] or 0.0)
+            delta[2] += sign * (snapshot["amount"] or 0.0)
+
+    for (day, category, vendor_id, currency_code), (count, base, amount) in deltas.items():
+        if count == 0 and base == 0 and amount == 0:
+            continue  # an update that didn't touch this rollup cell
+        key_filter = (DailySpend.day == day, DailySpend.category == category,
+                      DailySpend.vendor_id == vendor_id, DailySpend.currency_code == currency_code)
+        updated = db.query(DailySpend).filter(*key_filter).update({
+            DailySpend.receipt_count: DailySpend.receipt_count + count,
+            DailySpend.total_base: DailySpend.total_base + base,
+            DailySpend.total_amount: DailySpend.total_amount + amount,
+        }, synchronize_session=False)
+        if not updated and count > 0:
+            db.add(DailySpend(day=day, category=category, vendor_id=vendor_id, currency_code=currency_code,
+                              receipt_count=count, total_base=base, total_amount=amount, **bucket_keys(day)))
+        elif count < 0:
+            db.query(DailySpend).filter(*key_filter, DailySpend.receipt_count <= 0).delete(synchronize_session=False)
+    db.flush()
+
+def rebuild_daily_spend(db: Session, batch_size: int = 5000) -> int:
+    """
+    Recomputes the calendar rollup from the receipts table with one
+    aggregate query. Returns the number of rollup rows written.
+    """
+    db.query(DailySpend).delete(synchronize_session=False)
+    category = func.coalesce(Receipt.category, "")
+    vendor_id = func.coalesce(Receipt.vendor_id, 0)
+    currency_code = func.coalesce(Receipt.currency_code, "")
+    groups = db.query(Receipt.transaction_date, category, vendor_id, currency_code,
+                      func.count(Receipt.id),
+                      func.coalesce(func.sum(Receipt.base_amount), 0.0),
+                      func.coalesce(func.sum(Receipt.amount), 0.0))\
+               .filter(Receipt.transaction_date.isnot(None))\
+               .group_by(Receipt.transaction_date, category, vendor_id, currency_code)\
+               .all()
+    rows = [
+        {"day": day, "category": cat, "vendor_id": ven, "currency_code": cur,
+         "receipt_count": count, "total_base": base, "total_amount": amount, **bucket_keys(day)}
+        for day, cat, ven, cur, count, base, amount in groups
+    ]
+    for start in range(0, len(rows), batch_size):
+        db.execute(insert(DailySpend), rows[start:start + batch_size])
+    db.commit()
+    return len(rows)
+
+def ensure_daily_spend(db: Session) -> int:
+    """Builds the rollup if it is empty but dated receipts exist (first start after upgrading)."""
+    if db.query(DailySpend.day).first() is not None:
+        return 0
+    if db.query(Receipt.id).filter(Receipt.transaction_date.isnot(None)).first() is None:
+        return 0
+    return rebuild_daily_spend(db)
+
+# Longest series the timeseries endpoint returns (about 13 years of days)
+MAX_TIMESERIES_POINTS = 5000
+
+_BUCKET_COLUMNS = {
+    "day": DailySpend.day,
+    "week": DailySpend.week_key,
+    "month": DailySpend.year_month,
+    "quarter": DailySpend.quarter_key,
+    "year": DailySpend.year,
+}
+
+def get_spend_timeseries(db: Session,
+                         granularity: str = "month",
+                         category: Optional[str] = None,
+                         vendor: Optional[str] = None,
+                         vendor_id: Optional[int] = None,
+                         currency: Optional[str] = None,
+                         start_date: Optional[DateType] = None,
+                         end_date: Optional[DateType] = None) -> Dict[str, Any]:
+    """
+    Spend per calendar bucket from the daily rollup, with every bucket in
+    the range present (zero-filled). The range defaults to the first and
+    last day with matching receipts. Totals are in the base currency;
+    with a `currency` filter, "amount" is also summed in that currency.
+    `vendor` is matched to a canonical vendor like an OCR'd name.
+    Raises ValueError for an unknown granularity or an over-long series.
+    """
+    if granularity not in _BUCKET_COLUMNS:
+        raise ValueError(f"granularity must be one of {tuple(_BUCKET_COLUMNS)}")
+    bucket = _BUCKET_COLUMNS[granularity]
+    filters = []
+    if category is not None:
+        filters.append(DailySpend.category == category)
+    if vendor is not None and vendor_id is None:
+        vendor_id = match_vendor(db, vendor) or -1  # an unknown vendor has no spend
+    if vendor_id is not None:
+        filters.append(DailySpend.vendor_id == vendor_id)
+    if currency:
+        filters.append(DailySpend.currency_code == (normalize_currency(currency) or currency.upper()))
+    if start_date:
+        filters.append(DailySpend.day >= start_date)
+    if end_date:
+        filters.append(DailySpend.day <= end_date)
+
+    if start_date is None or end_date is None:
+        first, last = db.query(func.min(DailySpend.day), func.max(DailySpend.day)).filter(*filters).one()
+        start_date, end_date = start_date or first, end_date or last
+    result = {"granularity": granularity, "start_date": start_date, "end_date": end_date, "series": []}
+    if start_date is None or end_date is None or start_date > end_date:
+        return result
+
+    buckets = list(iter_buckets(granularity, start_date, end_date))
+    if len(buckets) > MAX_TIMESERIES_POINTS:
+        raise ValueError(f"{len(buckets)} {granularity} buckets requested; narrow the date range "
+                         f"or use a coarser granularity (limit {MAX_TIMESERIES_POINTS})")
+
+    totals = {
+        key: (count, base, amount)
+        for key, count, base, amount in db.query(
+            bucket, func.sum(DailySpend.receipt_count), func.sum(DailySpend.total_base),
+            func.sum(DailySpend.total_amount)
+        ).filter(*filters).group_by(bucket).all()
+    }
+    for key, start in buckets:
+        count, base, amount = totals.get(key, (0, 0.0, 0.0))
+        point = {"period": bucket_label(granularity, start), "start": start,
+                 "receipt_count": count, "total_spend": round(base, 2)}
+        if currency:
+            point["amount"] = round(amount, 2)
+        result["series"].append(point)
+    return result
+
+# Streaming sketches (backend/core/sketches.py), one row each in analytics_sketches
+SKETCH_AMOUNTS = "amount_tdigest"
+SKETCH_AMOUNTS_REMOVED = "amount_tdigest_removed"
+SKETCH_VENDORS_DISTINCT = "vendor_hll"
+SKETCH_VENDORS_TOP = "vendor_topk"
+_SKETCH_TYPES = {
+    SKETCH_AMOUNTS: TDigest,
+    SKETCH_AMOUNTS_REMOVED: TDigest,
+    SKETCH_VENDORS_DISTINCT: HyperLogLog,
+    SKETCH_VENDORS_TOP: CountMinTopK,
+}
+
+def _vendor_key(vendor_id: Optional[int]) -> Optional[str]:
+    return str(vendor_id) if vendor_id is not None else None
+
+def _load_sketches(db: Session, names, for_update: bool = False) -> Dict[str, Tuple[Optional[AnalyticsSketch], Any]]:
+    """name -> (row or None, deserialised sketch); empty sketches for rows not stored yet."""
+    query = db.query(AnalyticsSketch).filter(AnalyticsSketch.name.in_(list(names)))
+    if for_update:
+        query = query.with_for_update()
+    rows = {row.name: row for row in query.all()}
+    return {
+        name: (rows.get(name), _SKETCH_TYPES[name].from_bytes(rows[name].data) if name in rows else _SKETCH_TYPES[name]())
+        for name in names
+    }
+
+def _store_sketch(db: Session, name: str, row: Optional[AnalyticsSketch], sketch, removed: int = 0) -> None:
+    if row is None:
+        row = AnalyticsSketch(name=name, removed_count=0)
+        db.add(row)
+    row.data = sketch.to_bytes()
+    row.removed_count = (row.removed_count or 0) + removed
+    row.updated_at = datetime.utcnow()
+
+def _adjust_sketches(db: Session, pairs) -> None:
+    """
+    Appends the writes' sketch changes as aggregate deltas: plain inserts,
+    so concurrent writes never wait on each other for the shared sketch
+    rows. fold_aggregate_deltas applies them.
+    """
+    rows = []
+    vendor_deltas: Dict[str, int] = {}
+    for before, after in pairs:
+        old_amount = before["base_amount"] if before else None
+        new_amount = after["base_amount"] if after else None
+        if old_amount != new_amount:
+            if old_amount is not None:
+                rows.append({"target": SKETCH_AMOUNTS_REMOVED, "key": None, "value": old_amount, "count": 1})
+            if new_amount is not None:
+                rows.append({"target": SKETCH_AMOUNTS, "key": None, "value": new_amount, "count": 1})
+        old_vendor = _vendor_key(before["vendor_id"]) if before else None
+        new_vendor = _vendor_key(after["vendor_id"]) if after else None
+        if old_vendor != new_vendor:
+            if old_vendor:
+                vendor_deltas[old_vendor] = vendor_deltas.get(old_vendor, 0) - 1
+            if new_vendor:
+                vendor_deltas[new_vendor] = vendor_deltas.get(new_vendor, 0) + 1
+    rows += [{"target": SKETCH_VENDORS_TOP, "key": key, "value": None, "count": delta}
+             for key, delta in vendor_deltas.items() if delta]
+    if rows:
+        db.execute(insert(AggregateDelta), rows)
+
+def fold_aggregate_deltas(db: Session, batch_size: int = 5000) -> int:
+    """
+    Applies the pending aggregate deltas to the stored sketches and the
+    spend_stats digests and deletes them, in one transaction holding the
+    sketch rows' lock (the only place that takes it besides a rebuild).
+    Commits. Returns the deltas folded.
+    """
+    max_id = db.query(func.max(AggregateDelta.id)).scalar()
+    if max_id is None:
+        db.rollback()
+        return 0
+    # A concurrent fold that got the lock first leaves nothing up to max_id to apply
+    sketches = _load_sketches(db, list(_SKETCH_TYPES), for_update=True)
+    touched = set()
+    spend_values: Dict[Tuple[str, str, str], List[float]] = {}
+    removed_amounts, removed_vendors = 0, 0
+    folded, last_id = 0, 0
+    while True:
+        rows = db.query(AggregateDelta.id, AggregateDelta.target, AggregateDelta.dimension, AggregateDelta.key,
+                        AggregateDelta.value, AggregateDelta.count)\
+                 .filter(AggregateDelta.id > last_id, AggregateDelta.id <= max_id)\
+                 .order_by(AggregateDelta.id).limit(batch_size).all()
+        if not rows:
+            break
+        for row in rows:
+            if row.target == SKETCH_VENDORS_TOP:
+                if row.count > 0:
+                    sketches[SKETCH_VENDORS_DISTINCT][1].add(row.key)
+                else:
+                    removed_vendors -= row.count
+                sketches[SKETCH_VENDORS_TOP][1].add(row.key, row.key, row.count)
+                touched.update((SKETCH_VENDORS_DISTINCT, SKETCH_VENDORS_TOP))
+            elif row.target in (SKETCH_AMOUNTS, SKETCH_AMOUNTS_REMOVED):
+                sketches[row.target][1].add(row.value)
+                removed_amounts += row.target == SKETCH_AMOUNTS_REMOVED
+                touched.update((SKETCH_AMOUNTS, SKETCH_AMOUNTS_REMOVED))
+            elif row.target in (SPEND_DIGEST, SPEND_REMOVED_DIGEST):
+                spend_values.setdefault((row.target, row.dimension, row.key), []).append(row.value)
+        folded += len(rows)
+        last_id = rows[-1].id
+
+    # Removed amounts are counted on the main digest so readers know how stale it may be;
+    # the HyperLogLog is insert-only, so vendor deletions are counted on both vendor sketches
+    removed_counts = {SKETCH_AMOUNTS: removed_amounts,
+                      SKETCH_VENDORS_DISTINCT: removed_vendors, SKETCH_VENDORS_TOP: removed_vendors}
+    for name in touched:
+        row, sketch = sketches[name]
+        _store_sketch(db, name, row, sketch, removed=removed_counts.get(name, 0))
+    _fold_spend_digests(db, spend_values)
+    db.query(AggregateDelta).filter(AggregateDelta.id <= max_id).delete(synchronize_session=False)
+    db.commit()
+    return folded
+
+def rebuild_sketches(db: Session, batch_size: int = 5000) -> Dict[str, int]:
+    """
+    Recomputes every analytics sketch with one keyset-paginated pass over
+    receipts, discarding accumulated deletions and the deltas already
+    pending when it starts. Returns the rows scanned.
+    """
+    pending = db.query(func.max(AggregateDelta.id)).scalar()
+    amounts, hll, top = TDigest(), HyperLogLog(), CountMinTopK()
+    scanned, last_id = 0, 0
+    while True:
+        rows = db.query(Receipt.id, Receipt.vendor_id, Receipt.base_amount)\
+                 .filter(Receipt.id > last_id).order_by(Receipt.id).limit(batch_size).all()
+        if not rows:
+            break
+        for row in rows:
+            if row.base_amount is not None:
+                amounts.add(row.base_amount)
+            key = _vendor_key(row.vendor_id)
+            if key:
+                hll.add(key)
+                top.add(key)
+        scanned += len(rows)
+        last_id = rows[-1].id
+
+    now = datetime.utcnow()
+    if pending is not None:
+        db.query(AggregateDelta).filter(AggregateDelta.id <= pending, AggregateDelta.target.in_(list(_SKETCH_TYPES)))\
+          .delete(synchronize_session=False)
+    db.query(AnalyticsSketch).delete(synchronize_session=False)
+    for name, sketch in ((SKETCH_AMOUNTS, amounts), (SKETCH_AMOUNTS_REMOVED, TDigest()),
+                         (SKETCH_VENDORS_DISTINCT, hll), (SKETCH_VENDORS_TOP, top)):
+        db.add(AnalyticsSketch(name=name, data=sketch.to_bytes(), removed_count=0, rebuilt_at=now, updated_at=now))
+    db.commit()
+    return {"scanned": scanned}
+
+def ensure_sketches(db: Session) -> int:
+    """
+    Builds the sketches if none are stored yet (first start, or after
+    upgrading with receipts already stored), so the rows folds lock exist.
+    """
+    if db.query(AnalyticsSketch.name).first() is not None:
+        return 0
+    return rebuild_sketches(db)["scanned"]
+
+def _sketch_meta(row: Optional[AnalyticsSketch]) -> Dict[str, Any]:
+    return {
+        "removed_since_rebuild": row.removed_count if row else 0,
+        "rebuilt_at": row.rebuilt_at if row else None,
+    }
+
+def get_approx_percentiles(db: Session, quantiles: List[float]) -> Dict[str, Any]:
+    """Percentiles of base_amount from the t-digest, after folding in pending writes."""
+    fold_aggregate_deltas(db)
+    sketches = _load_sketches(db, [SKETCH_AMOUNTS, SKETCH_AMOUNTS_REMOVED])
+    (row, added), (_, removed) = sketches[SKETCH_AMOUNTS], sketches[SKETCH_AMOUNTS_REMOVED]
+    values = {}
+    for q in quantiles:
+        value = quantile_with_removals(added, removed, q)
+        values[f"p{q * 100:g}"] = round(value, 2) if value is not None else None
+    return {
+        "percentiles": values,
+        "count": int(added.total - removed.total),
+        "error_bound": TDigest.ERROR_NOTE + " Deleted values are subtracted approximately; "
+                       "rebuild when removed_since_rebuild is a large share of count.",
+        **_sketch_meta(row),
+    }
+
+def get_approx_distinct_vendors(db: Session) -> Dict[str, Any]:
+    """Distinct vendor count from the HyperLogLog, after folding in pending writes."""
+    fold_aggregate_deltas(db)
+    row, hll = _load_sketches(db, [SKETCH_VENDORS_DISTINCT])[SKETCH_VENDORS_DISTINCT]
+    return {
+        "distinct_vendors": hll.count(),
+        "standard_error": round(hll.standard_error, 4),
+        "error_bound": f"Within ±{2 * hll.standard_error:.1%} of the true count 95% of the time. Vendors whose "
+                       "receipts were all deleted are still counted until the next rebuild.",
+        **_sketch_meta(row),
+    }
+
+def get_approx_top_vendors(db: Session, k: int = 10) -> Dict[str, Any]:
+    """The k most frequent vendors from the Count-Min sketch and its candidate heap, after folding in pending writes."""
+    fold_aggregate_deltas(db)
+    row, top = _load_sketches(db, [SKETCH_VENDORS_TOP])[SKETCH_VENDORS_TOP]
+    max_overcount = math.ceil(top.epsilon * top.total)
+    ranked = top.top(k)  # keyed by vendor id
+    names = vendor_names(db, [key for key, _ in ranked])
+    return {
+        "top_vendors": [{"vendor": names.get(int(key)), "vendor_id": int(key), "count": count}
+                        for key, count in ranked],
+        "total": top.total,
+        "max_overcount": max_overcount,
+        "error_bound": f"Counts are never under the true count and exceed it by at most {max_overcount} "
+                       f"with probability {1 - top.delta:.1%}.",
+        **_sketch_meta(row),
+    }
+
+# Per-vendor / per-category running statistics for anomaly scores (backend/core/anomaly.py)
+
+def _stats_keys(snapshot: Optional[Dict[str, Any]]) -> List[Tuple[str, str]]:
+    if snapshot is None:
+        return []
+    keys = []
+    vendor = _vendor_key(snapshot["vendor_id"])
+    if vendor:
+        keys.append(("vendor", vendor))
+    if snapshot["category"]:
+        keys.append(("category", snapshot["category"]))
+    return keys
+
+# Aggregate delta targets for the spend_stats digests
+SPEND_DIGEST = "spend_digest"
+SPEND_REMOVED_DIGEST = "spend_removed_digest"
+
+def _get_spend_stats(db: Session, dimension: str, key: str):
+    """The statistics row's values, read from the database (writes update it without the ORM)."""
+    return db.query(SpendStats.count, SpendStats.mean, SpendStats.m2, SpendStats.digest, SpendStats.removed_digest)\
+             .filter(SpendStats.dimension == dimension, SpendStats.key == key).first()
+
+def _merged_stats(count: int, mean: float, m2: float) -> Dict[Any, Any]:
+    """
+    SET clause merging a batch's (count, mean, M2) into a row (Chan et al.),
+    evaluated by the database against the row's current values.
+    """
+    total = SpendStats.count + count
+    delta = mean - SpendStats.mean
+    return {SpendStats.count: total,
+            SpendStats.mean: SpendStats.mean + delta * count / total,
+            SpendStats.m2: SpendStats.m2 + m2 + delta * delta * SpendStats.count * count / total}
+
+def _unmerged_stats(count: int, mean: float, m2: float) -> Dict[Any, Any]:
+    """SET clause taking a batch's (count, mean, M2) back out of a row; the exact inverse of _merged_stats."""
+    rest = SpendStats.count - count
+    rest_mean = (SpendStats.mean * SpendStats.count - mean * count) / rest
+    delta = mean - rest_mean
+    rest_m2 = SpendStats.m2 - m2 - delta * delta * rest * count / SpendStats.count
+    return {SpendStats.count: rest,
+            SpendStats.mean: rest_mean,
+            SpendStats.m2: case((rest_m2 < 0, 0.0), else_=rest_m2)}
+
+def _adjust_spend_stats(db: Session, pairs) -> None:
+    """
+    Merges the writes into the vendor / category statistics with one
+    UPDATE per key and change direction, so concurrent writes never hold a
+    read-modify-write lock on a row. The digests are appended as aggregate
+    deltas.
+    """
+    changes: Dict[Tuple[str, str], Tuple[List[float], List[float]]] = {}
+    for before, after in pairs:
+        old_x = transform(before["base_amount"]) if before else None
+        new_x = transform(after["base_amount"]) if after else None
+        old_keys = set(_stats_keys(before)) if old_x is not None else set()
+        new_keys = set(_stats_keys(after)) if new_x is not None else set()
+        for key in old_keys:
+            if key not in new_keys or old_x != new_x:
+                changes.setdefault(key, ([], []))[1].append(old_x)
+        for key in new_keys:
+            if key not in old_keys or old_x != new_x:
+                changes.setdefault(key, ([], []))[0].append(new_x)
+
+    digest_rows = []
+    for (dimension, key), (added, removed) in changes.items():
+        key_filter = (SpendStats.dimension == dimension, SpendStats.key == key)
+        if removed:
+            count, mean, m2 = summarize(removed)
+            # Last receipts gone: drop the row so its removed_digest doesn't linger
+            db.query(SpendStats).filter(*key_filter, SpendStats.count <= count).delete(synchronize_session=False)
+            db.query(SpendStats).filter(*key_filter, SpendStats.count > count)\
+              .update(_unmerged_stats(count, mean, m2), synchronize_session=False)
+        if added:
+            count, mean, m2 = summarize(added)
+            updated = db.query(SpendStats).filter(*key_filter)\
+                        .update(_merged_stats(count, mean, m2), synchronize_session=False)
+            if not updated:
+                db.add(SpendStats(dimension=dimension, key=key, count=count, mean=mean, m2=m2))
+        digest_rows += [{"target": SPEND_DIGEST, "dimension": dimension, "key": key, "value": x, "count": 1}
+                        for x in added]
+        digest_rows += [{"target": SPEND_REMOVED_DIGEST, "dimension": dimension, "key": key, "value": x, "count": 1}
+                        for x in removed]
+    if digest_rows:
+        db.execute(insert(AggregateDelta), digest_rows)
+    db.flush()
+
+def _fold_spend_digests(db: Session, values: Dict[Tuple[str, str, str], List[float]]) -> None:
+    """Adds folded digest deltas, keyed (target, dimension, key), to the spend_stats rows still present."""
+    columns = {SPEND_DIGEST: "digest", SPEND_REMOVED_DIGEST: "removed_digest"}
+    rows = {}
+    for target, dimension, key in values:
+        if (dimension, key) not in rows:
+            rows[(dimension, key)] = db.query(SpendStats)\
+                .filter(SpendStats.dimension == dimension, SpendStats.key == key).with_for_update().first()
+    for (target, dimension, key), xs in values.items():
+        stats = rows[(dimension, key)]
+        if stats is None:
+            continue  # every receipt of the key was deleted since
+        data = getattr(stats, columns[target])
+        digest = TDigest.from_bytes(data) if data else TDigest(ANOMALY_DIGEST_COMPRESSION)
+        for x in xs:
+            digest.add(x)
+        setattr(stats, columns[target], digest.to_bytes())
+
+def score_receipt(db: Session,
+                  snapshot: Dict[str, Any],
+                  exclude: Optional[Dict[str, Any]] = None) -> Tuple[Optional[float], Optional[str]]:
+    """
+    Anomaly score of a receipt's amount: the largest |z| of log(base_amount)
+    against its vendor's and its category's running statistics, which
+    should not include the receipt itself (`exclude` is its previous
+    snapshot when re-scoring an update). Two primary-key reads; O(1).
+    Returns (score, detail) or (None, None) when there is too little history.
+    """
+    x = transform(snapshot["base_amount"])
+    if x is None:
+        return None, None
+    old_x = transform(exclude["base_amount"]) if exclude else None
+    excluded_keys = set(_stats_keys(exclude)) if old_x is not None else set()
+
+    best = (None, None)
+    for dimension, key in _stats_keys(snapshot):
+        stats = _get_spend_stats(db, dimension, key)
+        if stats is None:
+            continue
+        count, mean, m2 = stats.count, stats.mean, stats.m2
+        if (dimension, key) in excluded_keys:
+            count, mean, m2 = welford_remove(count, mean, m2, old_x)
+        score = z_score(x, count, mean, m2)
+        if score is None or (best[0] is not None and score <= best[0]):
+            continue
+        ratio = math.exp(x - mean)
+        label = vendor_names(db, [key]).get(int(key), key) if dimension == "vendor" else key
+        detail = f"{ratio:.3g}x the typical amount for {dimension} '{label}' ({count} receipts)"
+        if stats.digest:
+            removed = TDigest.from_bytes(stats.removed_digest) if stats.removed_digest else None
+            share = cdf_with_removals(TDigest.from_bytes(stats.digest), removed, x)
+            if share is not None:
+                detail += f", {'above' if x > mean else 'below'} {max(share, 1 - share) * 100:.0f}% of them"
+        best = (round(score, 3), detail)
+    return best
+
+def rebuild_spend_stats(db: Session, rescore: bool = True, batch_size: int = 2000) -> Dict[str, int]:
+    """
+    Recomputes the vendor / category statistics from the receipts table
+    and, with `rescore`, every stored anomaly score against them (each
+    receipt is scored as if it were the newest). Keyset-paginated.
+    """
+    db.query(AggregateDelta).filter(AggregateDelta.target.in_([SPEND_DIGEST, SPEND_REMOVED_DIGEST]))\
+      .delete(synchronize_session=False)
+    db.query(SpendStats).delete(synchronize_session=False)
+    db.flush()
+    columns = [Receipt.id] + [getattr(Receipt, name) for name in AGGREGATE_COLUMNS]
+
+    scanned, last_id = 0, 0
+    while True:
+        rows = db.query(*columns).filter(Receipt.id > last_id).order_by(Receipt.id).limit(batch_size).all()
+        if not rows:
+            break
+        _adjust_spend_stats(db, [(None, receipt_snapshot(row)) for row in rows])
+        scanned += len(rows)
+        last_id = rows[-1].id
+    db.commit()
+    fold_aggregate_deltas(db)  # the digests the score details quote
+
+    scored, last_id = 0, 0
+    while rescore:
+        rows = db.query(*columns).filter(Receipt.id > last_id).order_by(Receipt.id).limit(batch_size).all()
+        if not rows:
+            break
+        changes = []
+        for row in rows:
+            snapshot = receipt_snapshot(row)
+            score, detail = score_receipt(db, snapshot, exclude=snapshot)
+            changes.append({"id": row.id, "anomaly_score": score, "anomaly_detail": detail})
+            scored += score is not None
+        db.bulk_update_mappings(Receipt, changes)
+        db.commit()
+        last_id = rows[-1].id
+    return {"scanned": scanned, "scored": scored}
+
+def ensure_spend_stats(db: Session) -> int:
+    """Builds the statistics (and scores) if none exist yet but receipts do (first start after upgrading)."""
+    if db.query(SpendStats.key).first() is not None:
+        return 0
+    if db.query(Receipt.id).filter(Receipt.base_amount > 0).first() is None:
+        return 0
+    return rebuild_spend_stats(db)["scanned"]
+
+# --- Line items ---
+
+def item_terms(description: Optional[str]) -> List[str]:
+    """Lower-cased words of an item description, as stored in the term index."""
+    if not description:
+        return []
+    return sorted({w for w in re.findall(r"[a-z0-9]+", description.lower()) if len(w) > 1 and not w.isdigit()})
+
+def insert_receipt_items(db: Session, items_by_receipt: Dict[int, List[Dict[str, Any]]]) -> None:
+    """
+    Inserts line items (and their search terms) for one or more receipts as
+    one executemany per table. Does not commit.
+    """
+    item_rows, term_rows = [], []
+    for receipt_id, items in items_by_receipt.items():
+        for line_no, item in enumerate(items):
+            item_rows.append({
+                "receipt_id": receipt_id,
+                "line_no": line_no,
+                "description": item["description"],
+                "quantity": item.get("quantity"),
+                "unit_price": item.get("unit_price"),
+                "total": item.get("total")
+            })
+            term_rows.extend(
+                {"term": term, "receipt_id": receipt_id, "line_no": line_no}
+                for term in item_terms(item["description"])
+            )
+    if item_rows:
+        db.execute(insert(ReceiptItem), item_rows)
+    if term_rows:
+        db.execute(insert(ReceiptItemTerm), term_rows)
+
+def delete_receipt_items(db: Session, receipt_ids: List[int]) -> None:
+    """Removes the line items and search terms of the given receipts. Does not commit."""
+    if not receipt_ids:
+        return
+    db.query(ReceiptItemTerm).filter(ReceiptItemTerm.receipt_id.in_(receipt_ids)).delete(synchronize_session=False)
+    db.query(ReceiptItem).filter(ReceiptItem.receipt_id.in_(receipt_ids)).delete(synchronize_session=False)
+
+def get_receipt_items(db: Session, receipt_id: int) -> List[ReceiptItem]:
+    return db.query(ReceiptItem).filter(ReceiptItem.receipt_id == receipt_id)\
+             .order_by(ReceiptItem.line_no).all()
+
+def _matching_items(db: Session, query: str):
+    """
+    Subquery of (receipt_id, line_no) for items containing every word of
+    `query`, resolved through the term index. None if the query has no words.
+    """
+    terms = item_terms(query)
+    if not terms:
+        return None
+    return db.query(ReceiptItemTerm.receipt_id, ReceiptItemTerm.line_no)\
+             .filter(ReceiptItemTerm.term.in_(terms))\
+             .group_by(ReceiptItemTerm.receipt_id, ReceiptItemTerm.line_no)\
+             .having(func.count() == len(terms))\
+             .subquery()
+
+def _filter_by_transaction_date(query, start_date: Optional[DateType], end_date: Optional[DateType]):
+    if start_date:
+        query = query.filter(Receipt.transaction_date >= start_date)
+    if end_date:
+        query = query.filter(Receipt.transaction_date <= end_date)
+    return query
+
+def search_items(db: Session,
+                 query: str,
+                 start_date: Optional[DateType] = None,
+                 end_date: Optional[DateType] = None,
+                 skip: int = 0,
+                 limit: int = 100) -> List[Dict[str, Any]]:
+    """
+    Finds line items whose description contains every word of `query`.
+    """
+    matched = _matching_items(db, query)
+    if matched is None:
+        return []
+    rows = db.query(ReceiptItem, Receipt.vendor, Receipt.transaction_date, Receipt.currency_code)\
+             .join(matched, (ReceiptItem.receipt_id == matched.c.receipt_id) & (ReceiptItem.line_no == matched.c.line_no))\
+             .join(Receipt, Receipt.id == ReceiptItem.receipt_id)
+    rows = _filter_by_transaction_date(rows, start_date, end_date)
+    rows = rows.order_by(desc(ReceiptItem.receipt_id), ReceiptItem.line_no).offset(skip).limit(limit).all()
+    return [
+        {
+            "receipt_id": item.receipt_id,
+            "line_no": item.line_no,
+            "description": item.description,
+            "quantity": item.quantity,
+            "unit_price": item.unit_price,
+            "total": item.total,
+            "vendor": vendor,
+            "transaction_date": transaction_date,
+            "currency_code": currency_code
+        }
+        for item, vendor, transaction_date, currency_code in rows
+    ]
+
+def get_item_spend(db: Session,
+                   query: str,
+                   start_date: Optional[DateType] = None,
+                   end_date: Optional[DateType] = None) -> Dict[str, Any]:
+    """
+    Aggregates spend on items matching `query` (e.g. "milk"), converted to
+    the base currency with each receipt's ingest-time FX rate.
+    """
+    empty = {"query": query, "total_spend": 0.0, "total_quantity": 0.0, "item_count": 0, "receipt_count": 0}
+    matched = _matching_items(db, query)
+    if matched is None:
+        return empty
+    agg = db.query(
+        func.sum(ReceiptItem.total * Receipt.fx_rate).label("total_spend"),
+        func.sum(ReceiptItem.quantity).label("total_quantity"),
+        func.count().label("item_count"),
+        func.count(func.distinct(ReceiptItem.receipt_id)).label("receipt_count")
+    )\
+    .join(matched, (ReceiptItem.receipt_id == matched.c.receipt_id) & (ReceiptItem.line_no == matched.c.line_no))\
+    .join(Receipt, Receipt.id == ReceiptItem.receipt_id)\
+    .filter(Receipt.fx_rate.isnot(None))
+    row = _filter_by_transaction_date(agg, start_date, end_date).one()
+    return {
+        "query": query,
+        "total_spend": row.total_spend or 0.0,
+        "total_quantity": row.total_quantity or 0.0,
+        "item_count": row.item_count,
+        "receipt_count": row.receipt_count
+    }
+
+# --- Blob reference counting (content-addressed upload storage) ---
+
+def acquire_blob(db: Session, digest: str, path: str, size: int) -> None:
+    """
+    Takes one reference on a stored blob, registering it on first use.
+    Does not commit; the caller commits together with the referencing row.
+    """
+    # Storing the content again restored a file removed by retention, as uploaded
+    restored = Blob.purged_at.isnot(None)
+    updated = db.query(Blob).filter(Blob.digest == digest)\
+                .update({Blob.refcount: Blob.refcount + 1,
+                         Blob.recompressed_at: case((restored, None), else_=Blob.recompressed_at),
+                         Blob.stored_size: case((restored, None), else_=Blob.stored_size),
+                         Blob.purged_at: None,
+                         Blob.released_at: None}, synchronize_session=False)
+    if not updated:
+        db.add(Blob(digest=digest, path=path, size=size, refcount=1))
+        db.flush()  # so a second acquire in this transaction updates the row instead of adding another
+
+def release_blob(db: Session, digest: str) -> bool:
+    """
+    Drops one reference on a blob. Returns True when it was the last one,
+    in which case the blob is marked released in the same transaction; its
+    file and row go with cleanup.remove_released_files. Does not commit.
+    """
+    db.query(Blob).filter(Blob.digest == digest)\
+      .update({Blob.refcount: Blob.refcount - 1}, synchronize_session=False)
+    released = db.query(Blob).filter(Blob.digest == digest, Blob.refcount <= 0)\
+                 .update({Blob.released_at: datetime.utcnow()}, synchronize_session=False)
+    return bool(released)
+
+def get_blob(db: Session, digest: str) -> Optional[Blob]:
+    return db.query(Blob).filter(Blob.digest == digest).first()
+
+def live_blob_digests(db: Session, digests: List[str]) -> set:
+    """The digests among `digests` that are registered (referenced) blobs."""
+    if not digests:
+        return set()
+    return {digest for (digest,) in db.query(Blob.digest).filter(Blob.digest.in_(list(digests)))}
+
+def released_blob_digests(db: Session, digests: List[str]) -> set:
+    """The digests among `digests` still marked released (no upload has referenced them since)."""
+    if not digests:
+        return set()
+    return {digest for (digest,) in db.query(Blob.digest)
+            .filter(Blob.digest.in_(list(digests)), Blob.released_at.isnot(None), Blob.refcount <= 0)}
+
+def forget_released_blobs(db: Session, digests: List[str]) -> None:
+    """Removes the rows of blobs whose files are gone, unless referenced again. Does not commit."""
+    if digests:
+        db.query(Blob).filter(Blob.digest.in_(list(digests)), Blob.released_at.isnot(None), Blob.refcount <= 0)\
+          .delete(synchronize_session=False)
+
+def get_released_blobs(db: Session, before: datetime, after: str = "", limit: int = 500) -> List[str]:
+    """Digests, in order after `after`, of blobs released before `before` whose files are still awaiting removal."""
+    return [digest for (digest,) in db.query(Blob.digest)
+            .filter(Blob.digest > after, Blob.released_at < before, Blob.refcount <= 0)
+            .order_by(Blob.digest).limit(limit)]
+
+def get_blobs_to_recompress(db: Session, after: str = "", limit: int = 500) -> List[Tuple[str, str, str]]:
+    """
+    (digest, path, content_type) of blobs not yet looked at by the lifecycle,
+    in digest order after `after`. Only blobs with a receipt qualify: their
+    OCR has run, so the file is no longer read at its original quality.
+    """
+    return db.query(Blob.digest, Blob.path, func.min(Receipt.content_type))\
+             .join(Receipt, Receipt.content_hash == Blob.digest)\
+             .filter(Blob.digest > after, Blob.recompressed_at.is_(None), Blob.purged_at.is_(None))\
+             .group_by(Blob.digest, Blob.path)\
+             .order_by(Blob.digest).limit(limit).all()
+
+def record_recompressed(db: Session, digest: str, stored_size: Optional[int]) -> None:
+    """Marks a blob as handled by the lifecycle, with its new size if it was re-encoded. Does not commit."""
+    values = {Blob.recompressed_at: datetime.utcnow()}
+    if stored_size is not None:
+        values[Blob.stored_size] = stored_size
+    db.query(Blob).filter(Blob.digest == digest).update(values, synchronize_session=False)
+
+def get_blobs_past_retention(db: Session, cutoff: DateType, after: str = "", limit: int = 500) -> List[str]:
+    """
+    Digests, in order after `after`, of blobs whose every receipt was
+    uploaded before `cutoff` and that no unfinished OCR job or upload still
+    needs. Each receipt holds one reference, so a refcount above the
+    receipt count means an upload of the same content is being OCR'd.
+    """
+    pending = db.query(OcrJob.id).filter(OcrJob.content_hash == Blob.digest,
+                                         OcrJob.status.in_(["queued", "leased"]))
+    rows = db.query(Blob.digest)\
+             .join(Receipt, Receipt.content_hash == Blob.digest)\
+             .filter(Blob.digest > after, Blob.purged_at.is_(None), ~pending.exists())\
+             .group_by(Blob.digest, Blob.refcount)\
+             .having(func.max(Receipt.created_at) < cutoff, Blob.refcount <= func.count(Receipt.id))\
+             .order_by(Blob.digest).limit(limit)
+    return [digest for (digest,) in rows]
+
+def mark_blobs_purged(db: Session, digests: List[str]) -> None:
+    """Records that the retention policy removes these blobs' files. Does not commit."""
+    if digests:
+        db.query(Blob).filter(Blob.digest.in_(list(digests)), Blob.purged_at.is_(None))\
+          .update({Blob.purged_at: datetime.utcnow()}, synchronize_session=False)
+
+def purged_blob_digests(db: Session, digests: List[str]) -> set:
+    """The digests among `digests` still marked purged (no upload has restored them since)."""
+    if not digests:
+        return set()
+    return {digest for (digest,) in db.query(Blob.digest)
+            .filter(Blob.digest.in_(list(digests)), Blob.purged_at.isnot(None))}
+
+def referenced_paths(db: Session, paths: List[str]) -> set:
+    """The paths among `paths` that a receipt or an OCR job stores as its saved_path."""
+    if not paths:
+        return set()
+    paths = list(paths)
+    used = {path for (path,) in db.query(Receipt.saved_path).filter(Receipt.saved_path.in_(paths)).distinct()}
+    used |= {path for (path,) in db.query(OcrJob.saved_path).filter(OcrJob.saved_path.in_(paths)).distinct()}
+    return used
+
+def get_receipt_files(db: Session, after_id: int = 0, limit: int = 500):
+    """
+    (id, saved_path, purged) for receipts after `after_id`, in id order.
+    `purged` is true when the retention policy removed the receipt's file.
+    """
+    return db.query(Receipt.id, Receipt.saved_path, Blob.purged_at.isnot(None).label("purged"))\
+             .outerjoin(Blob, Blob.digest == Receipt.content_hash)\
+             .filter(Receipt.id > after_id)\
+             .order_by(Receipt.id).limit(limit).all()
+
+def find_near_duplicate(db: Session, phash: int, max_distance: int) -> Optional[Tuple[Receipt, int]]:
+    """
+    Finds the stored receipt whose perceptual hash is closest to `phash`,
+    if it is within `max_distance` bits. Returns (receipt, distance) or None.
+    Uses multi-index hashing: each band column is probed with its small
+    neighbourhood via the band indexes, so no full scan is needed.
+    """
+    radius = max_distance // PHASH_BANDS
+    band_columns = [Receipt.phash_b0, Receipt.phash_b1, Receipt.phash_b2, Receipt.phash_b3]
+    conditions = [
+        column.in_(band_neighbours(band, radius))
+        for column, band in zip(band_columns, split_bands(phash))
+    ]
+    candidates = db.query(Receipt.id, Receipt.phash).filter(or_(*conditions)).all()
+
+    best_id, best_distance = None, None
+    for candidate_id, candidate_hash in candidates:
+        distance = hamming_distance(phash, from_signed64(candidate_hash))
+        if distance <= max_distance and (best_distance is None or distance < best_distance):
+            best_id, best_distance = candidate_id, distance
+    if best_id is None:
+        return None
+    return get_receipt(db, best_id), best_distance
+
 def get_receipts(db: Session, skip: int = 0, limit: int = 100):
     """
     Retrieves a list of receipt records from the database.
@@ -68,15 +1125,31 @@ def update_receipt(db: Session, receipt_id: int, update_data: Dict[str, Any]):
     """
     db_receipt = db.query(Receipt).filter(Receipt.id == receipt_id).first()
     if db_receipt:
+        before = receipt_snapshot(db_receipt)
+        old_vendor = db_receipt.vendor
         for key, value in update_data.items():
             if key == "transaction_date" and isinstance(value, str):
-                try:
-                    # Attempt to parse date string to DateType for updates
-                    db_receipt.transaction_date = DateType.fromisoformat(value)
-                except ValueError:
-                    print(f"Warning: Could not parse update date '{value}'. Date not updated.")
+                # Attempt to parse date string to DateType for updates
+                parsed = parse_date(value, db_receipt.vendor)
+                if parsed:
+                    db_receipt.transaction_date = parsed
+                else:
+                    logger.warning("Could not parse update date %r for receipt %s; date not updated", value, receipt_id)
             else:
                 setattr(db_receipt, key, value)
+        if "transaction_date" in update_data:
+            db_receipt.year_month = year_month_of(db_receipt.transaction_date)
+        if {"amount", "currency", "transaction_date"} & update_data.keys():
+            for key, value in base_currency_columns(db_receipt.amount, db_receipt.currency,
+                                                    db_receipt.transaction_date or db_receipt.created_at).items():
+                setattr(db_receipt, key, value)
+        if "vendor" in update_data and db_receipt.vendor != old_vendor:
+            db_receipt.vendor_id = resolve_vendor(db, db_receipt.vendor)
+            learn_vendor_correction(db, db_receipt, old_vendor, before["vendor_id"])
+        after = receipt_snapshot(db_receipt)
+        if any(before[name] != after[name] for name in ("vendor_id", "category", "base_amount")):
+            db_receipt.anomaly_score, db_receipt.anomaly_detail = score_receipt(db, after, exclude=before)
+        maintain_aggregates(db, [(before, after)])
         db.commit()
         db.refresh(db_receipt)
         return db_receipt
@@ -84,15 +1157,151 @@ def update_receipt(db: Session, receipt_id: int, update_data: Dict[str, Any]):
 
 def delete_receipt(db: Session, receipt_id: int):
     """
-    Deletes a receipt record from the database.
+    Deletes a receipt record from the database and releases its blob reference.
     """
     db_receipt = db.query(Receipt).filter(Receipt.id == receipt_id).first()
     if db_receipt:
+        if db_receipt.content_hash:
+            release_blob(db, db_receipt.content_hash)
+        maintain_aggregates(db, [(receipt_snapshot(db_receipt), None)])
+        delete_receipt_items(db, [db_receipt.id])
         db.delete(db_receipt)
         db.commit()
         return True
     return False
 
+def release_blobs(db: Session, digests: List[str]) -> List[str]:
+    """
+    release_blob for many references at once (a digest may repeat): one
+    executemany UPDATE and one UPDATE marking the released blobs. Returns
+    the digests whose last reference went away. Does not commit.
+    """
+    counts: Dict[str, int] = {}
+    for digest in digests:
+        counts[digest] = counts.get(digest, 0) + 1
+    if not counts:
+        return []
+    blobs = Blob.__table__
+    db.execute(
+        update(blobs).where(blobs.c.digest == bindparam("b_digest"))
+                     .values(refcount=blobs.c.refcount - bindparam("b_count")),
+        [{"b_digest": digest, "b_count": count} for digest, count in counts.items()]
+    )
+    released = [digest for (digest,) in db.query(Blob.digest)
+                .filter(Blob.digest.in_(list(counts)), Blob.refcount <= 0)]
+    if released:
+        db.query(Blob).filter(Blob.digest.in_(released))\
+          .update({Blob.released_at: datetime.utcnow()}, synchronize_session=False)
+    return released
+
+def bulk_update_receipts(db: Session, updates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Applies per-receipt field changes (dicts with "id" plus the fields of a
+    single update) in one transaction: one SELECT of the targeted rows, one
+    bulk UPDATE, and the same derived columns, vendor learning, anomaly
+    scores and aggregates as update_receipt. Later entries for the same id
+    win. Returns [{"id", "status"}] in request order, status being
+    "updated", "unchanged" or "not_found".
+    """
+    merged: Dict[int, Dict[str, Any]] = {}
+    for update_data in updates:
+        fields = {key: value for key, value in update_data.items() if key != "id"}
+        merged.setdefault(update_data["id"], {}).update(fields)
+    if not merged:
+        return []
+
+    # Just the editable and derived-from columns (not the OCR text)
+    columns = {"id", "filename", "content_type", "saved_path", "vendor", "currency", "category", "created_at",
+               *AGGREGATE_COLUMNS} | {key for fields in merged.values() for key in fields}
+    rows = {row.id: row for row in db.query(*[getattr(Receipt, name) for name in sorted(columns)])
+            .filter(Receipt.id.in_(list(merged)))}
+    statuses: Dict[int, str] = {}
+    changes, vendor_corrections = [], []
+    for receipt_id, fields in merged.items():
+        row = rows.get(receipt_id)
+        if row is None:
+            statuses[receipt_id] = "not_found"
+            continue
+        values = {name: getattr(row, name) for name in
+                  ("vendor", "transaction_date", "amount", "currency", "category", "created_at")}
+        change = {}
+        for key, value in fields.items():
+            if key == "transaction_date" and isinstance(value, str):
+                value = parse_date(value, row.vendor)
+                if value is None:
+                    continue  # unparseable, left as it was (as in update_receipt)
+            if getattr(row, key) != value:
+                change[key] = value
+                values[key] = value
+        if not change:
+            statuses[receipt_id] = "unchanged"
+            continue
+        if "transaction_date" in change:
+            change["year_month"] = year_month_of(values["transaction_date"])
+        if {"amount", "currency", "transaction_date"} & change.keys():
+            change.update(base_currency_columns(values["amount"], values["currency"],
+                                                values["transaction_date"] or values["created_at"]))
+        if "vendor" in change:
+            change["vendor_id"] = resolve_vendor(db, change["vendor"])
+            vendor_corrections.append((receipt_id, row.vendor, row.vendor_id, change))
+        before = receipt_snapshot(row)
+        after = {name: change.get(name, before[name]) for name in AGGREGATE_COLUMNS}
+        if any(before[name] != after[name] for name in ("vendor_id", "category", "base_amount")):
+            change["anomaly_score"], change["anomaly_detail"] = score_receipt(db, after, exclude=before)
+        change["id"] = receipt_id
+        changes.append(change)
+        statuses[receipt_id] = "updated"
+
+    if changes:
+        maintain_aggregates_for_changes(db, changes)
+        db.bulk_update_mappings(Receipt, changes)
+        # After the UPDATE, so the alias check sees which receipts still carry each old spelling
+        for receipt_id, old_name, old_vendor_id, change in vendor_corrections:
+            corrected = Receipt(id=receipt_id, vendor=change["vendor"], vendor_id=change["vendor_id"])
+            learn_vendor_correction(db, corrected, old_name, old_vendor_id)
+    db.commit()
+    return [{"id": receipt_id, "status": statuses[receipt_id]} for receipt_id in merged]
+
+def bulk_delete_receipts(db: Session, receipt_ids: List[int]) -> Tuple[List[Dict[str, Any]], List[str], List[str]]:
+    """
+    Deletes receipts in one transaction with set-based statements (rows,
+    line items, aggregates and blob references). Files are not touched;
+    the caller removes them after the commit. Returns (results, digests,
+    paths): [{"id", "status", "file"}] in request order, the blobs that
+    lost their last reference, and the saved_path of deleted receipts
+    stored before content addressing that no remaining receipt uses.
+    """
+    ids = list(dict.fromkeys(receipt_ids))
+    if not ids:
+        return [], [], []
+    rows = db.query(Receipt.id, Receipt.content_hash, Receipt.saved_path,
+                    *[getattr(Receipt, name) for name in AGGREGATE_COLUMNS])\
+             .filter(Receipt.id.in_(ids)).all()
+    found = {row.id: row for row in rows}
+    if rows:
+        maintain_aggregates(db, [(receipt_snapshot(row), None) for row in rows])
+        delete_receipt_items(db, list(found))
+        db.query(Receipt).filter(Receipt.id.in_(list(found))).delete(synchronize_session=False)
+    released = set(release_blobs(db, [row.content_hash for row in rows if row.content_hash]))
+
+    legacy_paths = {row.saved_path for row in rows if not row.content_hash and row.saved_path}
+    if legacy_paths:
+        still_used = {path for (path,) in db.query(Receipt.saved_path)
+                      .filter(Receipt.saved_path.in_(list(legacy_paths))).distinct()}
+        legacy_paths -= still_used
+    db.commit()
+
+    results = []
+    for receipt_id in ids:
+        row = found.get(receipt_id)
+        if row is None:
+            results.append({"id": receipt_id, "status": "not_found", "file": None})
+        elif row.content_hash in released or (not row.content_hash and row.saved_path in legacy_paths):
+            results.append({"id": receipt_id, "status": "deleted", "file": "removal_scheduled"})
+        else:
+            results.append({"id": receipt_id, "status": "deleted", "file": "kept_shared"})
+    return results, sorted(released), sorted(legacy_paths)
+
 # --- Algorithmic Logic Additions ---
 
 def search_receipts(
@@ -103,6 +1312,8 @@ def search_receipts(
     start_date: Optional[DateType] = None,
     end_date: Optional[DateType] = None,
     vendor_pattern: Optional[str] = None, # For regex/wildcard search on vendor
+    min_anomaly_score: Optional[float] = None,
+    anomalous_only: bool = False,
     skip: int = 0,
     limit: int = 100
 ) -> List[Receipt]:
@@ -111,6 +1322,7 @@ def search_receipts(
     - Keyword search across filename, vendor, category.
     - Range-based queries for amount and date.
     - Pattern matching (regex) on vendor names.
+    - Unusual amounts (anomaly score), most unusual first.
     """
     query = db.query(Receipt)
 
@@ -143,6 +1355,11 @@ def search_receipts(
         # For simplicity and broad compatibility, let's assume `vendor_pattern` uses SQL LIKE wildcards (%)
         query = query.filter(func.lower(Receipt.vendor).like(f"%{vendor_pattern.lower()}%"))
 
+    if anomalous_only:
+        min_anomaly_score = max(min_anomaly_score or 0.0, ANOMALY_SCORE_THRESHOLD)
+    if min_anomaly_score is not None:
+        query = query.filter(Receipt.anomaly_score >= min_anomaly_score).order_by(Receipt.anomaly_score.desc())
+
     return query.offset(skip).limit(limit).all()
 
 
@@ -179,16 +1396,102 @@ def sort_receipts(
 
     return query.offset(skip).limit(limit).all()
 
+# Columns the receipt grid can be ordered by; ties (and whole pages of them) are broken by id
+PAGE_SORT_COLUMNS = {
+    "id": Receipt.id,
+    "date": Receipt.transaction_date,
+    "amount": Receipt.amount,
+    "vendor": Receipt.vendor,
+}
+
+def _encode_page_cursor(sort_by: str, receipt: Receipt) -> str:
+    value = getattr(receipt, PAGE_SORT_COLUMNS[sort_by].key)
+    if isinstance(value, DateType):
+        value = value.isoformat()
+    return base64.urlsafe_b64encode(json.dumps([value, receipt.id]).encode("utf-8")).decode("ascii")
+
+def _decode_page_cursor(sort_by: str, cursor: str) -> Tuple[Any, int]:
+    try:
+        value, last_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        if value is not None and sort_by == "date":
+            value = DateType.fromisoformat(value)
+        return value, int(last_id)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid page cursor")
+
+def get_receipt_page(
+    db: Session,
+    sort_by: str = "id",
+    sort_order: str = "desc",
+    cursor: Optional[str] = None,
+    limit: int = 50
+) -> Tuple[List[Receipt], Optional[str]]:
+    """
+    One page of receipts in (sort column, id) order, and the cursor of the
+    next page (None on the last one). Pages are read by keyset, so page
+    10,000 costs the same index seek as page 1. Receipts without a value in
+    the sort column come after all the others in either direction, ordered
+    by id. Raises ValueError for an unknown sort or a malformed cursor.
+    """
+    if sort_by not in PAGE_SORT_COLUMNS:
+        raise ValueError(f"sort_by must be one of {sorted(PAGE_SORT_COLUMNS)}")
+    if sort_order not in ("asc", "desc"):
+        raise ValueError("sort_order must be 'asc' or 'desc'")
+    column = PAGE_SORT_COLUMNS[sort_by]
+    descending = sort_order == "desc"
+    order = desc if descending else asc
+
+    value, last_id = _decode_page_cursor(sort_by, cursor) if cursor else (None, None)
+    rows: List[Receipt] = []
+    # Rows with a value first; a cursor whose value is None is already past them
+    if cursor is None or value is not None:
+        query = db.query(Receipt)
+        if sort_by != "id":
+            query = query.filter(column.isnot(None))
+        if cursor is not None:
+            beyond = (column < value) if descending else (column > value)
+            tie = (Receipt.id < last_id) if descending else (Receipt.id > last_id)
+            query = query.filter(beyond | ((column == value) & tie)) if sort_by != "id" else query.filter(tie)
+        order_by = [order(column)] if sort_by == "id" else [order(column), order(Receipt.id)]
+        rows = query.order_by(*order_by).limit(limit + 1).all()
+    if sort_by != "id" and len(rows) <= limit:
+        query = db.query(Receipt).filter(column.is_(None))
+        if cursor is not None and value is None:
+            query = query.filter((Receipt.id < last_id) if descending else (Receipt.id > last_id))
+        rows += query.order_by(order(Receipt.id)).limit(limit + 1 - len(rows)).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return rows, (_encode_page_cursor(sort_by, rows[-1]) if has_more else None)
+
+def get_receipt_summary(db: Session) -> Dict[str, Any]:
+    """
+    Receipt count, transaction date bounds and highest id: what a client
+    needs to size a paged grid, bound its date pickers and notice new
+    uploads, without fetching any receipts. Every part is an index lookup
+    except the count.
+    """
+    # Separate statements: a lone MIN() / MAX() is answered from the index edge
+    return {
+        "count": db.query(func.count()).select_from(Receipt).scalar(),
+        "max_id": db.query(func.max(Receipt.id)).scalar(),
+        "min_date": db.query(func.min(Receipt.transaction_date)).scalar(),
+        "max_date": db.query(func.max(Receipt.transaction_date)).scalar(),
+    }
+
 # --- Aggregation Functions ---
 
 def get_total_spend(db: Session) -> float:
-    """Computes the total sum of all receipt amounts."""
-    total = db.query(func.sum(Receipt.amount)).scalar()
+    """Computes the total sum of all receipt amounts, in the base currency."""
+    total = db.query(func.sum(Receipt.base_amount)).scalar()
     return total if total is not None else 0.0
 
 def get_spend_statistics(db: Session) -> Dict[str, Optional[float]]:
-    """Computes mean, median, and mode of expenditure."""
-    amounts = [r.amount for r in db.query(Receipt.amount).filter(Receipt.amount.isnot(None)).all()]
+    """
+    Computes mean, median, and mode of expenditure, in the base currency.
+    Receipts that couldn't be converted are left out.
+    """
+    amounts = [r.base_amount for r in db.query(Receipt.base_amount).filter(Receipt.base_amount.isnot(None)).all()]
     if not amounts:
         return {"mean": None, "median": None, "mode": None}
 
@@ -217,46 +1520,454 @@ def get_spend_statistics(db: Session) -> Dict[str, Optional[float]]:
 
 
 def get_vendor_frequency(db: Session) -> Dict[str, int]:
-    """Computes the frequency distribution of vendors."""
-    vendor_counts = db.query(Receipt.vendor, func.count(Receipt.id))\
-                      .filter(Receipt.vendor.isnot(None))\
-                      .group_by(Receipt.vendor)\
+    """
+    Computes the frequency distribution of vendors, grouped on the canonical
+    vendor id so every spelling of a vendor counts towards one entry.
+    """
+    vendor_counts = db.query(Receipt.vendor_id, func.count(Receipt.id))\
+                      .filter(Receipt.vendor_id.isnot(None))\
+                      .group_by(Receipt.vendor_id)\
                       .order_by(func.count(Receipt.id).desc())\
                       .all()
-    return {vendor: count for vendor, count in vendor_counts}
+    names = vendor_names(db, [vendor_id for vendor_id, _ in vendor_counts])
+    return {names[vendor_id]: count for vendor_id, count in vendor_counts if vendor_id in names}
 
 def get_monthly_spend_trend(db: Session) -> List[Dict[str, Any]]:
     """
-    Computes monthly spend trend.
+    Computes monthly spend trend, in the base currency.
     Returns a list of dictionaries with 'month_year' and 'total_spend'.
     """
-    # SQLite often stores dates as strings in YYYY-MM-DD format.
-    # We need to extract year and month from the string date.
-    # For SQLite, use strftime. For other DBs, use appropriate func like EXTRACT.
-    # Ensure transaction_date is not null before grouping.
-    monthly_data = db.query(
-        func.strftime('%Y-%m', Receipt.transaction_date).label('month_year'),
-        func.sum(Receipt.amount).label('total_spend')
-    )\
-    .filter(Receipt.transaction_date.isnot(None), Receipt.amount.isnot(None))\
-    .group_by('month_year')\
-    .order_by('month_year')\
-    .all()
+    # Grouped on the stored integer bucket, so the (year_month, base_amount)
+    # index answers it alone and no per-row date function is needed on any database.
+    monthly_data = _spend_by_year_month(db)
+    return [{"month_year": format_year_month(ym), "total_spend": total} for ym, total in monthly_data]
 
-    # Convert row objects to dictionaries
-    return [{"month_year": row.month_year, "total_spend": row.total_spend} for row in monthly_data]
+def get_yearly_spend_trend(db: Session) -> List[Dict[str, Any]]:
+    """
+    Computes yearly spend trend, in the base currency.
+    Returns a list of dictionaries with 'year' and 'total_spend'.
+    """
+    # Rolled up from the (at most 12 per year) monthly groups rather than
+    # integer division in SQL, whose semantics differ between databases.
+    yearly: Dict[int, float] = {}
+    for ym, total in _spend_by_year_month(db):
+        yearly[ym // 100] = yearly.get(ym // 100, 0.0) + total
+    return [{"year": year, "total_spend": total} for year, total in yearly.items()]
+
+def _spend_by_year_month(db: Session) -> List[Tuple[int, float]]:
+    return db.query(Receipt.year_month, func.sum(Receipt.base_amount))\
+             .filter(Receipt.year_month.isnot(None), Receipt.base_amount.isnot(None))\
+             .group_by(Receipt.year_month)\
+             .order_by(Receipt.year_month)\
+             .all()
 
 def get_spend_by_category(db: Session) -> List[Dict[str, Any]]:
     """
-    Computes total spend per category.
+    Computes total spend per category, in the base currency.
     """
     category_spend = db.query(
         Receipt.category,
-        func.sum(Receipt.amount).label('total_spend')
+        func.sum(Receipt.base_amount).label('total_spend')
     )\
-    .filter(Receipt.category.isnot(None), Receipt.amount.isnot(None))\
+    .filter(Receipt.category.isnot(None), Receipt.base_amount.isnot(None))\
     .group_by(Receipt.category)\
-    .order_by(func.sum(Receipt.amount).desc())\
+    .order_by(func.sum(Receipt.base_amount).desc())\
     .all()
 
-    return [{"category": row.category, "total_spend": row.total_spend} for row in category_spend]
\ No newline at end of file
+    return [{"category": row.category, "total_spend": row.total_spend} for row in category_spend]
+
+# --- Bulk maintenance ---
+
+def recategorize_receipts(db: Session,
+                          categorizer: Categorizer,
+                          only_uncategorized: bool = False,
+                          batch_size: int = 1000) -> Dict[str, int]:
+    """
+    Re-applies the category rules to stored receipts.
+    Walks the table in primary-key order one batch at a time (keyset
+    pagination, so memory stays flat) and writes changed categories back
+    with one bulk UPDATE per batch.
+    """
+    scanned, updated = 0, 0
+    last_id = 0
+    while True:
+        query = db.query(Receipt.id, Receipt.vendor, Receipt.ocr_text, Receipt.category)\
+                  .filter(Receipt.id > last_id)
+        if only_uncategorized:
+            query = query.filter(Receipt.category.is_(None))
+        rows = query.order_by(Receipt.id).limit(batch_size).all()
+        if not rows:
+            break
+        changes = []
+        for row in rows:
+            category = categorizer.categorize(row.vendor, row.ocr_text)
+            if category is not None and category != row.category:
+                changes.append({"id": row.id, "category": category})
+        if changes:
+            maintain_aggregates_for_changes(db, changes)
+            db.bulk_update_mappings(Receipt, changes)
+            db.commit()
+        scanned += len(rows)
+        updated += len(changes)
+        last_id = rows[-1].id
+    return {"scanned": scanned, "updated": updated}
+
+# --- Reprocessing jobs ---
+
+def create_reprocess_job(db: Session, workers: int = 1, batch_size: int = 500, rerun_ocr: bool = False) -> ReprocessJob:
+    """
+    Creates a reprocessing job over every receipt that exists right now,
+    split into `workers` contiguous id ranges (one shard per worker).
+    """
+    min_id, max_id, total = db.query(func.min(Receipt.id), func.max(Receipt.id), func.count(Receipt.id)).one()
+    job = ReprocessJob(
+        status="pending",
+        rerun_ocr=rerun_ocr,
+        workers=workers,
+        batch_size=batch_size,
+        max_receipt_id=max_id or 0,
+        total=total or 0
+    )
+    db.add(job)
+    db.flush()
+
+    low, high = (min_id or 1), (max_id or 0) + 1
+    width = max(1, -(-(high - low) // workers))  # ceil division
+    for shard in range(workers):
+        start_id = low + shard * width
+        db.add(ReprocessShard(
+            job_id=job.id,
+            shard=shard,
+            start_id=start_id,
+            end_id=min(high, start_id + width),
+            last_receipt_id=start_id - 1
+        ))
+    db.commit()
+    db.refresh(job)
+    return job
+
+def get_reprocess_job(db: Session, job_id: int) -> Optional[ReprocessJob]:
+    return db.query(ReprocessJob).filter(ReprocessJob.id == job_id).first()
+
+def get_reprocess_shard(db: Session, job_id: int, shard: int) -> Optional[ReprocessShard]:
+    return db.query(ReprocessShard).filter(ReprocessShard.job_id == job_id, ReprocessShard.shard == shard).first()
+
+def get_reprocess_progress(db: Session, job: ReprocessJob) -> Dict[str, Any]:
+    """Summarises a job and its shards for the progress endpoint."""
+    shards = db.query(ReprocessShard).filter(ReprocessShard.job_id == job.id)\
+               .order_by(ReprocessShard.shard).all()
+    processed = sum(s.processed for s in shards)
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "rerun_ocr": job.rerun_ocr,
+        "total": job.total,
+        "processed": processed,
+        "updated": sum(s.updated for s in shards),
+        "skipped": sum(s.skipped for s in shards),
+        "failed": sum(s.failed for s in shards),
+        "percent": round(100.0 * processed / job.total, 1) if job.total else 100.0,
+        "error": job.error,
+        "shards": [
+            {"shard": s.shard, "status": s.status, "start_id": s.start_id, "end_id": s.end_id,
+             "last_receipt_id": s.last_receipt_id, "processed": s.processed}
+            for s in shards
+        ],
+    }
+
+def get_reprocess_batch(db: Session, shard: ReprocessShard, batch_size: int) -> List[Receipt]:
+    """Next batch of receipts after the shard's checkpoint (keyset pagination on id)."""
+    return db.query(Receipt)\
+             .filter(Receipt.id > shard.last_receipt_id, Receipt.id < shard.end_id)\
+             .order_by(Receipt.id)\
+             .limit(batch_size)\
+             .all()
+
+def commit_reprocess_batch(db: Session,
+                           shard: ReprocessShard,
+                           changes: List[Dict[str, Any]],
+                           last_receipt_id: int,
+                           processed: int,
+                           skipped: int,
+                           failed: int,
+                           items_by_receipt: Optional[Dict[int, List[Dict[str, Any]]]] = None) -> None:
+    """
+    Writes one batch of re-derived fields with a single bulk UPDATE (and
+    re-extracted line items with one executemany per table) and moves
+    the shard checkpoint forward in the same transaction, so a crash never
+    loses or double-counts a batch.
+    """
+    if changes:
+        _resolve_vendor_changes(db, changes)
+        maintain_aggregates_for_changes(db, changes)
+        db.bulk_update_mappings(Receipt, changes)
+    if items_by_receipt:
+        delete_receipt_items(db, list(items_by_receipt))
+        insert_receipt_items(db, items_by_receipt)
+    shard.last_receipt_id = last_receipt_id
+    shard.processed += processed
+    shard.updated += len(changes)
+    shard.skipped += skipped
+    shard.failed += failed
+    db.commit()
+
+def backfill_year_months(db: Session, batch_size: int = 1000) -> int:
+    """
+    Fills year_month for receipts that have a transaction date but no bucket
+    (rows from before the column existed). Returns the number of rows filled.
+    """
+    filled = 0
+    last_id = 0
+    while True:
+        rows = db.query(Receipt.id, Receipt.transaction_date)\
+                 .filter(Receipt.id > last_id, Receipt.year_month.is_(None), Receipt.transaction_date.isnot(None))\
+                 .order_by(Receipt.id).limit(batch_size).all()
+        if not rows:
+            break
+        db.bulk_update_mappings(Receipt, [
+            {"id": row.id, "year_month": year_month_of(row.transaction_date)} for row in rows
+        ])
+        db.commit()
+        filled += len(rows)
+        last_id = rows[-1].id
+    return filled
+
+def backfill_base_amounts(db: Session, only_missing: bool = True, batch_size: int = 1000) -> Dict[str, int]:
+    """
+    Computes currency_code / fx_rate / base_amount for stored receipts, e.g.
+    after upgrading or after the FX rate table changes (only_missing=False).
+    Keyset-paginated with one bulk UPDATE per batch.
+    """
+    scanned, updated = 0, 0
+    last_id = 0
+    while True:
+        query = db.query(Receipt.id, Receipt.amount, Receipt.currency, Receipt.transaction_date,
+                         Receipt.created_at, Receipt.currency_code, Receipt.fx_rate, Receipt.base_amount)\
+                  .filter(Receipt.id > last_id)
+        if only_missing:
+            query = query.filter(Receipt.currency_code.is_(None))
+        rows = query.order_by(Receipt.id).limit(batch_size).all()
+        if not rows:
+            break
+        changes = []
+        for row in rows:
+            columns = base_currency_columns(row.amount, row.currency, row.transaction_date or row.created_at)
+            if (columns["currency_code"], columns["fx_rate"], columns["base_amount"]) != \
+                    (row.currency_code, row.fx_rate, row.base_amount):
+                changes.append({"id": row.id, **columns})
+        if changes:
+            maintain_aggregates_for_changes(db, changes)
+            db.bulk_update_mappings(Receipt, changes)
+            db.commit()
+        scanned += len(rows)
+        updated += len(changes)
+        last_id = rows[-1].id
+    return {"scanned": scanned, "updated": updated}
+
+# --- OCR job queue (see backend/core/jobs.py) ---
+
+def enqueue_ocr_job(db: Session,
+                    filename: str,
+                    content_type: str,
+                    saved_path: str,
+                    content_hash: str,
+                    blob_size: int,
+                    source: Optional[str] = None,
+                    reuse_duplicate_ocr: bool = False,
+                    max_attempts: int = 5,
+                    request_id: Optional[str] = None) -> OcrJob:
+    """
+    Queues a stored upload for OCR. The job takes a reference on the blob in
+    the same transaction, so the file can't be removed while it waits.
+    """
+    job = OcrJob(
+        status="queued",
+        filename=filename,
+        content_type=content_type,
+        saved_path=saved_path,
+        content_hash=content_hash,
+        blob_size=blob_size,
+        source=source,
+        reuse_duplicate_ocr=reuse_duplicate_ocr,
+        max_attempts=max_attempts,
+        request_id=request_id,
+        available_at=datetime.utcnow()
+    )
+    acquire_blob(db, content_hash, saved_path, blob_size)
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job
+
+def get_ocr_job(db: Session, job_id: int) -> Optional[OcrJob]:
+    return db.query(OcrJob).filter(OcrJob.id == job_id).first()
+
+def claim_ocr_job(db: Session, worker_id: str, lease_seconds: float, candidates: int = 8) -> Optional[OcrJob]:
+    """
+    Leases the next runnable job to `worker_id`: a queued job whose backoff
+    has elapsed, or a leased one whose lease expired (its worker died).
+    Each candidate is claimed with a conditional UPDATE, so concurrent
+    workers never get the same job; losing a race just tries the next one.
+    """
+    now = datetime.utcnow()
+    runnable = or_(
+        (OcrJob.status == "queued") & (OcrJob.available_at <= now),
+        # Expired on its last attempt: left for dead_letter_exhausted_jobs
+        (OcrJob.status == "leased") & (OcrJob.lease_expires_at < now) & (OcrJob.attempts < OcrJob.max_attempts),
+    )
+    ids = [row.id for row in db.query(OcrJob.id).filter(runnable)
+                                .order_by(OcrJob.available_at, OcrJob.id).limit(candidates)]
+    for job_id in ids:
+        claimed = db.query(OcrJob).filter(OcrJob.id == job_id, runnable).update({
+            OcrJob.status: "leased",
+            OcrJob.lease_owner: worker_id,
+            OcrJob.lease_expires_at: now + timedelta(seconds=lease_seconds),
+            OcrJob.heartbeat_at: now,
+            OcrJob.attempts: OcrJob.attempts + 1,
+        }, synchronize_session=False)
+        db.commit()
+        if claimed:
+            return get_ocr_job(db, job_id)
+    return None
+
+def heartbeat_ocr_job(db: Session, job_id: int, worker_id: str, lease_seconds: float) -> bool:
+    """Extends a lease. Returns False if the worker no longer holds it."""
+    now = datetime.utcnow()
+    renewed = db.query(OcrJob).filter(
+        OcrJob.id == job_id, OcrJob.status == "leased", OcrJob.lease_owner == worker_id
+    ).update({
+        OcrJob.lease_expires_at: now + timedelta(seconds=lease_seconds),
+        OcrJob.heartbeat_at: now,
+    }, synchronize_session=False)
+    db.commit()
+    return bool(renewed)
+
+def complete_ocr_job(db: Session,
+                     job: OcrJob,
+                     worker_id: str,
+                     parsed_data: Dict[str, Any],
+                     ocr_text: Optional[str] = None,
+                     phash: Optional[int] = None) -> Optional[Receipt]:
+    """
+    Creates the receipt for a finished job and marks the job succeeded in
+    the same transaction, handing the job's blob reference to the receipt.
+    Returns None (writing nothing) if the lease was lost to another worker.
+    """
+    finished = db.query(OcrJob).filter(
+        OcrJob.id == job.id, OcrJob.status == "leased", OcrJob.lease_owner == worker_id
+    ).update({
+        OcrJob.status: "succeeded",
+        OcrJob.lease_expires_at: None,
+        OcrJob.finished_at: datetime.utcnow(),
+        OcrJob.last_error: None,
+    }, synchronize_session=False)
+    if not finished:
+        db.rollback()
+        return None
+    # The job's reference becomes the receipt's: never dropped, so the blob can't be released meanwhile
+    db_receipt = create_receipt(
+        db=db,
+        filename=job.filename,
+        content_type=job.content_type,
+        saved_path=job.saved_path,
+        parsed_data=parsed_data,
+        ocr_text=ocr_text,
+        phash=phash,
+        content_hash=job.content_hash,
+        blob_size=job.blob_size,
+        blob_acquired=True
+    )
+    # Committed separately: a crash here leaves a succeeded job without its receipt id, never a lost receipt
+    db.query(OcrJob).filter(OcrJob.id == job.id).update({OcrJob.receipt_id: db_receipt.id}, synchronize_session=False)
+    db.commit()
+    return db_receipt
+
+def fail_ocr_job(db: Session, job: OcrJob, worker_id: str, error: str, retry_delay: float) -> Optional[str]:
+    """
+    Records a failed attempt: the job is re-queued after `retry_delay`
+    seconds, or dead-lettered once it has used all its attempts (releasing
+    its blob reference). Returns the new status, or None if the lease was lost.
+    """
+    dead = job.attempts >= job.max_attempts
+    failed = db.query(OcrJob).filter(
+        OcrJob.id == job.id, OcrJob.status == "leased", OcrJob.lease_owner == worker_id
+    ).update({
+        OcrJob.status: "dead" if dead else "queued",
+        OcrJob.available_at: datetime.utcnow() + timedelta(seconds=retry_delay),
+        OcrJob.lease_owner: None,
+        OcrJob.lease_expires_at: None,
+        OcrJob.last_error: error[:4000],
+        OcrJob.finished_at: datetime.utcnow() if dead else None,
+    }, synchronize_session=False)
+    if not failed:
+        db.rollback()
+        return None
+    if dead:
+        release_blob(db, job.content_hash)
+    db.commit()
+    return "dead" if dead else "queued"
+
+def dead_letter_exhausted_jobs(db: Session) -> List[OcrJob]:
+    """
+    Dead-letters jobs whose lease expired on their last attempt (the worker
+    crashed every time), releasing their blob references. Returns them so
+    the caller can remove blobs that are no longer referenced.
+    """
+    now = datetime.utcnow()
+    jobs = db.query(OcrJob).filter(
+        OcrJob.status == "leased", OcrJob.lease_expires_at < now, OcrJob.attempts >= OcrJob.max_attempts
+    ).all()
+    for job in jobs:
+        job.status = "dead"
+        job.lease_owner = None
+        job.lease_expires_at = None
+        job.finished_at = now
+        job.last_error = job.last_error or "Lease expired on the final attempt (worker crashed or hung)"
+        release_blob(db, job.content_hash)
+    db.commit()
+    return jobs
+
+def retry_ocr_job(db: Session, job: OcrJob) -> OcrJob:
+    """Moves a dead-lettered job back to the queue with a fresh set of attempts."""
+    acquire_blob(db, job.content_hash, job.saved_path, job.blob_size)
+    job.status = "queued"
+    job.attempts = 0
+    job.available_at = datetime.utcnow()
+    job.finished_at = None
+    db.commit()
+    db.refresh(job)
+    return job
+
+def get_ocr_queue_stats(db: Session) -> Dict[str, Any]:
+    """Job counts per status and the age of the oldest runnable job."""
+    counts = dict(db.query(OcrJob.status, func.count(OcrJob.id)).group_by(OcrJob.status).all())
+    oldest = db.query(func.min(OcrJob.created_at)).filter(OcrJob.status.in_(["queued", "leased"])).scalar()
+    return {
+        "queued": counts.get("queued", 0),
+        "leased": counts.get("leased", 0),
+        "succeeded": counts.get("succeeded", 0),
+        "dead": counts.get("dead", 0),
+        "oldest_pending_seconds": round((datetime.utcnow() - oldest).total_seconds(), 1) if oldest else None,
+    }
+
+def start_storage_gc_run(db: Session, delete_orphans: bool = False) -> StorageGcRun:
+    """
+    Returns the unfinished orphan collection, if an earlier one was
+    interrupted or failed, so it resumes from its checkpoints; otherwise
+    starts a new one.
+    """
+    run = db.query(StorageGcRun).filter(StorageGcRun.status != "completed")\
+            .order_by(StorageGcRun.id.desc()).first()
+    if run:
+        run.status = "running"
+        run.delete_orphans = delete_orphans
+        run.error = None
+    else:
+        run = StorageGcRun(delete_orphans=delete_orphans)
+        db.add(run)
+    db.commit()
+    db.refresh(run)
+    return run
+
+def get_storage_gc_run(db: Session, run_id: int) -> Optional[StorageGcRun]:
+    return db.query(StorageGcRun).filter(StorageGcRun.id == run_id).first()
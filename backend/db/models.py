@@ -1,5 +1,5 @@
 # backend/db/models.py
-from sqlalchemy import Column, Integer, String, Float, Date
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, Boolean, Text, LargeBinary, ForeignKey, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql import func # Import func for default date if needed
 import datetime # Import datetime module
@@ -8,19 +8,53 @@ Base = declarative_base()
 
 class Receipt(Base):
     __tablename__ = "receipts"
+    __table_args__ = (
+        # Covers spend-by-category without touching the table rows
+        Index("ix_receipts_category_base_amount", "category", "base_amount"),
+        # Monthly / yearly trends are index-only GROUP BYs over this
+        Index("ix_receipts_year_month_base_amount", "year_month", "base_amount"),
+        # Keyset pages of the receipt grid for each sortable column (crud.get_receipt_page)
+        Index("ix_receipts_page_date", "transaction_date", "id"),
+        Index("ix_receipts_page_amount", "amount", "id"),
+        Index("ix_receipts_page_vendor", "vendor", "id"),
+    )
     id = Column(Integer, primary_key=True, autoincrement=True)
     filename = Column(String, nullable=False)
     content_type = Column(String, nullable=False) # Added to store original file type
     saved_path = Column(String, nullable=False)
     vendor = Column(String)
+    # Canonical vendor the OCR'd name was matched to (backend/core/vendors.py); analytics group on this
+    vendor_id = Column(Integer, ForeignKey("vendors.id"), index=True)
     # Use Date type for date fields for proper database handling
     # Consider storing as String if parsing is inconsistent or if you prefer to handle date parsing/validation in application logic
     transaction_date = Column(Date)
+    # year * 100 + month of transaction_date (e.g. 202406), kept in sync on every write
+    year_month = Column(Integer)
     amount = Column(Float)
     category = Column(String)
     currency = Column(String)
+    # Normalised at ingest (backend/core/fx.py) so aggregates are plain SUMs over base_amount
+    currency_code = Column(String, index=True)
+    fx_rate = Column(Float)
+    base_amount = Column(Float, index=True)
+    # Tesseract model the text was read with (e.g. "eng", "rus"); see backend/core/language.py
+    language = Column(String)
+    # How unusual the amount is for the vendor / category at write time (|z| on log amounts)
+    anomaly_score = Column(Float, index=True)
+    anomaly_detail = Column(String)
     # Add a timestamp for when the record was created
     created_at = Column(Date, default=datetime.date.today) # Or use DateTime and func.now() for current timestamp
+    # sha256 of the stored blob (see backend/core/storage.py); None for legacy flat uploads
+    content_hash = Column(String, index=True)
+    # Raw OCR/text output, kept so duplicates can reuse it instead of re-running OCR
+    ocr_text = Column(Text)
+    # 64-bit perceptual hash (dHash) of the image / first PDF page, stored signed.
+    # The four 16-bit bands are indexed separately for multi-index hamming lookups.
+    phash = Column(Integer)
+    phash_b0 = Column(Integer, index=True)
+    phash_b1 = Column(Integer, index=True)
+    phash_b2 = Column(Integer, index=True)
+    phash_b3 = Column(Integer, index=True)
 
 
     def __repr__(self):
@@ -38,5 +72,290 @@ class Receipt(Base):
             "amount": self.amount,
             "category": self.category,
             "currency": self.currency,
+            "language": self.language,
             "created_at": self.created_at.isoformat() if self.created_at else None
-        }
\ No newline at end of file
+        }
+
+
+
+class Vendor(Base):
+    """
+    A canonical vendor. Receipts point at one through vendor_id, however
+    the vendor's name was spelled on the receipt; the spellings seen so far
+    are its aliases.
+    """
+    __tablename__ = "vendors"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String, nullable=False)  # display name: the first spelling seen, or a user correction
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    def __repr__(self):
+        return f"<Vendor(id={self.id}, name='{self.name}')>"
+
+
+class VendorAlias(Base):
+    """
+    A normalised vendor spelling (normalize_vendor) and the vendor it means.
+    source is "parsed" (first seen at ingest), "matched" (fuzzy-matched to
+    an existing vendor) or "user" (learned from a correction, never
+    overridden by matching). Rows are only appended, so other processes
+    pick up new and re-pointed aliases by reading ids above the last seen.
+    """
+    __tablename__ = "vendor_aliases"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    alias = Column(String, nullable=False, index=True)
+    vendor_id = Column(Integer, ForeignKey("vendors.id"), nullable=False, index=True)
+    source = Column(String, nullable=False, default="parsed")
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    def __repr__(self):
+        return f"<VendorAlias(alias='{self.alias}', vendor_id={self.vendor_id}, source='{self.source}')>"
+
+
+class DailySpend(Base):
+    """
+    Calendar rollup of receipts: one row per day, category, vendor and
+    currency, maintained on every receipt write (see crud). The coarser
+    bucket keys are stored too, so week / month / quarter / year series are
+    plain GROUP BYs over this table instead of scans of receipts.
+    Missing dimensions are stored as "" (0 for vendor_id) because they are
+    part of the key.
+    """
+    __tablename__ = "daily_spend"
+    __table_args__ = (
+        Index("ix_daily_spend_category_day", "category", "day"),
+        Index("ix_daily_spend_vendor_id_day", "vendor_id", "day"),
+    )
+    day = Column(Date, primary_key=True)
+    category = Column(String, primary_key=True, default="")
+    vendor_id = Column(Integer, primary_key=True, default=0)
+    currency_code = Column(String, primary_key=True, default="")
+    week_key = Column(Integer, nullable=False)
+    year_month = Column(Integer, nullable=False)
+    quarter_key = Column(Integer, nullable=False)
+    year = Column(Integer, nullable=False)
+    receipt_count = Column(Integer, nullable=False, default=0)
+    total_base = Column(Float, nullable=False, default=0.0)    # sum of base_amount
+    total_amount = Column(Float, nullable=False, default=0.0)  # sum of amount, in currency_code
+
+    def __repr__(self):
+        return f"<DailySpend(day={self.day}, category='{self.category}', vendor_id={self.vendor_id}, count={self.receipt_count})>"
+
+
+class AnalyticsSketch(Base):
+    """
+    A serialised streaming sketch (backend/core/sketches.py), brought up
+    to date by folding in the aggregate deltas of receipt writes and
+    rebuilt from the receipts table on demand. removed_count counts
+    deletions applied since the last rebuild.
+    """
+    __tablename__ = "analytics_sketches"
+    name = Column(String, primary_key=True)
+    data = Column(LargeBinary, nullable=False)
+    removed_count = Column(Integer, nullable=False, default=0)
+    rebuilt_at = Column(DateTime)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    def __repr__(self):
+        return f"<AnalyticsSketch(name='{self.name}', removed_count={self.removed_count})>"
+
+
+class AggregateDelta(Base):
+    """
+    One pending change to a serialised sketch, appended by a receipt write
+    and folded into the sketch later (crud.fold_aggregate_deltas), so
+    writers never lock or rewrite the shared sketch rows or the spend_stats
+    digests.
+    """
+    __tablename__ = "aggregate_deltas"
+    id = Column(Integer, primary_key=True)
+    target = Column(String, nullable=False)  # sketch name, or a spend_stats digest
+    dimension = Column(String)  # spend_stats row, for its digests
+    key = Column(String)    # vendor key for the vendor sketches, spend_stats key for its digests
+    value = Column(Float)   # amount, for the t-digests
+    count = Column(Integer, nullable=False, default=1)  # vendor count change (negative for removals)
+
+
+class SpendStats(Base):
+    """
+    Running amount statistics of one vendor or category: Welford count /
+    mean / M2 of log(base_amount), plus a small t-digest for percentiles
+    (removed_digest holds amounts of deleted receipts). count / mean / M2
+    are merged on every receipt write with one UPDATE; the digests follow
+    when aggregate deltas are folded. See backend/core/anomaly.py.
+    """
+    __tablename__ = "spend_stats"
+    dimension = Column(String, primary_key=True) # vendor, category
+    key = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    mean = Column(Float, nullable=False, default=0.0)
+    m2 = Column(Float, nullable=False, default=0.0)
+    digest = Column(LargeBinary)
+    removed_digest = Column(LargeBinary)
+
+    def __repr__(self):
+        return f"<SpendStats(dimension='{self.dimension}', key='{self.key}', count={self.count})>"
+
+
+class ReceiptItem(Base):
+    """
+    A purchased line item extracted by parse_receipt_text. Keyed by
+    (receipt_id, line_no) so a receipt's items are one contiguous index range.
+    """
+    __tablename__ = "receipt_items"
+    receipt_id = Column(Integer, ForeignKey("receipts.id"), primary_key=True)
+    line_no = Column(Integer, primary_key=True)
+    description = Column(String, nullable=False)
+    quantity = Column(Float)
+    unit_price = Column(Float)
+    total = Column(Float)
+
+    def __repr__(self):
+        return f"<ReceiptItem(receipt_id={self.receipt_id}, line_no={self.line_no}, description='{self.description}')>"
+
+
+class ReceiptItemTerm(Base):
+    """
+    Inverted index over item descriptions: one row per (word, item). Item
+    search looks words up through the primary key instead of scanning
+    descriptions with LIKE '%...%'.
+    """
+    __tablename__ = "receipt_item_terms"
+    __table_args__ = (
+        Index("ix_receipt_item_terms_receipt_id", "receipt_id"),
+    )
+    term = Column(String, primary_key=True)
+    receipt_id = Column(Integer, primary_key=True)
+    line_no = Column(Integer, primary_key=True)
+
+class Blob(Base):
+    """
+    One stored upload blob, shared by every receipt with identical content.
+    When its refcount drops to zero the blob is marked released, and its
+    file and row are removed afterwards (backend/core/cleanup.py).
+    """
+    __tablename__ = "blobs"
+    digest = Column(String, primary_key=True)
+    path = Column(String, nullable=False)
+    size = Column(Integer, nullable=False)
+    refcount = Column(Integer, nullable=False, default=0)
+    created_at = Column(Date, default=datetime.date.today)
+    # Set by the storage lifecycle (backend/core/lifecycle.py). The digest
+    # always names the uploaded content, even once the file is re-encoded.
+    recompressed_at = Column(DateTime)
+    stored_size = Column(Integer)  # bytes on disk after recompression
+    purged_at = Column(DateTime)   # file removed by the retention policy
+    released_at = Column(DateTime)  # last reference dropped, file awaiting removal
+
+    def __repr__(self):
+        return f"<Blob(digest='{self.digest}', refcount={self.refcount})>"
+
+
+class ReprocessJob(Base):
+    """
+    A bulk re-parse of stored receipts (see backend/core/reprocess.py).
+    Receipts up to max_receipt_id are split into id ranges, one shard per worker.
+    """
+    __tablename__ = "reprocess_jobs"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    status = Column(String, nullable=False, default="pending") # pending, running, completed, failed
+    rerun_ocr = Column(Boolean, nullable=False, default=False)
+    workers = Column(Integer, nullable=False, default=1)
+    batch_size = Column(Integer, nullable=False, default=500)
+    max_receipt_id = Column(Integer, nullable=False, default=0)
+    total = Column(Integer, nullable=False, default=0)
+    error = Column(Text)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    finished_at = Column(DateTime)
+
+    def __repr__(self):
+        return f"<ReprocessJob(id={self.id}, status='{self.status}')>"
+
+
+class ReprocessShard(Base):
+    """
+    One worker's slice of a ReprocessJob: receipts with start_id <= id < end_id.
+    last_receipt_id is the checkpoint, committed together with each batch.
+    """
+    __tablename__ = "reprocess_shards"
+    job_id = Column(Integer, ForeignKey("reprocess_jobs.id"), primary_key=True)
+    shard = Column(Integer, primary_key=True)
+    start_id = Column(Integer, nullable=False)
+    end_id = Column(Integer, nullable=False)
+    last_receipt_id = Column(Integer, nullable=False, default=0)
+    status = Column(String, nullable=False, default="pending") # pending, running, completed, failed
+    processed = Column(Integer, nullable=False, default=0)
+    updated = Column(Integer, nullable=False, default=0)
+    skipped = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<ReprocessShard(job_id={self.job_id}, shard={self.shard}, last_receipt_id={self.last_receipt_id})>"
+
+
+class OcrJob(Base):
+    """
+    A queued upload waiting for an OCR worker (see backend/core/jobs.py).
+    The stored blob holds one reference for the job until it finishes.
+    Workers claim a job by taking a lease; a lease that isn't renewed by
+    heartbeats expires and the job becomes claimable again.
+    """
+    __tablename__ = "ocr_jobs"
+    __table_args__ = (
+        # Claim query: next runnable job in order
+        Index("ix_ocr_jobs_status_available_at", "status", "available_at"),
+        Index("ix_ocr_jobs_status_lease_expires_at", "status", "lease_expires_at"),
+    )
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    status = Column(String, nullable=False, default="queued") # queued, leased, succeeded, dead
+    filename = Column(String, nullable=False)
+    content_type = Column(String, nullable=False)
+    saved_path = Column(String, nullable=False)
+    content_hash = Column(String, nullable=False)
+    blob_size = Column(Integer, nullable=False, default=0)
+    source = Column(String)
+    reuse_duplicate_ocr = Column(Boolean, nullable=False, default=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=5)
+    available_at = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
+    lease_owner = Column(String)
+    lease_expires_at = Column(DateTime)
+    heartbeat_at = Column(DateTime)
+    last_error = Column(Text)
+    receipt_id = Column(Integer)
+    # Correlation id of the request that queued the job; the worker logs under it too
+    request_id = Column(String)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    finished_at = Column(DateTime)
+
+    def __repr__(self):
+        return f"<OcrJob(id={self.id}, status='{self.status}', attempts={self.attempts})>"
+
+
+class StorageGcRun(Base):
+    """
+    One orphan collection over the upload storage (see backend/core/lifecycle.py).
+    It walks the files on disk, then the receipt rows; file_cursor and
+    receipt_cursor are the checkpoints, committed after every batch.
+    """
+    __tablename__ = "storage_gc_runs"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    status = Column(String, nullable=False, default="running") # running, completed, failed
+    phase = Column(String, nullable=False, default="files") # files, receipts
+    delete_orphans = Column(Boolean, nullable=False, default=False)
+    file_cursor = Column(String)  # last file checked, relative to the storage root
+    receipt_cursor = Column(Integer, nullable=False, default=0)
+    files_scanned = Column(Integer, nullable=False, default=0)
+    orphan_files = Column(Integer, nullable=False, default=0)
+    orphan_bytes = Column(Integer, nullable=False, default=0)
+    removed_files = Column(Integer, nullable=False, default=0)
+    receipts_scanned = Column(Integer, nullable=False, default=0)
+    missing_files = Column(Integer, nullable=False, default=0)
+    missing_receipt_ids = Column(Text)  # JSON list, the first few receipts whose file is gone
+    error = Column(Text)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+    finished_at = Column(DateTime)
+
+    def __repr__(self):
+        return f"<StorageGcRun(id={self.id}, status='{self.status}', phase='{self.phase}')>"
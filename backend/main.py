@@ -1,9 +1,31 @@
 # backend/main.py (Complete Code)
-from fastapi import FastAPI
+import logging
+import os
+import time
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from backend.api.upload import router as upload_router
+from starlette.concurrency import run_in_threadpool
+from backend.core.logs import configure_logging, new_request_id, request_id_var
+from backend.core.profiling import (
+    PROFILE_HEADER, PROFILING_ENABLED, StackSampler, get_request_profiler, new_profile_id, profile_path,
+)
 from backend.db.database import init_db
 
+# Structured, queue-backed logging for backend.* (see backend/core/logs.py)
+configure_logging()
+logger = logging.getLogger("backend.main")
+
+# Which parts of the service this replica runs:
+#   api        - reads, corrections and analytics only; never imports the OCR stack
+#   ocr-worker - ingestion (/api/upload) only; OCR libraries are loaded at startup
+#   all        - everything in one process (default, single-box setups)
+# Queued uploads (/api/ocr-jobs) are accepted by every role and OCR'd by
+# separate worker processes: python -m backend.scripts.ocr_worker
+APP_ROLE = os.getenv("APP_ROLE", "all")
+APP_ROLES = ("api", "ocr-worker", "all")
+if APP_ROLE not in APP_ROLES:
+    raise ValueError(f"APP_ROLE must be one of {APP_ROLES}, got '{APP_ROLE}'")
+
 app = FastAPI()
 
 # Configure CORS (Important: This should be one of the first things after app = FastAPI())
@@ -20,6 +42,56 @@ origins = [
     # "https://your-deployed-frontend.com",
 ]
 
+# Request profiling costs nothing unless enabled: the middleware and the
+# /debug routes aren't installed at all otherwise (see backend/core/profiling.py).
+# Registered before the correlation id middleware so it runs inside it.
+if PROFILING_ENABLED:
+    @app.middleware("http")
+    async def profiling_middleware(request: Request, call_next):
+        """
+        Samples the process's stacks while a request is handled, when it
+        sends X-Profile: 1 or the /debug/profile toggle is armed. The
+        profile id comes back in the X-Profile-Id response header.
+        """
+        profiler = get_request_profiler()
+        if not profiler.try_begin(request.url.path, request.headers.get(PROFILE_HEADER)):
+            return await call_next(request)
+        profile_id = new_profile_id()
+        sampler = StackSampler().start()
+        try:
+            response = await call_next(request)
+        finally:
+            sampler.stop()
+            try:
+                await run_in_threadpool(sampler.write, profile_path(profile_id))
+                profiler.last = {"id": profile_id, "path": request.url.path, "samples": sampler.samples,
+                                 "elapsed_ms": round(sampler.elapsed * 1000, 1),
+                                 "top_functions": sampler.top_functions()}
+            finally:
+                profiler.end()
+        logger.info("Profiled %s %s", request.method, request.url.path,
+                    extra={"profile_id": profile_id, "samples": sampler.samples})
+        response.headers["X-Profile-Id"] = profile_id
+        return response
+
+@app.middleware("http")
+async def correlation_id_middleware(request: Request, call_next):
+    """
+    Tags everything logged while handling a request with one id: the
+    caller's X-Request-ID if sent, else a new one. Echoed in the response.
+    """
+    request_id = request.headers.get("X-Request-ID") or new_request_id()
+    token = request_id_var.set(request_id)
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+        response.headers["X-Request-ID"] = request_id
+        logger.info("%s %s %s", request.method, request.url.path, response.status_code,
+                    extra={"duration_ms": round((time.perf_counter() - start) * 1000, 1)})
+        return response
+    finally:
+        request_id_var.reset(token)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -29,15 +101,35 @@ app.add_middleware(
 )
 
 # --- CRITICAL: Include your API routers here, BEFORE any generic routes or other potentially conflicting routers ---
-app.include_router(upload_router, prefix="/api")
+# Routers are imported per role so an api replica never loads backend.core.ocr's dependencies.
+if APP_ROLE in ("ocr-worker", "all"):
+    from backend.api.upload import router as upload_router
+    from backend.api.reprocess import router as reprocess_router
+    app.include_router(upload_router, prefix="/api")
+    app.include_router(reprocess_router, prefix="/api")
+if APP_ROLE in ("api", "all"):
+    from backend.api.receipts import router as receipts_router
+    app.include_router(receipts_router, prefix="/api")
+from backend.api.ocr_jobs import router as ocr_jobs_router
+app.include_router(ocr_jobs_router, prefix="/api")
+if PROFILING_ENABLED:
+    from backend.api.debug import router as debug_router
+    app.include_router(debug_router)
 
 
 @app.on_event("startup")
 async def startup_event():
     init_db()
-    print("FastAPI application startup: Database initialized.")
+    # Receipt writes only append sketch deltas; fold them into the sketches in the background
+    from backend.core.aggregates import start_folding
+    start_folding()
+    if APP_ROLE == "ocr-worker":
+        # Pay the OCR import cost once at boot instead of on the first upload
+        from backend.core.ocr import load_ocr_dependencies
+        load_ocr_dependencies()
+    logger.info("FastAPI application startup (%s role): Database initialized.", APP_ROLE)
 
 # This is a very general root route. It's usually fine if other routes are prefixed properly.
 @app.get("/")
 def read_root():
-    return {"message": "Receipt Bill Analyzer Backend is running!"}
\ No newline at end of file
+    return {"message": "Receipt Bill Analyzer Backend is running!", "role": APP_ROLE}
\ No newline at end of file
@@ -0,0 +1,51 @@
+# backend/scripts/bench_pdf_text_layer.py
+"""
+Compares PDF text extraction with the embedded-text fast path against
+rasterising and OCR'ing every page, per file.
+
+Usage (from the repository root):
+    python -m backend.scripts.bench_pdf_text_layer [PDF ...] [--runs 3]
+
+With no files given, every PDF in backend/uploads is measured.
+"""
+import argparse
+import glob
+import os
+import time
+
+from backend.core.ocr import ocr_pdf_pages
+
+
+def _time(file_path, use_text_layer, runs):
+    best, pages = None, []
+    for _ in range(runs):
+        start = time.perf_counter()
+        pages = ocr_pdf_pages(file_path, use_text_layer=use_text_layer)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, pages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="*", help="PDF files to measure")
+    parser.add_argument("--runs", type=int, default=3, help="Runs per mode; the fastest is reported")
+    args = parser.parse_args()
+
+    files = args.files or sorted(glob.glob(os.path.join("backend", "uploads", "*.pdf")))
+    if not files:
+        print("No PDF files found.")
+        return
+
+    print(f"{'file':<50}{'pages':>6}{'text layer':>11}{'fast (s)':>10}{'raster (s)':>12}{'speedup':>9}")
+    for file_path in files:
+        fast, pages = _time(file_path, True, args.runs)
+        slow, _ = _time(file_path, False, args.runs)
+        text_pages = sum(1 for p in pages if p["method"] == "text_layer")
+        speedup = slow / fast if fast else float("inf")
+        print(f"{os.path.basename(file_path)[:49]:<50}{len(pages):>6}{text_pages:>11}"
+              f"{fast:>10.2f}{slow:>12.2f}{speedup:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
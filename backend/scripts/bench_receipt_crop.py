@@ -0,0 +1,98 @@
+# backend/scripts/bench_receipt_crop.py
+"""
+Compares OCR on the raw photo against OCR on the detected, cropped,
+deskewed and downscaled receipt (backend.core.ocr.prepare_receipt_image):
+latency, pixels sent to tesseract, and which parsed fields were found.
+
+Usage (from the repository root):
+    python -m backend.scripts.bench_receipt_crop [IMAGE ...] [--runs 3] [--truth truth.json]
+
+With no files given, every JPEG/PNG in backend/uploads is measured.
+--truth is an optional JSON object mapping file name to expected fields,
+e.g. {"1.jpg": {"vendor": "TRADER JOE'S", "amount": 38.68, "date": "2014-06-28"}};
+with it, field accuracy is reported per mode instead of fields found.
+"""
+import argparse
+import glob
+import json
+import os
+import time
+
+from backend.core.ocr import ocr_image, parse_receipt_text, prepare_receipt_image
+
+FIELDS = ("vendor", "date", "amount")
+
+
+def _time(file_path, prepare, runs):
+    best, text = None, ""
+    for _ in range(runs):
+        start = time.perf_counter()
+        text = ocr_image(file_path, prepare=prepare)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, parse_receipt_text(text)
+
+
+def _score(parsed, expected):
+    if expected is None:
+        return sum(1 for field in FIELDS if parsed.get(field))
+    score = 0
+    for field in FIELDS:
+        want, got = expected.get(field), parsed.get(field)
+        if field == "vendor" and want and got:
+            score += want.strip().lower() in got.lower()
+        elif field == "amount" and want is not None and got is not None:
+            score += abs(float(got) - float(want)) < 0.005
+        else:
+            score += want == got
+    return score
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="*", help="Image files to measure")
+    parser.add_argument("--runs", type=int, default=3, help="Runs per mode; the fastest is reported")
+    parser.add_argument("--truth", help="JSON file of expected fields per file name")
+    args = parser.parse_args()
+
+    files = args.files or sorted(
+        f for pattern in ("*.jpg", "*.JPG", "*.jpeg", "*.png")
+        for f in glob.glob(os.path.join("backend", "uploads", pattern))
+    )
+    if not files:
+        print("No image files found.")
+        return
+    truth = None
+    if args.truth:
+        with open(args.truth, "r", encoding="utf-8") as f:
+            truth = json.load(f)
+
+    from PIL import Image
+
+    label = "correct" if truth else "found"
+    print(f"{'file':<30}{'raw MP':>8}{'prep MP':>9}{'raw (s)':>9}{'prep (s)':>10}"
+          f"{'speedup':>9}{'raw ' + label:>12}{'prep ' + label:>13}")
+    totals = [0.0, 0.0, 0, 0]
+    for file_path in files:
+        with Image.open(file_path) as image:
+            raw_mp = image.size[0] * image.size[1] / 1_000_000
+        prepared = prepare_receipt_image(file_path)
+        prep_mp = prepared.size / 1_000_000 if prepared is not None else raw_mp
+
+        raw_s, raw_fields = _time(file_path, False, args.runs)
+        prep_s, prep_fields = _time(file_path, True, args.runs)
+        expected = truth.get(os.path.basename(file_path), {}) if truth is not None else None
+        raw_score, prep_score = _score(raw_fields, expected), _score(prep_fields, expected)
+        totals = [totals[0] + raw_s, totals[1] + prep_s, totals[2] + raw_score, totals[3] + prep_score]
+
+        speedup = raw_s / prep_s if prep_s else float("inf")
+        print(f"{os.path.basename(file_path)[:29]:<30}{raw_mp:>8.2f}{prep_mp:>9.2f}{raw_s:>9.2f}{prep_s:>10.2f}"
+              f"{speedup:>8.1f}x{raw_score:>10}/{len(FIELDS)}{prep_score:>11}/{len(FIELDS)}")
+
+    possible = len(FIELDS) * len(files)
+    print(f"\nTotal: raw {totals[0]:.2f}s, prepared {totals[1]:.2f}s; "
+          f"fields {label}: raw {totals[2]}/{possible}, prepared {totals[3]}/{possible}")
+
+
+if __name__ == "__main__":
+    main()
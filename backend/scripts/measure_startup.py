@@ -0,0 +1,69 @@
+# backend/scripts/measure_startup.py
+"""
+Measures import time and resident memory of backend.main for each APP_ROLE.
+Every role is measured in a fresh interpreter so module caches don't leak
+between runs.
+
+Usage (from the repository root):
+    python -m backend.scripts.measure_startup [--runs 5]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROLES = ["api", "ocr-worker", "all"]
+
+# Runs inside the child interpreter. For the ocr-worker role the startup
+# hook's eager OCR import is included, since that's what the replica pays.
+_CHILD = """
+import json, resource, sys, time
+start = time.perf_counter()
+import backend.main as main
+if main.APP_ROLE == "ocr-worker":
+    from backend.core.ocr import load_ocr_dependencies
+    load_ocr_dependencies()
+elapsed = time.perf_counter() - start
+heavy = [m for m in ("cv2", "numpy", "pytesseract", "PIL", "pdf2image") if m in sys.modules]
+print(json.dumps({
+    "import_seconds": elapsed,
+    "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "modules": len(sys.modules),
+    "ocr_modules_loaded": heavy,
+}))
+"""
+
+
+def measure(role, runs):
+    samples = []
+    for _ in range(runs):
+        env = dict(os.environ, APP_ROLE=role)
+        out = subprocess.run(
+            [sys.executable, "-c", _CHILD], env=env, capture_output=True, text=True, check=True
+        ).stdout
+        samples.append(json.loads(out.strip().splitlines()[-1]))
+    seconds = sorted(s["import_seconds"] for s in samples)
+    return {
+        "role": role,
+        "median_import_ms": seconds[len(seconds) // 2] * 1000,
+        "max_rss_mb": max(s["max_rss_mb"] for s in samples),
+        "modules": samples[-1]["modules"],
+        "ocr_modules_loaded": samples[-1]["ocr_modules_loaded"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="Interpreter launches per role")
+    args = parser.parse_args()
+
+    print(f"{'role':<12}{'import (ms)':>14}{'max RSS (MB)':>15}{'modules':>10}  OCR modules loaded")
+    for role in ROLES:
+        r = measure(role, args.runs)
+        print(f"{r['role']:<12}{r['median_import_ms']:>14.1f}{r['max_rss_mb']:>15.1f}{r['modules']:>10}  "
+              f"{', '.join(r['ocr_modules_loaded']) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
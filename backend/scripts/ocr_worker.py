@@ -0,0 +1,72 @@
+# backend/scripts/ocr_worker.py
+"""
+OCR worker entry point: claims uploads queued through /api/ocr-jobs and
+runs OCR, parsing and the database write for each. Run as many of these
+as there are cores to spare, on any machine that shares the database and
+the upload volume.
+
+Usage (from the repository root):
+    python -m backend.scripts.ocr_worker [--processes 4] [--burst] [--profile]
+
+--profile samples each worker's stacks (every PROFILE_WORKER_INTERVAL
+seconds, 20 ms by default) into PROFILE_DIR/ocr-worker-<host>-<pid>.folded,
+rewritten every minute; feed it to flamegraph.pl or speedscope.
+
+SIGINT / SIGTERM stop the worker after the job in progress.
+"""
+import argparse
+import multiprocessing
+import signal
+import threading
+
+from backend.db.database import engine, init_db
+
+
+def _worker_main(burst, profile=False):
+    from backend.core.jobs import run_worker
+    from backend.core.logs import configure_logging
+    from backend.core.ocr import load_ocr_dependencies
+
+    # Connections inherited from the parent process must not be reused after fork
+    engine.dispose(close=False)
+    configure_logging()
+    load_ocr_dependencies()
+    stop_event = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop_event.set())
+    profiler = None
+    if profile:
+        from backend.core.profiling import WorkerProfiler
+        profiler = WorkerProfiler().start()
+    try:
+        run_worker(stop_event=stop_event, burst=burst)
+    finally:
+        if profiler is not None:
+            profiler.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, default=1, help="Worker processes to run on this machine")
+    parser.add_argument("--burst", action="store_true", help="Exit once the queue is empty")
+    parser.add_argument("--profile", action="store_true", help="Write a sampling profile per worker process")
+    args = parser.parse_args()
+
+    init_db()
+    if args.processes == 1:
+        _worker_main(args.burst, args.profile)
+        return
+
+    workers = [multiprocessing.Process(target=_worker_main, args=(args.burst, args.profile)) for _ in range(args.processes)]
+    for worker in workers:
+        worker.start()
+    # Ctrl-C reaches the children directly (same process group); SIGTERM is
+    # forwarded. Either way each child finishes its current job, then exits.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda *_: [w.terminate() for w in workers if w.is_alive()])
+    for worker in workers:
+        worker.join()
+
+
+if __name__ == "__main__":
+    main()
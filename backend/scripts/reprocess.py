@@ -0,0 +1,55 @@
+# backend/scripts/reprocess.py
+"""
+Command-line entry point for bulk reprocessing, for backfills too large to
+run inside the API process.
+
+Usage (from the repository root):
+    python -m backend.scripts.reprocess --workers 4 [--rerun-ocr] [--batch-size 500]
+    python -m backend.scripts.reprocess --resume JOB_ID
+"""
+import argparse
+import sys
+
+from backend.core.reprocess import run_job
+from backend.db import crud
+from backend.db.database import SessionLocal, init_db
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes (one id-range shard each)")
+    parser.add_argument("--batch-size", type=int, default=500, help="Receipts read and written per batch")
+    parser.add_argument("--rerun-ocr", action="store_true", help="Re-run OCR instead of using stored OCR text")
+    parser.add_argument("--resume", type=int, metavar="JOB_ID", help="Resume an existing job from its checkpoints")
+    args = parser.parse_args()
+
+    init_db()
+    db = SessionLocal()
+    try:
+        if args.resume:
+            job = crud.get_reprocess_job(db, args.resume)
+            if not job:
+                sys.exit(f"Reprocess job {args.resume} not found")
+        else:
+            job = crud.create_reprocess_job(db, workers=args.workers, batch_size=args.batch_size,
+                                            rerun_ocr=args.rerun_ocr)
+        job_id = job.id
+    finally:
+        db.close()
+
+    print(f"Running reprocess job {job_id}...")
+    run_job(job_id)
+
+    db = SessionLocal()
+    try:
+        progress = crud.get_reprocess_progress(db, crud.get_reprocess_job(db, job_id))
+    finally:
+        db.close()
+    print(f"Job {job_id} {progress['status']}: processed={progress['processed']} updated={progress['updated']} "
+          f"skipped={progress['skipped']} failed={progress['failed']}")
+    if progress["error"]:
+        print(f"Errors: {progress['error']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# backend/scripts/storage_lifecycle.py
+"""
+Runs the storage lifecycle (see backend/core/lifecycle.py): recompresses
+originals after OCR, applies the retention policy and collects orphaned
+files. Without a step flag every step runs. Orphans are only reported
+unless --delete-orphans is given.
+
+Run a single instance per upload volume. An interrupted orphan collection
+resumes from its checkpoint the next time the collector runs.
+
+Usage (from the repository root):
+    python -m backend.scripts.storage_lifecycle [--recompress] [--retention] [--gc] [--delete-orphans]
+    python -m backend.scripts.storage_lifecycle --interval 3600 --delete-orphans
+"""
+import argparse
+import logging
+import time
+
+from backend.core import lifecycle
+from backend.core.logs import configure_logging
+from backend.db import crud
+from backend.db.database import SessionLocal, init_db
+
+logger = logging.getLogger(__name__)
+
+
+def report_gc_run(run_id):
+    db = SessionLocal()
+    try:
+        run = crud.get_storage_gc_run(db, run_id)
+        print(f"GC run {run.id} {run.status}: files_scanned={run.files_scanned} orphan_files={run.orphan_files} "
+              f"orphan_bytes={run.orphan_bytes} removed_files={run.removed_files} "
+              f"receipts_scanned={run.receipts_scanned} missing_files={run.missing_files}")
+        if run.missing_files:
+            print(f"Receipts with missing files (sample): {run.missing_receipt_ids}")
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--recompress", action="store_true", help="Recompress originals whose OCR has run")
+    parser.add_argument("--retention", action="store_true", help="Remove originals past RETENTION_ORIGINALS_DAYS")
+    parser.add_argument("--gc", action="store_true", help="Reconcile files on disk with the database")
+    parser.add_argument("--delete-orphans", action="store_true", help="Remove orphaned files instead of reporting them")
+    parser.add_argument("--interval", type=float, metavar="SECONDS",
+                        help="Keep running, starting a pass every SECONDS")
+    args = parser.parse_args()
+    run_all = not (args.recompress or args.retention or args.gc)
+
+    configure_logging()
+    init_db()
+    while True:
+        started = time.monotonic()
+        try:
+            results = lifecycle.run_lifecycle(recompress=run_all or args.recompress,
+                                              retention=run_all or args.retention,
+                                              gc=run_all or args.gc,
+                                              delete_orphans=args.delete_orphans)
+        except Exception:
+            if args.interval is None:
+                raise
+            logger.exception("Storage lifecycle pass failed; retrying at the next interval")
+        else:
+            print(f"Expired upload sessions removed: {results['expired_sessions']}")
+            print(f"Released blobs: {results['released_blobs']}")
+            if "recompression" in results:
+                print(f"Recompression: {results['recompression']}")
+            if "retention" in results:
+                print(f"Retention: {results['retention']}")
+            if "gc_run_id" in results:
+                report_gc_run(results["gc_run_id"])
+        if args.interval is None:
+            break
+        time.sleep(max(0.0, args.interval - (time.monotonic() - started)))
+
+
+if __name__ == "__main__":
+    main()
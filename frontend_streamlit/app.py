@@ -3,11 +3,18 @@ import streamlit as st
 import requests
 import pandas as pd
 import datetime
+import hashlib
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # --- Configuration ---
 # Ensure this matches your FastAPI backend's running URL
 BACKEND_URL = os.getenv("BACKEND_URL", "http://127.0.0.1:8000")
+# Files larger than this are uploaded in concurrent, resumable chunks
+CHUNKED_UPLOAD_THRESHOLD = 8 * 1024 * 1024
+CHUNK_UPLOAD_WORKERS = 4
+CHUNK_UPLOAD_RETRIES = 3
 
 st.set_page_config(
     page_title="Receipt & Bill Analyzer",
@@ -189,24 +196,16 @@ def fetch_all_receipts():
         response = requests.get(f"{BACKEND_URL}/api/receipts")
         response.raise_for_status() # Raise an exception for HTTP errors
         receipts_data = response.json()
-        # Convert date strings to datetime.date objects for Streamlit's table/charting
-        for r in receipts_data:
-            if r.get('transaction_date'):
-                # Handle potential different date formats during parsing
-                try:
-                    r['transaction_date'] = datetime.date.fromisoformat(r['transaction_date'])
-                except (ValueError, TypeError):
-                    # Fallback for other common formats, e.g., MM/DD/YYYY
-                    try:
-                        r['transaction_date'] = datetime.datetime.strptime(r['transaction_date'], '%m/%d/%Y').date()
-                    except (ValueError, TypeError):
-                        r['transaction_date'] = None # If still unparseable, set to None
-            if r.get('created_at'):
-                try:
-                    # The created_at field might include time, so parse as datetime first
-                    r['created_at'] = datetime.datetime.fromisoformat(r['created_at'].replace("Z", "+00:00")).date()
-                except (ValueError, TypeError):
-                    r['created_at'] = None
+        if not receipts_data:
+            return []
+        # The backend normalises dates to ISO (YYYY-MM-DD), so convert whole columns at once
+        # with pandas instead of re-parsing each value in a Python loop.
+        df = pd.DataFrame(receipts_data)
+        for col in ('transaction_date', 'created_at'):
+            if col in df.columns:
+                dates = pd.to_datetime(df[col], format='%Y-%m-%d', errors='coerce')
+                df[col] = dates.dt.date.astype(object).where(dates.notna(), None)
+        receipts_data = df.astype(object).where(df.notna(), None).to_dict('records')
         return receipts_data
     except requests.exceptions.ConnectionError:
         st.error("🚨 Cannot connect to backend. Please ensure your FastAPI server is running.", icon="‼️")
@@ -216,6 +215,106 @@ def fetch_all_receipts():
         st.error(f"⚠️ Error fetching receipts: {error_detail}", icon="⚠️")
         return []
 
+@st.cache_data(ttl=60)
+def fetch_receipt_summary():
+    """Receipt count, date bounds and highest id, without fetching any receipts."""
+    try:
+        response = requests.get(f"{BACKEND_URL}/api/receipts/summary")
+        response.raise_for_status()
+        summary = response.json()
+        for key in ('min_date', 'max_date'):
+            if summary.get(key):
+                summary[key] = datetime.date.fromisoformat(summary[key])
+        return summary
+    except requests.exceptions.ConnectionError:
+        st.error("🚨 Cannot connect to backend. Please ensure your FastAPI server is running.", icon="‼️")
+        return None
+    except requests.exceptions.RequestException as e:
+        error_detail = e.response.json().get('detail', str(e)) if e.response else str(e)
+        st.error(f"⚠️ Error fetching receipt summary: {error_detail}", icon="⚠️")
+        return None
+
+# Pages are cached per cursor, so paging back and forth never refetches. `data_version`
+# (count and highest id from the summary) changes on uploads and deletes, retiring stale pages.
+@st.cache_data(ttl=600, max_entries=500, show_spinner=False)
+def fetch_receipt_page(sort_by, sort_order, cursor, page_size, data_version):
+    """One page of the receipt grid, sorted by the backend: (DataFrame, next page cursor)."""
+    params = {"sort_by": sort_by, "sort_order": sort_order, "limit": page_size}
+    if cursor:
+        params["cursor"] = cursor
+    response = requests.get(f"{BACKEND_URL}/api/receipts/page", params=params)
+    response.raise_for_status()
+    page = response.json()
+    df = pd.DataFrame(page['items'])
+    for col in ('transaction_date', 'created_at'):
+        if col in df.columns:
+            dates = pd.to_datetime(df[col], format='%Y-%m-%d', errors='coerce')
+            df[col] = dates.dt.date.astype(object).where(dates.notna(), None)
+    return df, page['next_cursor']
+
+def _put_chunk(session_id, data, offset, chunk_size):
+    """Sends one chunk, retrying with backoff; chunk PUTs are idempotent. Returns its length."""
+    chunk = data[offset:offset + chunk_size]
+    headers = {"Content-Type": "application/octet-stream", "X-Chunk-SHA256": hashlib.sha256(chunk).hexdigest()}
+    for attempt in range(CHUNK_UPLOAD_RETRIES):
+        try:
+            response = requests.put(f"{BACKEND_URL}/api/uploads/{session_id}", params={"offset": offset},
+                                    data=chunk, headers=headers, timeout=120)
+            response.raise_for_status()
+            return len(chunk)
+        except requests.exceptions.RequestException:
+            if attempt == CHUNK_UPLOAD_RETRIES - 1:
+                raise
+            time.sleep(2 ** attempt)
+
+def upload_in_chunks(uploaded_file, progress):
+    """
+    Uploads a file through a resumable upload session, CHUNK_UPLOAD_WORKERS
+    chunks at a time, and returns the processed upload. The session is
+    remembered per file, so retrying after a failure only sends the chunks
+    the backend doesn't have yet.
+    """
+    data = uploaded_file.getvalue()
+    digest = hashlib.sha256(data).hexdigest()
+    sessions = st.session_state.setdefault('upload_sessions', {})
+    status = None
+    if digest in sessions:
+        response = requests.get(f"{BACKEND_URL}/api/uploads/{sessions[digest]}")
+        if response.ok:
+            status = response.json()
+    if status is None:
+        response = requests.post(f"{BACKEND_URL}/api/uploads", json={
+            "filename": uploaded_file.name, "size": len(data), "content_type": uploaded_file.type, "sha256": digest
+        })
+        response.raise_for_status()
+        status = response.json()
+        sessions[digest] = status['session_id']
+
+    session_id, chunk_size = status['session_id'], status['chunk_size']
+    total_mb = len(data) / 2**20
+    sent = status['bytes_received']
+    progress.progress(sent / len(data), text=f"Uploading... {sent / 2**20:.1f} of {total_mb:.1f} MB")
+    with ThreadPoolExecutor(max_workers=CHUNK_UPLOAD_WORKERS) as pool:
+        futures = [pool.submit(_put_chunk, session_id, data, index * chunk_size, chunk_size)
+                   for index in status['missing_chunks']]
+        for future in as_completed(futures):
+            sent += future.result()
+            progress.progress(min(sent / len(data), 1.0), text=f"Uploading... {sent / 2**20:.1f} of {total_mb:.1f} MB")
+
+    progress.progress(1.0, text="Processing...")
+    response = requests.post(f"{BACKEND_URL}/api/uploads/{session_id}/complete")
+    response.raise_for_status()
+    del sessions[digest]
+    return response.json()
+
+def clear_receipt_caches():
+    fetch_all_receipts.clear()
+    fetch_receipt_summary.clear()
+    fetch_receipt_page.clear()
+
+def move_grid_page(step):
+    st.session_state.grid_page = max(0, st.session_state.grid_page + step)
+
 # --- Main App Structure ---
 
 st.title("📈 Receipt & Bill Analyzer")
@@ -246,19 +345,25 @@ if app_mode == "Upload & View Receipts":
         uploaded_file = st.file_uploader(
             "Choose an image (.jpg, .png), PDF, or text file",
             type=["jpg", "jpeg", "png", "pdf", "txt"],
-            help="Supported formats: JPG, PNG, PDF, TXT. Max file size: 25MB."
+            help="Supported formats: JPG, PNG, PDF, TXT. Files over 8MB are sent in resumable chunks."
         )
 
         if uploaded_file is not None:
             # Button to process the file and show the correction form
             if st.button("Process File for Correction", key="process_button"):
                 with st.spinner("Uploading and processing file... This may take a moment."):
-                    files = {'file': (uploaded_file.name, uploaded_file.getvalue(), uploaded_file.type)}
                     try:
-                        # This endpoint saves an initial record and returns the data
-                        response = requests.post(f"{BACKEND_URL}/api/upload", files=files)
-                        response.raise_for_status()
-                        st.session_state.last_upload_response = response.json()
+                        if uploaded_file.size > CHUNKED_UPLOAD_THRESHOLD:
+                            # Large scans go in resumable chunks; pressing the button again resumes
+                            progress = st.progress(0.0, text="Uploading...")
+                            st.session_state.last_upload_response = upload_in_chunks(uploaded_file, progress)
+                        else:
+                            # This endpoint saves an initial record and returns the data
+                            files = {'file': (uploaded_file.name, uploaded_file.getvalue(), uploaded_file.type)}
+                            response = requests.post(f"{BACKEND_URL}/api/upload", files=files)
+                            response.raise_for_status()
+                            st.session_state.last_upload_response = response.json()
+                        clear_receipt_caches()
                         st.toast("File processed. Correct fields below if needed.", icon="✍️")
                         st.rerun() # Rerun to show the correction form immediately
                     except requests.exceptions.ConnectionError:
@@ -316,7 +421,7 @@ if app_mode == "Upload & View Receipts":
                             st.success(f"🎉 Receipt ID {record_id} updated successfully!", icon="✅")
                             
                             st.session_state.last_upload_response = None
-                            fetch_all_receipts.clear()
+                            clear_receipt_caches()
                             st.rerun()
                         except requests.exceptions.RequestException as e:
                             error_detail = e.response.json().get('detail', str(e)) if e.response else str(e)
@@ -327,10 +432,35 @@ if app_mode == "Upload & View Receipts":
     st.write("---")
     st.subheader("🧾 All Uploaded Receipts")
 
-    receipts = fetch_all_receipts()
+    summary = fetch_receipt_summary()
+
+    if summary and summary['count']:
+        # Sorting and paging happen on the backend; only the visible page is fetched
+        grid_sort_options = {"Newest Upload": "id", "Date": "date", "Amount": "amount", "Vendor": "vendor"}
+        col_sort, col_order, col_size = st.columns(3)
+        grid_sort_by = grid_sort_options[col_sort.selectbox("Sort By", options=list(grid_sort_options), key="grid_sort_by")]
+        grid_sort_order = col_order.radio("Sort Order", options=["desc", "asc"], horizontal=True, key="grid_sort_order")
+        page_size = col_size.selectbox("Rows per Page", options=[25, 50, 100, 200], index=1, key="grid_page_size")
+
+        data_version = f"{summary['count']}:{summary['max_id']}"
+        grid_key = (grid_sort_by, grid_sort_order, page_size, data_version)
+        if st.session_state.get('grid_key') != grid_key:
+            # A new order or new data: page cursors are only valid for the order they were issued in
+            st.session_state.grid_key = grid_key
+            st.session_state.grid_cursors = [None]
+            st.session_state.grid_page = 0
+        cursors = st.session_state.grid_cursors
+        page_number = min(st.session_state.grid_page, len(cursors) - 1)
+
+        try:
+            df, next_cursor = fetch_receipt_page(grid_sort_by, grid_sort_order, cursors[page_number], page_size, data_version)
+        except requests.exceptions.RequestException as e:
+            error_detail = e.response.json().get('detail', str(e)) if e.response is not None else str(e)
+            st.error(f"⚠️ Error fetching receipts: {error_detail}", icon="⚠️")
+            df, next_cursor = pd.DataFrame(), None
+        if next_cursor and len(cursors) == page_number + 1:
+            cursors.append(next_cursor)
 
-    if receipts:
-        df = pd.DataFrame(receipts)
         # Reorder columns for better presentation
         display_columns = [
             "id", "vendor", "transaction_date", "amount",
@@ -341,11 +471,18 @@ if app_mode == "Upload & View Receipts":
             if col not in df.columns:
                 df[col] = None
 
-        df_display = df[display_columns].copy() # Use .copy() to prevent SettingWithCopyWarning
+        st.dataframe(df[display_columns], use_container_width=True, hide_index=True)
 
-        st.dataframe(df_display, use_container_width=True, hide_index=True)
+        total_pages = max(1, -(-summary['count'] // page_size))
+        col_prev, col_info, col_next = st.columns([1, 2, 1])
+        col_prev.button("◀ Previous", on_click=move_grid_page, args=(-1,), disabled=page_number == 0,
+                        key="grid_prev", use_container_width=True)
+        col_info.markdown(f"<p style='text-align: center;'>Page {page_number + 1:,} of {total_pages:,} "
+                          f"· {summary['count']:,} receipts</p>", unsafe_allow_html=True)
+        col_next.button("Next ▶", on_click=move_grid_page, args=(1,), disabled=next_cursor is None,
+                        key="grid_next", use_container_width=True)
 
-    else: # This branch means receipts list is empty
+    elif summary is not None: # No receipts stored yet
         st.info("No receipts uploaded yet. Use the 'Upload New File' section above!")
 
 
@@ -439,12 +576,9 @@ elif app_mode == "Search & Filter":
         max_amount = col_amount2.number_input("Maximum Amount", min_value=0.0, value=999999.99, format="%.2f")
 
         st.subheader("Date Range")
-        all_receipts_for_dates = fetch_all_receipts()
-        min_db_date, max_db_date = None, None
-        if all_receipts_for_dates:
-            dates = [r['transaction_date'] for r in all_receipts_for_dates if isinstance(r.get('transaction_date'), datetime.date)]
-            if dates:
-                min_db_date, max_db_date = min(dates), max(dates)
+        # Date bounds come from the summary endpoint rather than from fetching receipts
+        summary = fetch_receipt_summary() or {}
+        min_db_date, max_db_date = summary.get('min_date'), summary.get('max_date')
 
         col_date1, col_date2 = st.columns(2)
         start_date = col_date1.date_input("Start Date", value=min_db_date, min_value=min_db_date, max_value=max_db_date)
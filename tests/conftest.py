@@ -0,0 +1,26 @@
+import os
+import tempfile
+
+import pytest
+
+# The backend reads its database and storage locations at import time, so
+# point them at a scratch directory before any test module imports it.
+_SCRATCH = tempfile.mkdtemp(prefix="receipt-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_SCRATCH, 'receipts.db')}")
+os.environ.setdefault("UPLOAD_STORAGE_DIR", os.path.join(_SCRATCH, "uploads"))
+os.environ.setdefault("AGGREGATE_FOLD_INTERVAL", "0")
+
+
+@pytest.fixture
+def db():
+    """A session on freshly created tables, dropped again after the test."""
+    from backend.db.database import SessionLocal, engine
+    from backend.db.models import Base
+
+    Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+        Base.metadata.drop_all(bind=engine)
@@ -0,0 +1,102 @@
+import io
+import os
+
+from backend.core.cleanup import remove_blob_files, remove_released_files
+from backend.core.storage import get_storage
+from backend.db import crud
+
+
+def _store(content):
+    return get_storage().save(io.BytesIO(content))
+
+
+def test_acquire_and_release_refcount(db):
+    blob = _store(b"receipt one")
+    crud.acquire_blob(db, blob.digest, blob.path, blob.size)
+    crud.acquire_blob(db, blob.digest, blob.path, blob.size)
+    db.commit()
+    assert crud.get_blob(db, blob.digest).refcount == 2
+
+    assert crud.release_blob(db, blob.digest) is False
+    db.commit()
+    row = crud.get_blob(db, blob.digest)
+    db.refresh(row)
+    assert row.refcount == 1 and row.released_at is None
+
+    assert crud.release_blob(db, blob.digest) is True
+    db.commit()
+    db.refresh(row)
+    assert row.refcount == 0 and row.released_at is not None
+    assert crud.released_blob_digests(db, [blob.digest]) == {blob.digest}
+
+
+def test_acquire_clears_release_mark(db):
+    blob = _store(b"receipt two")
+    crud.acquire_blob(db, blob.digest, blob.path, blob.size)
+    db.commit()
+    crud.release_blob(db, blob.digest)
+    db.commit()
+    crud.acquire_blob(db, blob.digest, blob.path, blob.size)
+    db.commit()
+    row = crud.get_blob(db, blob.digest)
+    db.refresh(row)
+    assert row.refcount == 1 and row.released_at is None
+    assert crud.released_blob_digests(db, [blob.digest]) == set()
+
+
+def test_release_blobs_counts_repeated_digests(db):
+    shared, single = _store(b"shared"), _store(b"single")
+    for blob in (shared, shared, shared, single):
+        crud.acquire_blob(db, blob.digest, blob.path, blob.size)
+    db.commit()
+    released = crud.release_blobs(db, [shared.digest, shared.digest, single.digest])
+    db.commit()
+    assert released == [single.digest]
+    assert crud.get_blob(db, shared.digest).refcount == 1
+
+
+def test_remove_released_files(db):
+    blob = _store(b"receipt three")
+    crud.acquire_blob(db, blob.digest, blob.path, blob.size)
+    db.commit()
+    crud.release_blob(db, blob.digest)
+    db.commit()
+
+    counts = remove_released_files([blob.digest])
+    assert counts["removed"] == 1
+    assert not os.path.exists(blob.path)
+    db.expire_all()
+    assert crud.get_blob(db, blob.digest) is None
+
+
+def test_remove_keeps_reacquired_blob(db):
+    blob = _store(b"receipt four")
+    crud.acquire_blob(db, blob.digest, blob.path, blob.size)
+    db.commit()
+    crud.release_blob(db, blob.digest)
+    db.commit()
+    crud.acquire_blob(db, blob.digest, blob.path, blob.size)
+    db.commit()
+
+    counts = remove_released_files([blob.digest])
+    assert counts["kept"] == 1 and counts["removed"] == 0
+    assert os.path.exists(blob.path)
+    db.expire_all()
+    assert crud.get_blob(db, blob.digest).refcount == 1
+
+
+def test_file_put_back_when_referenced_while_set_aside(db):
+    blob = _store(b"receipt five")
+    checks = []
+
+    def still_unused(db, digests):
+        # Unused at the first check, referenced again by the second one
+        checks.append(list(digests))
+        return set(digests) if len(checks) == 1 else set()
+
+    counts = {"removed": 0, "kept": 0, "missing": 0, "failed": 0}
+    gone = remove_blob_files(db, [blob.digest], still_unused, counts)
+    assert gone == [] and counts["kept"] == 1
+    assert checks == [[blob.digest], [blob.digest]]
+    with open(blob.path, "rb") as f:
+        assert f.read() == b"receipt five"
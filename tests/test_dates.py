@@ -0,0 +1,61 @@
+import datetime
+
+import pytest
+
+from backend.core.dates import find_date, parse_date
+
+
+@pytest.mark.parametrize("line", [
+    "1 Decaf 12.50",
+    "3 Marlboro 20.00",
+    "2 MAYO 24.99",
+    "1 Octopus Salad 14.99",
+    "Qty 4 x 1.25 = 5.00",
+])
+def test_item_lines_are_not_dates(line):
+    assert find_date(line) == (None, None)
+
+
+def test_date_after_item_lines():
+    text = "1 Decaf 12.50\n2 MAYO 24.99\nDate: 15 Jun 2024"
+    assert find_date(text) == ("15 Jun 2024", datetime.date(2024, 6, 15))
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Date: 03.05.2024", datetime.date(2024, 5, 3)),
+    ("Paid 03.05.24 12:40", datetime.date(2024, 5, 3)),
+    ("31.12.2023", datetime.date(2023, 12, 31)),
+])
+def test_dotted_dates_are_day_first(text, expected):
+    assert find_date(text)[1] == expected
+
+
+def test_dotted_date_falls_back_to_month_first():
+    # No 30th month, so only MDY fits
+    assert find_date("12.30.24")[1] == datetime.date(2024, 12, 30)
+
+
+def test_slashed_dates_follow_date_order():
+    assert find_date("03/05/2024")[1] == datetime.date(2024, 3, 5)
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("2024-06-15", datetime.date(2024, 6, 15)),
+    ("15 Jun 2024", datetime.date(2024, 6, 15)),
+    ("June 15, 2024", datetime.date(2024, 6, 15)),
+    ("15-Jun-24", datetime.date(2024, 6, 15)),
+    ("Sept 1st 2023", datetime.date(2023, 9, 1)),
+])
+def test_parse_date_formats(value, expected):
+    assert parse_date(value) == expected
+
+
+@pytest.mark.parametrize("value", ["15 Decaf 2024", "15 Mayo 2024", "13/13/2024", "1 Jun 1850"])
+def test_parse_date_rejects(value):
+    assert parse_date(value) is None
+
+
+def test_vendor_order_is_remembered():
+    # 25/04 only parses day-first; the vendor's next ambiguous date follows suit
+    assert parse_date("25/04/2024", vendor="Test Bakery") == datetime.date(2024, 4, 25)
+    assert parse_date("03/05/2024", vendor="Test Bakery") == datetime.date(2024, 5, 3)
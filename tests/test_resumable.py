@@ -0,0 +1,117 @@
+import hashlib
+import os
+import time
+
+import pytest
+
+from backend.core.resumable import (
+    UPLOAD_MIN_CHUNK_SIZE, UploadSession, UploadSessionError, _FINALIZE_LOCK_STALE_SECONDS
+)
+
+CHUNK = UPLOAD_MIN_CHUNK_SIZE
+CONTENT = os.urandom(2 * CHUNK + CHUNK // 2)
+
+
+def _session(root, sha256=None):
+    return UploadSession.create("receipt.pdf", "application/pdf", len(CONTENT),
+                                chunk_size=CHUNK, sha256=sha256, root=str(root))
+
+
+def _chunk(index):
+    return CONTENT[index * CHUNK:(index + 1) * CHUNK]
+
+
+def _send_all(session):
+    for index in reversed(range(session.chunk_count)):
+        session.write_chunk(index, _chunk(index))
+
+
+def test_chunk_offsets(tmp_path):
+    session = _session(tmp_path)
+    assert session.chunk_count == 3
+    assert [session.chunk_index(offset) for offset in (0, CHUNK, 2 * CHUNK)] == [0, 1, 2]
+    assert session.chunk_length(2) == CHUNK // 2
+    for offset in (-CHUNK, 1, CHUNK + 1, 3 * CHUNK):
+        with pytest.raises(UploadSessionError):
+            session.chunk_index(offset)
+
+
+def test_write_chunk_checks_length_and_sha256(tmp_path):
+    session = _session(tmp_path)
+    with pytest.raises(UploadSessionError):
+        session.write_chunk(2, _chunk(1))  # the last chunk is shorter
+    with pytest.raises(UploadSessionError) as error:
+        session.write_chunk(0, _chunk(0), sha256="0" * 64)
+    assert error.value.status_code == 422
+    assert session.received() == []
+
+
+def test_chunks_in_any_order_and_resent(tmp_path):
+    session = _session(tmp_path)
+    assert session.write_chunk(2, _chunk(2)) is True
+    assert session.write_chunk(0, _chunk(0), sha256=hashlib.sha256(_chunk(0)).hexdigest()) is True
+    assert session.write_chunk(0, _chunk(0)) is False
+
+    reloaded = UploadSession.load(session.session_id, root=str(tmp_path))
+    assert reloaded.missing() == [1]
+    assert reloaded.status()["bytes_received"] == CHUNK + CHUNK // 2
+
+
+def test_finalize_with_missing_chunks_releases_lock(tmp_path):
+    session = _session(tmp_path)
+    session.write_chunk(0, _chunk(0))
+    with pytest.raises(UploadSessionError) as error:
+        session.begin_finalize()
+    assert error.value.status_code == 409
+    assert not os.path.exists(session.lock_path)
+
+
+def test_finalize_assembles_file(tmp_path):
+    session = _session(tmp_path, sha256=hashlib.sha256(CONTENT).hexdigest())
+    _send_all(session)
+    with session.begin_finalize() as stream:
+        assert stream.read() == CONTENT
+    session.end_finalize({"id": 7})
+
+    assert session.finished() and session.result() == {"id": 7}
+    assert not os.path.exists(session.data_path)
+    assert not os.path.exists(session.lock_path)
+    with pytest.raises(UploadSessionError) as error:
+        session.write_chunk(0, _chunk(0))
+    assert error.value.status_code == 409
+
+
+def test_finalize_checks_whole_file_sha256(tmp_path):
+    session = _session(tmp_path, sha256="0" * 64)
+    _send_all(session)
+    with pytest.raises(UploadSessionError) as error:
+        session.begin_finalize()
+    assert error.value.status_code == 422
+    assert not os.path.exists(session.lock_path)
+
+
+def test_concurrent_finalize_is_rejected(tmp_path):
+    session = _session(tmp_path)
+    _send_all(session)
+    stream = session.begin_finalize()
+    try:
+        with pytest.raises(UploadSessionError) as error:
+            UploadSession.load(session.session_id, root=str(tmp_path)).begin_finalize()
+        assert error.value.status_code == 409
+    finally:
+        stream.close()
+        session.end_finalize()
+    session.begin_finalize().close()  # free again once released
+
+
+def test_stale_finalize_lock_is_taken_over(tmp_path):
+    session = _session(tmp_path)
+    _send_all(session)
+    session.begin_finalize().close()  # a finalize that never ended
+    stale = time.time() - _FINALIZE_LOCK_STALE_SECONDS - 60
+    os.utime(session.lock_path, (stale, stale))
+
+    session.begin_finalize().close()
+    assert os.path.getmtime(session.lock_path) > stale
+    assert os.listdir(session.path).count("finalizing") == 1
+    assert not [name for name in os.listdir(session.path) if name.startswith("finalizing.")]